@@ -1,5 +1,7 @@
 import subprocess as sp
 import time, os, uuid, glob, re, stat
+import queue, threading, json, hashlib, shutil
+from collections import deque
 import networkx as nx
 
 class JobUtils:
@@ -13,8 +15,39 @@ cd {anadir}
 source ./setup.sh &> /dev/null
 """.format(anadir = os.getenv("ANALYSISDIR"), proxy_cert_location = os.getenv("X509_USER_PROXY")))
 
+    @staticmethod
+    def memory_in_MB(memory):
+        # memory requests are either plain numbers (in MB, as for Condor) or strings such as "10 GB"
+        if isinstance(memory, (int, float)):
+            return memory
+
+        match = re.match(r"\s*([0-9.]+)\s*([KMGT]?)B?\s*$", str(memory).upper())
+        if not match:
+            raise ValueError(f"Error: cannot interpret memory request '{memory}'")
+
+        return float(match.group(1)) * {"K": 1.0 / 1024, "": 1, "M": 1, "G": 1024, "T": 1024**2}[match.group(2)]
+
+    @staticmethod
+    def poll_completed(jobs, completed_jobs, poll_interval):
+        # for batch systems that cannot notify us: block until the status query
+        # reports at least one of the jobs as completed
+        while True:
+            completed = completed_jobs(jobs)
+            if completed or not jobs:
+                return completed
+            time.sleep(poll_interval)
+
 class Task:
 
+    # set this for tasks whose job generator needs the output of the prerequisites
+    # (e.g. reads the workspace), such that the jobs are only built once those are complete
+    generate_after_prerequisites = False
+
+    # files and directories that this task reads / produces; only tasks that declare
+    # their outputs can be restored from the ResultCache
+    inputs = []
+    outputs = []
+
     def __init__(self, taskname, job_generator, prerequisites = []):
         
         self.taskname = taskname
@@ -27,11 +60,30 @@ class Task:
         if self.jobs is None:
             self.jobs = self.job_generator()
 
+            for job in self.jobs:
+                job.taskname = self.taskname
+
         return self.jobs
 
     def can_start(self, tasks):
         return set(self.prerequisites).issubset(set(tasks))
 
+    def final_jobs(self):
+        # the jobs of this task that no other job of this task is waiting for
+        jobs = self.generate_jobs()
+        parents = set().union(*[job.get_parents(jobs) for job in jobs])
+        return [job for job in jobs if job not in parents]
+
+    def get_job_prerequisites(self, prerequisite_task):
+        # the jobs of a prerequisite task that the jobs of this task need to wait for;
+        # override this if only part of the prerequisite task is actually needed
+        return prerequisite_task.final_jobs()
+
+    def fingerprint_commands(self):
+        # what the ResultCache hashes of this task, along with the files named in it; override this
+        # if the commands depend on more than the results do (e.g. on what earlier runs already did)
+        return [command for job in self.generate_jobs() for command in getattr(job, "commands", [])]
+
 class AtomicTask(Task):
 
     # a task that does the work of a WSMakerJob
@@ -42,24 +94,66 @@ class AtomicTask(Task):
 
         super().__init__(taskname = name, job_generator = job_generator, prerequisites = prerequisites)
 
-class Scheduler:
+class ReadyQueue:
 
-    @staticmethod
-    def schedule(tasks, submit_task, task_completed, scheduling_finished, max_concurrent_jobs = -1):
+    # keeps track of the number of unsatisfied prerequisites of every node (task or job)
+    # and hands out nodes as soon as they can be started; updating the books after a
+    # node completes only touches its direct dependents
+    def __init__(self, nodes = []):
 
-        def update_task_status(tasks_scheduled, tasks_to_run, tasks_running, tasks_completed):
-            # scheduled -> running
-            for task in tasks_scheduled:
-                tasks_running.append(task)
-                tasks_to_run.remove(task)
+        self.missing_prerequisites = {}
+        self.dependents = {}
+        self.ready = deque()
+        self.completed = set()
+
+        self.add(nodes)
+
+    def add(self, nodes):
+
+        # prerequisites that are not known to this queue are considered satisfied
+        nodes = list(nodes)
+        known_nodes = set(self.missing_prerequisites.keys()) | set(nodes)
+
+        for node in nodes:
+            self.dependents.setdefault(node, [])
+            open_prerequisites = [prerequisite for prerequisite in set(node.prerequisites)
+                                  if prerequisite in known_nodes and prerequisite not in self.completed]
+            self.missing_prerequisites[node] = len(open_prerequisites)
+
+            for prerequisite in open_prerequisites:
+                self.dependents.setdefault(prerequisite, []).append(node)
+
+        for node in nodes:
+            if self.missing_prerequisites[node] == 0:
+                self.ready.append(node)
+
+    def complete(self, node):
+
+        self.completed.add(node)
+
+        for dependent in self.dependents.get(node, []):
+            self.missing_prerequisites[dependent] -= 1
+            if self.missing_prerequisites[dependent] == 0:
+                self.ready.append(dependent)
+
+    def __len__(self):
+        return len(self.ready)
+
+    def pop(self, fits = None):
+        # hand out the first ready node that fits (e.g. into the available resources), if any
+        for node in self.ready:
+            if fits is None or fits(node):
+                self.ready.remove(node)
+                return node
 
-            # running -> completed
-            for task in tasks_running:
-                if task_completed(task):
-                    tasks_running.remove(task)
-                    tasks_completed.append(task)
+        return None
 
-        # build the graph of tasks
+class Scheduler:
+
+    @staticmethod
+    def schedule(tasks, submit_task, wait_completed, scheduling_finished, max_concurrent_jobs = -1, has_capacity = None):
+
+        # build the graph of tasks (this also makes sure that there are no cyclic dependencies)
         task_dag = nx.DiGraph()
         task_dag.add_nodes_from(tasks)
         
@@ -67,46 +161,334 @@ class Scheduler:
             for prerequisite in task.prerequisites:
                 task_dag.add_edge(prerequisite, task)
 
-        # traverse the graph in the order of the dependencies and start all the tasks
-        # that can be started
-        tasks_running = []
-        tasks_completed = []
-        tasks_to_run = [task for task in nx.topological_sort(task_dag)]
+        # all tasks are queued in the order of their dependencies and become ready
+        # as soon as the last of their prerequisites has completed
+        tasks_queued = ReadyQueue([task for task in nx.topological_sort(task_dag) if task in tasks])
+        tasks_to_run = set(tasks)
+        tasks_running = set()
 
         while not scheduling_finished(tasks_to_run, tasks_running):
 
             # start all tasks that can be started
-            tasks_scheduled = []
+            while len(tasks_queued) > 0 and (len(tasks_running) < max_concurrent_jobs or max_concurrent_jobs < 0):
+                task = tasks_queued.pop(fits = (lambda task: has_capacity(task, tasks_running)) if has_capacity else None)
+                if task is None:
+                    break
 
-            for task in tasks_to_run:
-                if task.can_start(tasks_completed) and (len(tasks_scheduled) + len(tasks_running) < max_concurrent_jobs or max_concurrent_jobs < 0):
-                    tasks_scheduled.append(task)
-
-            for task in tasks_scheduled:
                 submit_task(task)
+                tasks_to_run.remove(task)
+                tasks_running.add(task)
 
-            # update the books
-            update_task_status(tasks_scheduled, tasks_to_run, tasks_running, tasks_completed)
-            time.sleep(5)
+            if not tasks_running:
+                if tasks_to_run:
+                    raise RuntimeError("Error: remaining tasks can never be started, check their prerequisites")
+                break
+
+            # block until some of the running tasks are done, then update the books
+            for task in wait_completed(tasks_running):
+                tasks_running.remove(task)
+                tasks_queued.complete(task)
 
 class TaskScheduler(Scheduler):
 
     @staticmethod
     def schedule(tasks, jobSubmitter):
 
+        # jobs of each running task that are not yet known to be completed
+        outstanding_jobs = {}
+
         def submit_task(task):
             print(f"started task {task.taskname}")
             jobSubmitter.submit(task.generate_jobs(), dagname = task.taskname)
+            outstanding_jobs[task] = set(task.generate_jobs())
 
-        def task_completed(task):
+        def wait_completed(tasks_running):
             # the task is complete as soon as all of its jobs are
-            return all([jobSubmitter.is_complete(job) for job in task.generate_jobs()])
+            while True:
+                for job in jobSubmitter.wait_completed(set().union(*[outstanding_jobs[task] for task in tasks_running])):
+                    for task in tasks_running:
+                        outstanding_jobs[task].discard(job)
+
+                tasks_completed = [task for task in tasks_running if not outstanding_jobs[task]]
+                if tasks_completed:
+                    return tasks_completed
 
         def scheduling_finished(tasks_to_run, tasks_running):
             # return as soon as no more tasks need to be scheduled
             return len(tasks_to_run) == 0
 
-        super(TaskScheduler, TaskScheduler).schedule(tasks, submit_task, task_completed, scheduling_finished)
+        super(TaskScheduler, TaskScheduler).schedule(tasks, submit_task, wait_completed, scheduling_finished)
+
+class JobScheduler(Scheduler):
+
+    @staticmethod
+    def schedule(tasks, jobSubmitter, result_cache = None):
+
+        # build the graph of tasks (this also makes sure that there are no cyclic dependencies)
+        task_dag = nx.DiGraph()
+        task_dag.add_nodes_from(tasks)
+
+        for task in tasks:
+            for prerequisite in task.prerequisites:
+                task_dag.add_edge(prerequisite, task)
+
+        tasks_pending = [task for task in nx.topological_sort(task_dag) if task in tasks]
+        tasks_completed = set()
+
+        # all jobs of all tasks end up in the same graph, such that every job can start
+        # as soon as the jobs it actually depends on are done (irrespective of the task they belong to)
+        jobs_queued = ReadyQueue()
+        jobs_running = set()
+        job_task = {}
+        outstanding_jobs = {}
+        submissions = {}
+
+        def expand_tasks():
+            for task in list(tasks_pending):
+                task_prerequisites = [prerequisite for prerequisite in task.prerequisites if prerequisite in tasks]
+
+                # the jobs of the prerequisites must be known before ours can refer to them
+                if any(prerequisite in tasks_pending for prerequisite in task_prerequisites):
+                    continue
+
+                # the outputs of the prerequisites enter the fingerprint of cached tasks
+                cached = result_cache is not None and result_cache.is_cacheable(task)
+                if (task.generate_after_prerequisites or cached) and not set(task_prerequisites).issubset(tasks_completed):
+                    continue
+
+                jobs = task.generate_jobs()
+                tasks_pending.remove(task)
+
+                if cached and result_cache.restore(task, task_prerequisites):
+                    print(f"restored task {task.taskname} from cache")
+                    outstanding_jobs[task] = set()
+                    tasks_completed.add(task)
+                    continue
+                elif cached:
+                    result_cache.prepare(task)
+
+                # it is enough to attach the cross-task prerequisites to the jobs that have
+                # no prerequisites within the task, all others wait for those anyways
+                cross_task_prerequisites = []
+                for prerequisite in task_prerequisites:
+                    cross_task_prerequisites += task.get_job_prerequisites(prerequisite)
+
+                for job in jobs:
+                    if not job.get_parents(jobs):
+                        job.prerequisites = job.prerequisites + cross_task_prerequisites
+                    job_task[job] = task
+
+                outstanding_jobs[task] = set(jobs)
+                if not jobs:
+                    tasks_completed.add(task)
+
+                jobs_queued.add(jobs)
+                print(f"scheduled task {task.taskname} with {len(jobs)} job(s)")
+
+        def submit_ready_jobs():
+            jobs_to_submit = []
+            while len(jobs_queued) > 0:
+                job = jobs_queued.pop(fits = lambda job: jobSubmitter.has_capacity(job, jobs_running.union(jobs_to_submit)))
+                if job is None:
+                    break
+
+                jobs_to_submit.append(job)
+
+            # submit everything that became ready in one go, one submission per task
+            for task in tasks:
+                task_jobs = [job for job in jobs_to_submit if job_task[job] is task]
+                if task_jobs:
+                    submissions[task] = submissions.get(task, 0) + 1
+                    jobSubmitter.start(task_jobs, dagname = f"{task.taskname}_{submissions[task]}")
+
+            jobs_running.update(jobs_to_submit)
+
+        while True:
+            expand_tasks()
+            submit_ready_jobs()
+
+            if not jobs_running:
+                if tasks_pending:
+                    raise RuntimeError("Error: remaining tasks can never be started, check their prerequisites")
+                break
+
+            # block until some of the running jobs are done, then update the books
+            for job in jobSubmitter.wait_completed(jobs_running):
+                jobs_running.remove(job)
+                jobs_queued.complete(job)
+
+                task = job_task[job]
+                outstanding_jobs[task].discard(job)
+                if not outstanding_jobs[task]:
+                    tasks_completed.add(task)
+                    print(f"finished task {task.taskname}")
+
+                    if result_cache is not None:
+                        result_cache.store(task)
+
+class ResultCache:
+
+    # content-addressed store for the outputs of tasks: a task is identified by a hash of its
+    # commands, the code and input files they refer to, its declared inputs and the outputs of its
+    # prerequisites; if the same fingerprint was seen before, the files the task wrote into its
+    # outputs are copied back instead of running the task again. Only runs in which all jobs are
+    # known to have succeeded are stored
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.output_hashes = {} # of the tasks that ran (or were restored) in this run
+        self.code_hash = None
+
+        # avoid hashing large files over and over again if they did not change
+        self.file_hashes_path = os.path.join(cache_dir, "file_hashes.json")
+        self.file_hashes = {}
+        if os.path.exists(self.file_hashes_path):
+            with open(self.file_hashes_path) as infile:
+                self.file_hashes = json.load(infile)
+
+    def hash_file(self, path):
+        info = os.stat(path)
+        key = os.path.abspath(path)
+        if key in self.file_hashes and self.file_hashes[key][:2] == [info.st_size, info.st_mtime_ns]:
+            return self.file_hashes[key][2]
+
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                file_hash.update(chunk)
+
+        self.file_hashes[key] = [info.st_size, info.st_mtime_ns, file_hash.hexdigest()]
+        return self.file_hashes[key][2]
+
+    @staticmethod
+    def list_files(path):
+        if os.path.isdir(path):
+            return sorted(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(path) for filename in filenames)
+        return [path]
+
+    def hash_paths(self, paths):
+        paths_hash = hashlib.sha256()
+
+        for path in paths:
+            for cur_file in self.list_files(path):
+                paths_hash.update(cur_file.encode())
+                paths_hash.update(self.hash_file(cur_file).encode() if os.path.isfile(cur_file) else b"missing")
+
+        return paths_hash.hexdigest()
+
+    def hash_code(self):
+        # the macros, scripts and libraries that the commands load without naming them on the command line
+        if self.code_hash is None:
+            patterns = []
+            for directory in [os.getenv("WORKDIR"), os.getenv("ANALYSISDIR")]:
+                if directory:
+                    patterns += [os.path.join(directory, "*.C"), os.path.join(directory, "macros", "*.C"),
+                                 os.path.join(directory, "macros", "*.h"), os.path.join(directory, "scripts", "*.py")]
+            if os.getenv("BUILDDIR"):
+                patterns += [os.path.join(os.getenv("BUILDDIR"), "*.so"), os.path.join(os.getenv("BUILDDIR"), "WSMakerCore", "*.so")]
+
+            self.code_hash = self.hash_paths(sorted(set(path for pattern in patterns for path in glob.glob(pattern))))
+
+        return self.code_hash
+
+    def is_cacheable(self, task):
+        return len(task.outputs) > 0
+
+    def fingerprint(self, task, prerequisites):
+
+        # can only vouch for the inputs of this task if all the prerequisites are known
+        if not all(prerequisite in self.output_hashes for prerequisite in prerequisites):
+            return None
+
+        fingerprint = hashlib.sha256(task.taskname.encode())
+        fingerprint.update(self.hash_code().encode())
+
+        for command in task.fingerprint_commands():
+            fingerprint.update(command.encode())
+
+            # the scripts, executables and files that appear on the command line
+            for token in command.split():
+                token = os.path.expandvars(token.strip('"\''))
+                path = token if os.path.isfile(token) else shutil.which(token)
+                if path and os.path.isfile(path):
+                    fingerprint.update(self.hash_file(path).encode())
+
+        fingerprint.update(self.hash_paths(task.inputs).encode())
+
+        for prerequisite in prerequisites:
+            fingerprint.update(self.output_hashes[prerequisite].encode())
+
+        return fingerprint.hexdigest()
+
+    def restore(self, task, prerequisites):
+        task.fingerprint = self.fingerprint(task, prerequisites)
+        if task.fingerprint is None:
+            return False
+
+        entry_dir = os.path.join(self.cache_dir, task.fingerprint)
+        manifest_path = os.path.join(entry_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return False
+
+        with open(manifest_path) as infile:
+            manifest = json.load(infile)
+
+        for ind, output in enumerate(manifest["files"]):
+            os.makedirs(os.path.dirname(output) or ".", exist_ok = True)
+            shutil.copy2(os.path.join(entry_dir, str(ind)), output)
+
+        self.output_hashes[task] = manifest["output_hash"]
+        return True
+
+    def prepare(self, task):
+        # called before the jobs of a task that was not restored run: everything in its outputs that
+        # is not newer than this belongs to earlier runs (the time is taken from the file system
+        # the outputs live on, not from the clock of this machine)
+        if getattr(task, "fingerprint", None) is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok = True)
+        marker_path = os.path.join(self.cache_dir, task.fingerprint + ".start")
+        with open(marker_path, 'w'):
+            pass
+        task.start_time = os.stat(marker_path).st_mtime
+        os.remove(marker_path)
+
+    def store(self, task):
+        if getattr(task, "start_time", None) is None:
+            return
+
+        # only cache what is known to be good: the exit status of every job must have been seen
+        if not all(job.succeeded() for job in task.generate_jobs()):
+            print(f"not all jobs of task {task.taskname} are known to have succeeded, will not cache its outputs")
+            return
+
+        # the files the task wrote in this run, every output must have some
+        files = []
+        for output in task.outputs:
+            new_files = [cur_file for cur_file in self.list_files(output) if os.path.isfile(cur_file) and os.stat(cur_file).st_mtime >= task.start_time]
+            if not new_files:
+                print(f"task {task.taskname} did not write {output}, will not cache its outputs")
+                return
+            files += new_files
+
+        # copy everything aside first, such that a cache entry is either complete or absent
+        entry_dir = os.path.join(self.cache_dir, task.fingerprint)
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        os.makedirs(tmp_dir)
+
+        for ind, cur_file in enumerate(files):
+            shutil.copy2(cur_file, os.path.join(tmp_dir, str(ind)))
+
+        self.output_hashes[task] = self.hash_paths(files)
+        with open(os.path.join(tmp_dir, "manifest.json"), 'w') as outfile:
+            json.dump({"task": task.taskname, "files": files, "output_hash": self.output_hashes[task]}, outfile, indent = 1)
+
+        shutil.rmtree(entry_dir, ignore_errors = True)
+        os.rename(tmp_dir, entry_dir)
+
+        with open(self.file_hashes_path, 'w') as outfile:
+            json.dump(self.file_hashes, outfile)
 
 class Job:
 
@@ -134,11 +516,29 @@ class Job:
         return self.executable_generator()
 
     def get_parents(self, jobs):
-        return self.prerequisites
+        # prerequisites that are part of the same submission
+        return [job for job in self.prerequisites if job in jobs]
 
     def can_start(self, jobs):
         return set(self.prerequisites).issubset(set(jobs))
 
+    def failed(self):
+        # only known for jobs that ran locally
+        return getattr(self, "pid", None) is not None and self.pid.returncode not in (None, 0)
+
+    def succeeded(self):
+        # true only if the job is known to have run through: from the exit code of local jobs,
+        # or from the status file that the jobs on a batch system leave behind
+        if getattr(self, "pid", None) is not None:
+            return self.pid.returncode == 0
+
+        status_path = getattr(self, "status_path", None)
+        if status_path is None or not os.path.isfile(status_path):
+            return False
+
+        with open(status_path) as infile:
+            return infile.read().strip() == "0"
+
 class WSMakerJob(Job):
 
     def __init__(self, name, commands, submit_dir, log_dir, prerequisites, settings):
@@ -146,10 +546,19 @@ class WSMakerJob(Job):
         if not isinstance(commands, list):
             commands = [commands]
 
+        self.commands = commands
+
+        # the job writes the exit code of its first failing command (or 0) here when it is done
+        self.status_path = os.path.join(log_dir, name + ".status")
+
         def executable_generator():
             
             jobpath = os.path.join(submit_dir, name + ".sh")
 
+            # the file may be left over from an earlier run
+            if os.path.exists(self.status_path):
+                os.remove(self.status_path)
+
             with open(jobpath, 'w') as jobfile:
                 JobUtils.write_job_preamble(jobfile)
 
@@ -162,15 +571,57 @@ class WSMakerJob(Job):
 
                     redirect_output = f" > {logfile_path} 2>&1"
 
-                    jobfile.write(command + redirect_output + '\n')
+                    jobfile.write(command + redirect_output + ' || status=${status:-$?}\n')
+
+                jobfile.write(f"echo ${{status:-0}} > {self.status_path}\n")
+                jobfile.write("exit ${status:-0}\n")
 
             return jobpath
 
         super().__init__(jobname = name, executable_generator = executable_generator,
                                          prerequisites = prerequisites, settings = settings)
 
+class ClusterStatusCache:
+
+    # answers all job status questions from memory: the batch system is queried once per
+    # refresh for all tracked cluster IDs that are not yet known to be completed, and at most
+    # once every 'refresh_interval' seconds
+    def __init__(self, query_completed, refresh_interval = 5):
+        self.query_completed = query_completed # returns the subset of the passed IDs that have completed
+        self.refresh_interval = refresh_interval
+        self.tracked_ids = set()
+        self.completed_ids = set()
+        self.last_refresh = None
+
+    def track(self, cluster_id):
+        self.tracked_ids.add(cluster_id)
+
+    def refresh(self):
+        open_ids = self.tracked_ids - self.completed_ids
+        if open_ids:
+            self.completed_ids |= self.query_completed(open_ids)
+        self.last_refresh = time.time()
+
+    def completed(self, cluster_ids):
+        cluster_ids = set(cluster_ids)
+        if not cluster_ids.issubset(self.tracked_ids):
+            # never heard of some of them, need to ask the batch system right away
+            self.tracked_ids |= cluster_ids
+            self.last_refresh = None
+
+        if self.last_refresh is None or time.time() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+
+        return cluster_ids & self.completed_ids
+
+    def is_complete(self, cluster_id):
+        return cluster_id in self.completed([cluster_id])
+
 class TorqueJobSubmitter:
 
+    # the status of all jobs is obtained from one 'qstat' call per refresh
+    status_cache = ClusterStatusCache(query_completed = lambda cluster_ids: TorqueJobSubmitter.query_completed(cluster_ids))
+
     @staticmethod
     def submit(jobs, dagname = None):
 
@@ -186,7 +637,7 @@ class TorqueJobSubmitter:
         job_dag.add_nodes_from(jobs)
         
         for job in jobs:
-            for prerequisite in job.prerequisites:
+            for prerequisite in job.get_parents(jobs):
                 job_dag.add_edge(prerequisite, job)
         
         # traverse the graph in the order of the dependencies
@@ -213,22 +664,68 @@ class TorqueJobSubmitter:
                 pid = sp.check_output(["qsub", "-q", queue, "-l", add_opt,  exec_path])
             else:
                 pid = sp.check_output(["qsub", "-q", queue, "-l", add_opt, "-W", depstr, exec_path])
-            job.cluster_id = pid.replace('\n','') #this replace might be nikhef specific but shouldn't hurt
+            job.cluster_id = str(pid, 'UTF-8').replace('\n','') #this replace might be nikhef specific but shouldn't hurt
+            TorqueJobSubmitter.status_cache.track(job.cluster_id)
+
+    @staticmethod
+    def query_completed(cluster_ids):
+        # qstat may truncate the server part of the job ID, so match on the numeric part only
+        short_ids = {cluster_id.split('.')[0]: cluster_id for cluster_id in cluster_ids}
+        completed_ids = set()
+
+        while True:
+            reply = sp.run(["qstat"] + sorted(cluster_ids), stdout = sp.PIPE, stderr = sp.PIPE, universal_newlines = True)
+            if reply.returncode == 0 or "Unknown Job Id" in reply.stderr:
+                break
+            print("Problem retrieving job status - retrying in 10 seconds!")
+            time.sleep(10)
+
+        # jobs that are already purged from the server are done as well
+        for short_id in re.findall(r"Unknown Job Id (?:Error )?(\d+)", reply.stderr):
+            if short_id in short_ids:
+                completed_ids.add(short_ids[short_id])
+
+        # each job is listed as "<job ID> <name> <user> <time used> <status> <queue>"
+        for line in reply.stdout.splitlines():
+            fields = line.split()
+            if len(fields) < 6:
+                continue
+            short_id = fields[0].split('.')[0]
+            if short_id in short_ids and fields[-2] == "C":
+                completed_ids.add(short_ids[short_id])
+
+        return completed_ids
 
     @staticmethod
     def is_complete(job):
         # check whether this job is still running
-        reply = sp.check_output(["qstat", str(job.cluster_id)])
-        status_pattern = r".*\ ([A-Z])\ "+job.queue
-        status = re.search(status_pattern, reply).group(1)
-        if status == "C":
-            return True
-        else:
-            return False
+        return TorqueJobSubmitter.status_cache.is_complete(job.cluster_id)
+
+    @staticmethod
+    def completed_jobs(jobs):
+        completed_ids = TorqueJobSubmitter.status_cache.completed([job.cluster_id for job in jobs])
+        return [job for job in jobs if job.cluster_id in completed_ids]
+
+    @staticmethod
+    def wait_completed(jobs):
+        return JobUtils.poll_completed(jobs, TorqueJobSubmitter.completed_jobs, TorqueJobSubmitter.status_cache.refresh_interval)
+
+    @staticmethod
+    def start(jobs, dagname = None):
+        # only gets passed jobs whose prerequisites are all done, so the submission has no internal dependencies
+        return TorqueJobSubmitter.submit(jobs, dagname = dagname)
+
+    @staticmethod
+    def has_capacity(job, jobs_running):
+        # the batch system takes care of the resources
+        return True
 
 
 class CondorJobSubmitter:
-    
+
+    # the status of all DAGs is obtained from one 'condor_q' call per refresh
+    status_cache = ClusterStatusCache(query_completed = lambda cluster_ids: CondorJobSubmitter.query_completed(cluster_ids))
+
     @staticmethod
     def submit(jobs, dagname = None):
 
@@ -306,24 +803,136 @@ class CondorJobSubmitter:
         for job in jobs:
             job.cluster_id = cluster_id
 
+        CondorJobSubmitter.status_cache.track(cluster_id)
+
     @staticmethod
-    def is_complete(job):
-        # check whether this job is still running
+    def query_completed(cluster_ids):
+        # a DAG stays in the queue until all of its jobs are done
         while True:
             try:
-                reply = sp.check_output(["condor_q", "-long", "-attributes", "ClusterId", str(job.cluster_id)])
+                reply = sp.check_output(["condor_q", "-long", "-attributes", "ClusterId"] + [str(cluster_id) for cluster_id in sorted(cluster_ids)])
                 break
             except:
                 print("Problem retrieving job status - retrying in 10 seconds!") 
                 time.sleep(10)
-                
-        if len(reply) > 0:
-            return False
-        else:
-            return True
+
+        queued_ids = {int(cluster_id) for cluster_id in re.findall(r"ClusterId\s*=\s*(\d+)", str(reply, 'UTF-8'))}
+        return set(cluster_ids) - queued_ids
+
+    @staticmethod
+    def is_complete(job):
+        # check whether this job is still running
+        return CondorJobSubmitter.status_cache.is_complete(job.cluster_id)
+
+    @staticmethod
+    def completed_jobs(jobs):
+        completed_ids = CondorJobSubmitter.status_cache.completed([job.cluster_id for job in jobs])
+        return [job for job in jobs if job.cluster_id in completed_ids]
+
+    @staticmethod
+    def wait_completed(jobs):
+        return JobUtils.poll_completed(jobs, CondorJobSubmitter.completed_jobs, CondorJobSubmitter.status_cache.refresh_interval)
+
+    @staticmethod
+    def start(jobs, dagname = None):
+        # only gets passed jobs whose prerequisites are all done, so the submission has no internal dependencies
+        return CondorJobSubmitter.submit(jobs, dagname = dagname)
+
+    @staticmethod
+    def has_capacity(job, jobs_running):
+        # the batch system takes care of the resources
+        return True
 
 class LocalJobSubmitter(Scheduler):
 
+    # resources of this machine that the jobs can be packed into (None: determine automatically)
+    max_concurrent_jobs = -1
+    number_CPUs = None
+    memory = None # in MB
+
+    # if set, the peak memory observed for each task is kept in this file and used
+    # instead of the requested memory in later runs
+    memory_record_path = None
+    memory_record = None
+
+    # every local job gets a watcher thread that waits for the process to exit
+    # and then reports the job here; whether a job has exited is kept on the job itself
+    completion_events = queue.Queue()
+
+    @staticmethod
+    def available_resources():
+
+        if LocalJobSubmitter.number_CPUs is None:
+            try:
+                LocalJobSubmitter.number_CPUs = len(os.sched_getaffinity(0))
+            except AttributeError:
+                LocalJobSubmitter.number_CPUs = os.cpu_count() or 1
+
+        if LocalJobSubmitter.memory is None:
+            try:
+                with open("/proc/meminfo") as meminfo:
+                    available_kB = [int(line.split()[1]) for line in meminfo if line.startswith("MemAvailable:")][0]
+                LocalJobSubmitter.memory = available_kB / 1024
+            except (OSError, IndexError):
+                LocalJobSubmitter.memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**2
+
+        return LocalJobSubmitter.number_CPUs, LocalJobSubmitter.memory
+
+    @staticmethod
+    def load_memory_record():
+
+        if LocalJobSubmitter.memory_record is None:
+            LocalJobSubmitter.memory_record = {}
+            if LocalJobSubmitter.memory_record_path and os.path.exists(LocalJobSubmitter.memory_record_path):
+                with open(LocalJobSubmitter.memory_record_path) as infile:
+                    LocalJobSubmitter.memory_record = json.load(infile)
+
+        return LocalJobSubmitter.memory_record
+
+    @staticmethod
+    def record_memory(job):
+
+        if not LocalJobSubmitter.memory_record_path or getattr(job, "peak_memory", None) is None:
+            return
+
+        memory_record = LocalJobSubmitter.load_memory_record()
+        taskname = getattr(job, "taskname", job.jobname)
+        memory_record[taskname] = max(memory_record.get(taskname, 0), job.peak_memory)
+
+        with open(LocalJobSubmitter.memory_record_path, 'w') as outfile:
+            json.dump(memory_record, outfile, indent = 1, sort_keys = True)
+
+    @staticmethod
+    def required_resources(job):
+
+        number_CPUs, memory = LocalJobSubmitter.available_resources()
+        job_CPUs = job.settings.number_CPUs if job.settings else 1
+        job_memory = JobUtils.memory_in_MB(job.settings.memory) if job.settings else 0
+
+        # prefer what the task actually needed in earlier runs, with some safety margin
+        observed_memory = LocalJobSubmitter.load_memory_record().get(getattr(job, "taskname", job.jobname))
+        if observed_memory:
+            job_memory = 1.2 * observed_memory
+
+        # a job that asks for more than the machine has gets to run on its own
+        return min(job_CPUs, number_CPUs), min(job_memory, memory)
+
+    @staticmethod
+    def has_capacity(job, jobs_running):
+
+        if len(jobs_running) >= LocalJobSubmitter.max_concurrent_jobs and LocalJobSubmitter.max_concurrent_jobs >= 0:
+            return False
+
+        number_CPUs, memory = LocalJobSubmitter.available_resources()
+        job_CPUs, job_memory = LocalJobSubmitter.required_resources(job)
+
+        for running_job in jobs_running:
+            running_CPUs, running_memory = LocalJobSubmitter.required_resources(running_job)
+            number_CPUs -= running_CPUs
+            memory -= running_memory
+
+        return job_CPUs <= number_CPUs and job_memory <= memory
+
     @staticmethod
     def is_complete(job):
         if job.pid.poll() is not None:
@@ -332,18 +941,58 @@ class LocalJobSubmitter(Scheduler):
             return False
 
     @staticmethod
-    def submit(jobs, max_concurrent_jobs = 4, dagname = None):
+    def start_job(job):
+
+        def watch(job):
+            # also get the resource usage of the job (including all processes it waited for)
+            _, status, rusage = os.wait4(job.pid.pid, 0)
+            job.pid.returncode = os.waitstatus_to_exitcode(status)
+            job.peak_memory = rusage.ru_maxrss / 1024 # in MB
+            LocalJobSubmitter.completion_events.put(job)
+
+        job.pid = sp.Popen(["bash", job.generate_executable()])
+        threading.Thread(target = watch, args = (job,), daemon = True).start()
+        print(f"started job {job.jobname}")
+
+    @staticmethod
+    def start(jobs, dagname = None):
+        # only gets passed jobs whose prerequisites are all done
+        for job in jobs:
+            LocalJobSubmitter.start_job(job)
+
+    @staticmethod
+    def wait_completed(jobs):
+
+        # block until at least one of the jobs has exited and return all those that have
+        while True:
+            completed_jobs = [job for job in jobs if getattr(job, "exited", False)]
+            if completed_jobs or not jobs:
+                return completed_jobs
 
-        def submit_job(job):
-            pid = sp.Popen(["bash", job.generate_executable()])
-            job.pid = pid
-            print(f"started job {job.jobname}")
+            finished_jobs = [LocalJobSubmitter.completion_events.get()]
+            while not LocalJobSubmitter.completion_events.empty():
+                finished_jobs.append(LocalJobSubmitter.completion_events.get())
+
+            for job in finished_jobs:
+                job.exited = True
+                LocalJobSubmitter.record_memory(job)
+
+    @staticmethod
+    def submit(jobs, max_concurrent_jobs = None, dagname = None):
+
+        if max_concurrent_jobs is None:
+            max_concurrent_jobs = LocalJobSubmitter.max_concurrent_jobs
+
+        for job in jobs:
+            if dagname and not hasattr(job, "taskname"):
+                job.taskname = dagname
 
         def scheduling_finished(tasks_to_run, tasks_running):
             # return when nothing more needs to be done
             return len(tasks_to_run) == 0 and len(tasks_running) == 0
 
-        super(LocalJobSubmitter, LocalJobSubmitter).schedule(jobs, submit_job, LocalJobSubmitter.is_complete, scheduling_finished, max_concurrent_jobs = max_concurrent_jobs)
+        super(LocalJobSubmitter, LocalJobSubmitter).schedule(jobs, LocalJobSubmitter.start_job, LocalJobSubmitter.wait_completed, scheduling_finished,
+                                                             max_concurrent_jobs = max_concurrent_jobs, has_capacity = LocalJobSubmitter.has_capacity)
 
 # ----------------------------------------------------------------------
 # some convenience methods that expose the same interface as before
@@ -17,6 +17,9 @@ import argparse
 import logging
 import time
 import ctypes
+import csv
+import multiprocessing
+import numpy as np
 from ROOT import *
 import CompareShape as CS
 from fnmatch import fnmatch
@@ -201,6 +204,27 @@ Result = {
   'MIT':[],
 }
 
+# the same results, as records for the output table
+Records = []
+RecordFields = ['check', 'name', 'flag',
+                'ref_entry', 'ref_error', 'ref_under', 'ref_over',
+                'test_entry', 'test_error', 'test_under', 'test_over',
+                'shape_chi2', 'shape_ndf']
+Missing = (-1., -1., -1., -1.)
+
+def AddResult(check, name, comment, result, ref_info, test_info, chi2 = (-1., 0)):
+  Result[comment].append(result)
+  Records.append([check, name, comment] + list(ref_info or Missing) + list(test_info or Missing) + list(chi2))
+  logging.info(result)
+
+def WriteTable(output):
+  """ Write all the records in the csv file output """
+  with open(output, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(RecordFields)
+    writer.writerows(Records)
+  print(f'{len(Records)} results written in {output}')
+
 def ShowResult(condition,detail=True):
   AllItems = Result[condition]
   num = len(AllItems)
@@ -217,45 +241,178 @@ def ShowResult(condition,detail=True):
       print(res)
   return num
 
-def CompareSysNominal(file, showDetail = False):
-  for reg in Regions[lep]:
+# index of the keys of each directory, and what was read from each histogram of the
+# current batch (one region, or one region and systematic)
+KeyIndex = {}
+HistInfo = {}
+HistArrays = {}
+PairResults = {}
+
+def GetKeyIndex(directory):
+  """ Keys of directory by name, built once per directory """
+  path = directory.GetPath()
+  if path not in KeyIndex:
+    index = {}
+    for key in directory.GetListOfKeys():
+      name = key.GetName()
+      if name not in index or key.GetCycle() > index[name].GetCycle():
+        index[name] = key
+    KeyIndex[path] = index
+  return KeyIndex[path]
+
+def GetHist(directory, name):
+  """ Histogram name of directory, detached from it. None if it does not exist """
+  index = GetKeyIndex(directory)
+  if name not in index:
+    return None
+  hist = index[name].ReadObj()
+  hist.SetDirectory(0)
+  SetOwnership(hist, True)
+  return hist
+
+def GetArrays(hist):
+  """ Contents and sums of squared weights of all the bins of hist, under- and overflow included """
+  n = hist.GetNbinsX()+2
+  dtype = {'TH1D': np.float64, 'TH1F': np.float32}.get(hist.ClassName())
+  if dtype is None:
+    contents = np.array([hist.GetBinContent(i) for i in range(n)])
+  else:
+    contents = np.frombuffer(hist.GetArray(), dtype=dtype, count=n).astype(np.float64)
+  if hist.GetSumw2N() > 0:
+    sumw2 = np.frombuffer(hist.GetSumw2().GetArray(), dtype=np.float64, count=n).copy()
+  else:
+    sumw2 = np.abs(contents)
+  return contents, sumw2
+
+def LoadHists(directory, names):
+  """ Read the histograms names of directory, and get their integrals, errors, under- and overflows at once
+
+  The integrals and errors include the underflow but not the overflow, as IntegralAndError(0, nbin).
+  The under- and overflows are in % of the integral. Histograms already read are skipped.
+  """
+  path = directory.GetPath()
+  index = GetKeyIndex(directory)
+  groups = {}
+  for name in names:
+    key = (path, name)
+    if key in HistInfo:
+      continue
+    if name not in index:
+      HistInfo[key] = None
+      continue
+    HistArrays[key] = GetArrays(GetHist(directory, name))
+    HistInfo[key] = Missing
+    groups.setdefault(len(HistArrays[key][0]), []).append(key)
+
+  # histograms with the same number of bins are done together
+  for keys in groups.values():
+    contents = np.array([HistArrays[key][0] for key in keys])
+    sumw2 = np.array([HistArrays[key][1] for key in keys])
+    entries = contents[:, :-1].sum(axis=1)
+    errors = np.sqrt(sumw2[:, :-1].sum(axis=1))
+    nonzero = entries != 0
+    under = np.divide(100.0*contents[:, 0], entries, out=np.zeros_like(entries), where=nonzero)
+    over = np.divide(100.0*contents[:, -1], entries, out=np.zeros_like(entries), where=nonzero)
+    for key, info in zip(keys, zip(entries.tolist(), errors.tolist(), under.tolist(), over.tolist())):
+      HistInfo[key] = info
+
+def DropHists():
+  """ Forget the histograms read so far, once all the comparisons of a batch that use them are done """
+  HistArrays.clear()
+  HistInfo.clear()
+  PairResults.clear()
+
+def GetHistInfo(directory, name):
+  """ Integral, error, under- and overflow of histogram name of directory, None if it does not exist """
+  LoadHists(directory, [name])
+  return HistInfo[(directory.GetPath(), name)]
+
+def ComparePairs(pairs):
+  """ Difference of the integrals (in %) and chi2 of the normalised shapes of pairs of histograms, all at once
+
+  pairs are given as ((ref directory, ref name), (test directory, test name)), of histograms read
+  with LoadHists. The results go to PairResults. Pairs of which a histogram is missing are skipped,
+  the chi2 is (-1, 0) if one of them is empty or their binnings differ.
+  """
+  keys = []
+  for (ref, ref_name), (test, test_name) in pairs:
+    key = ((ref.GetPath(), ref_name), (test.GetPath(), test_name))
+    if key not in PairResults and key[0] in HistArrays and key[1] in HistArrays:
+      keys.append(key)
+  if len(keys) == 0:
+    return
+
+  ref_entries = np.array([HistInfo[key[0]][0] for key in keys])
+  test_entries = np.array([HistInfo[key[1]][0] for key in keys])
+  difs = np.full(len(keys), 1.0)
+  np.divide((test_entries - ref_entries) * 100, ref_entries, out=difs, where=ref_entries > 0)
+  chi2s = np.full(len(keys), -1.)
+  ndfs = np.zeros(len(keys), dtype=int)
+
+  # pairs with the same number of bins are done together
+  groups = {}
+  for i, key in enumerate(keys):
+    nbins = len(HistArrays[key[0]][0])
+    if nbins == len(HistArrays[key[1]][0]):
+      groups.setdefault(nbins, []).append(i)
+  for indices in groups.values():
+    ref_contents = np.array([HistArrays[keys[i][0]][0] for i in indices])
+    ref_sumw2 = np.array([HistArrays[keys[i][0]][1] for i in indices])
+    test_contents = np.array([HistArrays[keys[i][1]][0] for i in indices])
+    test_sumw2 = np.array([HistArrays[keys[i][1]][1] for i in indices])
+    ref_sum = ref_contents.sum(axis=1, keepdims=True)
+    test_sum = test_contents.sum(axis=1, keepdims=True)
+    filled = ((ref_sum != 0) & (test_sum != 0))[:, 0]
+    ref_sum[ref_sum == 0] = 1.
+    test_sum[test_sum == 0] = 1.
+    var = ref_sumw2/ref_sum**2 + test_sumw2/test_sum**2
+    used = var > 0
+    diff = ref_contents/ref_sum - test_contents/test_sum
+    terms = np.divide(diff**2, var, out=np.zeros_like(var), where=used)
+    chi2s[indices] = np.where(filled, terms.sum(axis=1), -1.)
+    ndfs[indices] = np.where(filled, used.sum(axis=1), 0)
+
+  for key, dif, chi2, ndf in zip(keys, difs.tolist(), chi2s.tolist(), ndfs.tolist()):
+    PairResults[key] = (dif, (chi2, ndf))
+
+def GetPairResult(ref, ref_name, test, test_name):
+  """ Difference of the integrals (in %) and (chi2, ndf) of two histograms, see ComparePairs
+
+  The difference is None if one of them is missing.
+  """
+  ComparePairs([((ref, ref_name), (test, test_name))])
+  return PairResults.get(((ref.GetPath(), ref_name), (test.GetPath(), test_name)), (None, (-1., 0)))
+
+def CompareSysNominal(file, showDetail = False, regions = None, systs = None):
+  sys_dir = file.GetDirectory('Systematics');
+  for reg in regions or Regions[lep]:
+    names = [pro+'_'+reg+'_'+var for pro in Processes for var in Vars[lep]]
+    LoadHists(file, names)
+    LoadHists(sys_dir, [name+'_'+Sys['Name']+'__1up' for name in names for Sys in systs or Systs])
+    ComparePairs([((file, name), (sys_dir, name+'_'+Sys['Name']+'__1up')) for name in names for Sys in systs or Systs])
     for pro in Processes:
       for var in Vars[lep]:
         name = pro+'_'+reg+'_'+var
-        for Sys in Systs:
+        for Sys in systs or Systs:
           SysName = Sys['Name']
           # check if the histograms in nominal and sys exist
-          nom_exist = file.GetListOfKeys().Contains(name)
-          sys_dir = file.GetDirectory('Systematics');
-          sys_exist = sys_dir.GetListOfKeys().Contains(name+'_'+SysName+'__1up')
+          nom_info = GetHistInfo(file, name)
+          sys_info = GetHistInfo(sys_dir, name+'_'+SysName+'__1up')
           # in case the sys name contains AntiKt4EMPFlowJets but not the histo (e.g. 2leptons)
-          if not nom_exist and not sys_exist and "AntiKt4EMPFlowJets" in SysName:
+          if nom_info is None and sys_info is None and "AntiKt4EMPFlowJets" in SysName:
             SysName = SysName.replace("_AntiKt4EMPFlowJets", "");
-            sys_exist = sys_dir.GetListOfKeys().Contains(name+'_'+SysName+'__1up')
+            sys_info = GetHistInfo(sys_dir, name+'_'+SysName+'__1up')
+          nom_exist = nom_info is not None
+          sys_exist = sys_info is not None
+          dif, chi2 = GetPairResult(file, name, sys_dir, name+'_'+SysName+'__1up')
 
           # retrieve the information for nominal and systematic histograms
-          nom_entry  = -1.
-          sys_entry = -1.
-          #pass by reference
-          nom_error  = ctypes.c_double(-1.)
-          sys_error = ctypes.c_double(-1.)
-
-          if nom_exist:
-            nom_hist = file.Get(name)
-            nbin = nom_hist.GetNbinsX()
-            nom_entry = nom_hist.IntegralAndError(0, nbin, nom_error)
-
-          if sys_exist:
-            sys_hist = sys_dir.Get(name+'_'+SysName+'__1up')
-            nbin = sys_hist.GetNbinsX()
-            sys_entry = sys_hist.IntegralAndError(0, nbin, sys_error)
+          nom_entry, nom_error = nom_info[:2] if nom_exist else (-1., -1.)
+          sys_entry, sys_error = sys_info[:2] if sys_exist else (-1., -1.)
 
           # perfrom the comparison between nominal and systematic inputs
           info="Missing"
           if nom_exist and sys_exist:
-            dif = 1.0
-            if nom_entry > 0. :
-              dif = (sys_entry - nom_entry) * 100 / nom_entry
             absdif = abs(dif)
             if (absdif < 5.):
               comment = "OK"
@@ -286,45 +443,25 @@ def CompareSysNominal(file, showDetail = False):
           if showDetail:
             result_reg = "{:10s}: {:9.2f} +- {:6.2f}, {:9.2f} +- {:6.2f}; ({})".format(name.split('_')[0], nom_entry, nom_error, sys_entry, sys_error, info)
             print(result_reg)
-          Result[comment].append(result)
-          logging.info(result)
+          AddResult('sysnom', name+'_'+SysName+'__1up', comment, result, nom_info, sys_info, chi2)
+    DropHists()
 
-def Check(name, ref, test, showDetail = False):
+def Check(name, ref, test, showDetail = False, getHists = False, check = 'nominal'):
   # check if the histogrames in reference and test exist
-  ref_exist = ref.GetListOfKeys().Contains(name)
-  test_exist = test.GetListOfKeys().Contains(name)
+  ref_info = GetHistInfo(ref, name)
+  test_info = GetHistInfo(test, name)
   # special case for 2 lepton channel
-  if not ref_exist and not test_exist and "AntiKt4EMPFlowJets" in name:
+  if ref_info is None and test_info is None and "AntiKt4EMPFlowJets" in name:
     name = name.replace("_AntiKt4EMPFlowJets", "");
-    ref_exist  = ref.GetListOfKeys().Contains(name)
-    test_exist = test.GetListOfKeys().Contains(name)
+    ref_info = GetHistInfo(ref, name)
+    test_info = GetHistInfo(test, name)
+  ref_exist = ref_info is not None
+  test_exist = test_info is not None
+  dif, chi2 = GetPairResult(ref, name, test, name)
 
   # retrieve the information for reference and test histograms
-  ref_entry  = -1.
-  ref_under  = -1.
-  ref_over  = -1.
-  test_entry = -1.
-  test_under = -1.
-  test_over = -1.
-  #pass by reference
-  ref_error  = ctypes.c_double(-1.)
-  test_error = ctypes.c_double(-1.)
-
-  if ref_exist:
-    ref_hist = ref.Get(name)
-    #ref_entry = ref_hist.Integral()
-    nbin = ref_hist.GetNbinsX()
-    ref_entry = ref_hist.IntegralAndError(0, nbin, ref_error)
-    ref_under = 100.0*ref_hist.GetBinContent(0)/ref_entry
-    ref_over = 100.0*ref_hist.GetBinContent(nbin+1)/ref_entry
-
-  if test_exist:
-    test_hist = test.Get(name)
-    #test_entry = h2.Integral()
-    nbin = test_hist.GetNbinsX()
-    test_entry = test_hist.IntegralAndError(0, nbin, test_error)
-    test_under = 100.0*test_hist.GetBinContent(0)/test_entry
-    test_over = 100.0*test_hist.GetBinContent(nbin+1)/test_entry
+  ref_entry, ref_error, ref_under, ref_over = ref_info if ref_exist else Missing
+  test_entry, test_error, test_under, test_over = test_info if test_exist else Missing
 
   unexpUnder = False
   if (test_under > 0 or ref_under > 0 or test_over > 0 or ref_over > 0) and ('mva' in name or 'MVA' in name):
@@ -333,9 +470,6 @@ def Check(name, ref, test, showDetail = False):
   # perfrom the comparison between reference and test inputs
   info="Missing"
   if ref_exist and test_exist:
-    dif = 1.0
-    if ref_entry > 0. :
-      dif = (test_entry - ref_entry) * 100 / ref_entry
     absdif = abs(dif)
     if (absdif < 5.):
       comment = "OK"
@@ -363,16 +497,15 @@ def Check(name, ref, test, showDetail = False):
         comment = 'MIB'
 
   #name.replace("_AntiKt4EMPFlowJets", "")
-  result = f"{name:90s}: {ref_entry:9.2f} +- {ref_error.value:6.2f} (u:{ref_under:4.1f}%,o:{ref_over:4.1f}%), {test_entry:9.2f} +- {test_error.value:6.2f} (u:{test_under:4.1f}%,o:{test_over:4.1f}%); ({info})"
+  result = f"{name:90s}: {ref_entry:9.2f} +- {ref_error:6.2f} (u:{ref_under:4.1f}%,o:{ref_over:4.1f}%), {test_entry:9.2f} +- {test_error:6.2f} (u:{test_under:4.1f}%,o:{test_over:4.1f}%); ({info})"
   if unexpUnder: result += "   <= \033[1;31m  MVA variable with underflow -- CHECK INPUTS  \033[0m"
   if showDetail:
-    result_reg = "{:10s}: {:9.2f} +- {:6.2f} (u:{:4.1f}%,o:{:4.1f}%), {:9.2f} +- {:6.2f} (u:{:4.1f}%,o:{:4.1f}%); ({})".format(name.split('_')[0], ref_entry, ref_error.value, ref_under, ref_over, test_entry, test_error.value, test_under, test_over, info)
+    result_reg = "{:10s}: {:9.2f} +- {:6.2f} (u:{:4.1f}%,o:{:4.1f}%), {:9.2f} +- {:6.2f} (u:{:4.1f}%,o:{:4.1f}%); ({})".format(name.split('_')[0], ref_entry, ref_error, ref_under, ref_over, test_entry, test_error, test_under, test_over, info)
     if unexpUnder: result_reg += "   <= \033[1;31m  MVA variable with underflow -- CHECK INPUTS  \033[0m"
     print(result_reg)
-  Result[comment].append(result)
-  logging.info(result)
+  AddResult(check, name, comment, result, ref_info, test_info, chi2)
 
-  if ref_exist and test_exist: return [ref_hist.Clone(),test_hist.Clone()]
+  if ref_exist and test_exist and getHists: return [GetHist(ref, name), GetHist(test, name)]
   else: return None
 
 def CheckBinning(test):
@@ -406,24 +539,35 @@ def PlotShapeDiff(name, var, histNos, histUPs, histDOs=None):
     CL.append( {'name':'test-DO', 'color':kRed, 'remark':'DOWN from test', 'hist':histDOs[1], 'LineStyle':2 } )
     CS.DrawCompWithHist(CL, False, name, var, 'Events', './Shape/')
 
-def CheckNominal(ref, test):
-  for reg in Regions[lep]:
+def CheckNominal(ref, test, regions = None):
+  for reg in regions or Regions[lep]:
+    names = [pro+'_'+reg+'_'+var for pro in Processes for var in Vars[lep]]
+    LoadHists(ref, names)
+    LoadHists(test, names)
+    ComparePairs([((ref, name), (test, name)) for name in names])
     print('nominal (underflow:, overflow:) for region:' + reg)
     for pro in Processes:
       for var in Vars[lep]:
         histoname = pro+'_'+reg+'_'+var
         Check(histoname, ref, test, True)
+    DropHists()
 
-def CheckSyst(ref, test):
+def CheckSyst(ref, test, regions = None, systs = None):
   subdir_ref  = ref.GetDirectory('Systematics');
   subdir_test = test.GetDirectory('Systematics');
-  for sys in Systs:
+  for sys in systs or Systs:
     SysName = sys['Name']
     OneSide = sys['OneSide']
     #print
-    for reg in Regions[lep]:
+    for reg in regions or Regions[lep]:
       if 'Region' in sys and reg not in sys['Region']:
         continue
+      names = [pro+'_'+reg+'_'+var+'_'+SysName+side for pro in Processes for var in Vars[lep]
+               for side in ['__1up', '__1down']
+               if pro != 'data' and ('Process' not in sys or pro in sys['Process'])]
+      LoadHists(subdir_ref, names)
+      LoadHists(subdir_test, names)
+      ComparePairs([((subdir_ref, name), (subdir_test, name)) for name in names])
       for pro in Processes:
         if 'Process' in sys and pro not in sys['Process']:
           continue
@@ -431,34 +575,74 @@ def CheckSyst(ref, test):
           continue
         for var in Vars[lep]:
           histoname = pro+'_'+reg+'_'+var+'_'+SysName
-          histUPs = Check(histoname+'__1up', subdir_ref, subdir_test)
-          if not OneSide:
-            histDOs = Check(histoname+'__1down', subdir_ref, subdir_test)
-
-          # we are doing the shape comparison
           # check if this is what we want to perform the shape comparison
           DoShapeDiff = False
           for regex in exp_diff:
             DoShapeDiff |= fnmatch(histoname, regex)
+
+          histUPs = Check(histoname+'__1up', subdir_ref, subdir_test, getHists = DoShapeDiff, check = 'syst')
+          if not OneSide:
+            histDOs = Check(histoname+'__1down', subdir_ref, subdir_test, getHists = DoShapeDiff, check = 'syst')
+
+          # we are doing the shape comparison
           if DoShapeDiff:
             # get the nominal histos
             nominal = pro+'_'+reg+'_'+var
-            ref_exist = ref.GetListOfKeys().Contains(nominal)
-            test_exist = test.GetListOfKeys().Contains(nominal)
+            ref_hist = GetHist(ref, nominal)
+            test_hist = GetHist(test, nominal)
 
-            if ref_exist:
-              ref_hist = ref.Get(nominal)
-            else:
+            if ref_hist is None:
               logging.critical('The nominal %s doesn\' t exist in reference'%nominal)
 
-            if test_exist:
-              test_hist = test.Get(nominal)
-            else:
+            if test_hist is None:
               logging.critical('The nominal %s doesn\' t exist in test'%nominal)
 
-            histNos = [ ref_hist.Clone(), test_hist.Clone() ]
+            histNos = [ ref_hist, test_hist ]
             if OneSide: PlotShapeDiff(histoname, var, histNos, histUPs)
             else: PlotShapeDiff(histoname, var, histNos, histUPs, histDOs)
+      DropHists()
+
+# state of a worker process of CheckParallel
+CheckWorker = {}
+
+def InitCheckWorker(ref_path, test_path):
+  # each worker reads the inputs through its own handles
+  KeyIndex.clear()
+  HistInfo.clear()
+  CheckWorker['ref'] = TFile(ref_path, 'READ') if ref_path != '' else None
+  CheckWorker['test'] = TFile(test_path, 'READ') if test_path != '' else None
+
+def CheckShard(shard):
+  """ Run the checks of one (region, systematic) shard, and send back what they found """
+  check, reg, sys = shard
+  for items in Result.values():
+    del items[:]
+  del Records[:]
+  ref = CheckWorker['ref']
+  test = CheckWorker['test']
+  systs = [sys] if sys is not None else None
+  if check == 'nominal':
+    CheckNominal(ref, test, [reg])
+  elif check == 'syst':
+    CheckSyst(ref, test, [reg], systs)
+  elif check == 'sysnom':
+    CompareSysNominal(test if test is not None else ref, regions = [reg], systs = systs)
+  return Result, Records
+
+def CheckParallel(check, workers, ref_path, test_path):
+  """ Share the (region, systematic) pairs of check among workers processes, and merge their results """
+  if check == 'nominal':
+    shards = [(check, reg, None) for reg in Regions[lep]]
+  elif check == 'syst':
+    shards = [(check, reg, sys) for sys in Systs for reg in Regions[lep]]
+  else:
+    shards = [(check, reg, sys) for reg in Regions[lep] for sys in Systs]
+  ctx = multiprocessing.get_context("fork")
+  with ctx.Pool(workers, initializer=InitCheckWorker, initargs=(ref_path, test_path)) as pool:
+    for result, records in pool.imap(CheckShard, shards):
+      for condition, items in result.items():
+        Result[condition] += items
+      Records.extend(records)
 
 def main():
   usage = "Usage: %prog [options]"
@@ -467,6 +651,8 @@ def main():
     )
   parser.add_argument( "-d", "--debug",   help="Print lots of debugging statements", action="store_true")
   parser.add_argument( "-v", "--verbose", help="increase output verbosity",          action="store_true")
+  parser.add_argument( "-j", "--workers", help="number of processes sharing the regions and systematics", type=int, default=1)
+  parser.add_argument( "-o", "--output",  help="also write the results in this csv file", default=None)
 
   args = parser.parse_args()
   if args.verbose:
@@ -484,26 +670,38 @@ def main():
 
       # start check the nominal
       start_time = time.time()
-      tfile_ref = TFile(input_ref,  'READ');
-      tfile_test = TFile(input_test, 'READ');
-      CheckNominal(tfile_ref, tfile_test)
+      if args.workers > 1:
+        CheckParallel('nominal', args.workers, input_ref, input_test)
+      else:
+        tfile_ref = TFile(input_ref,  'READ');
+        tfile_test = TFile(input_test, 'READ');
+        CheckNominal(tfile_ref, tfile_test)
       print("--- %s seconds for nominal check---" % round(time.time() - start_time, 2))
 
       # start check the systematics, first we enter the subdir for systematics
       start_time = time.time()
-      CheckSyst(tfile_ref, tfile_test)
+      if args.workers > 1:
+        CheckParallel('syst', args.workers, input_ref, input_test)
+      else:
+        CheckSyst(tfile_ref, tfile_test)
       print("--- %s seconds for systematic check---" % round(time.time() - start_time, 2))
   elif input_test != '' and input_ref == '':
      print(f'Comparing nominal and syst for: {input_test}')
      start_time = time.time()
-     tfile_test = TFile(input_test, 'READ');
-     CompareSysNominal(tfile_test);
+     if args.workers > 1:
+       CheckParallel('sysnom', args.workers, input_ref, input_test)
+     else:
+       tfile_test = TFile(input_test, 'READ');
+       CompareSysNominal(tfile_test);
      print("--- %s seconds for nominal vs systematic check---" % round(time.time() - start_time, 2))
   elif input_test == '' and input_ref != '':
     print(f'Comparing nominal and syst for: {input_ref}')
     start_time = time.time()
-    tfile_ref = TFile(input_ref, 'READ');
-    CompareSysNominal(tfile_ref);
+    if args.workers > 1:
+      CheckParallel('sysnom', args.workers, input_ref, input_test)
+    else:
+      tfile_ref = TFile(input_ref, 'READ');
+      CompareSysNominal(tfile_ref);
     print("--- %s seconds for nominal vs systematic check---" % round(time.time() - start_time, 2))
 
   total = 0
@@ -518,6 +716,9 @@ def main():
   total +=  ShowResult('HUGE')
   print('For all above, in total: ',total)
 
+  if args.output is not None:
+    WriteTable(args.output)
+
 if __name__ == "__main__":
   start_time = time.time()
   main()
@@ -15,6 +15,8 @@ class BatchConfig(bcfg):
         # Ranking is slow 
         self.setJobSettings("RankingTask" , BatchConfig.JobSettings(number_CPUs = 1, runtime = 3*3600))
         self.number_ranking_jobs = 200
+        # once fit times are recorded, fill the jobs up to 2 h (of the 3 h requested) rather than using all 200
+        self.ranking_job_runtime = 2*3600
 
         # Breakdown is slow 
         # ----------------------------------
@@ -42,12 +42,41 @@ class BatchConfig(metaclass=metaBatchConfig):
         # self.setJobSettings("RankingTask",BatchConfig.JobSettings(number_CPUs = 1,runtime=4*3600)) 
         self.ranking_job_settings = BatchConfig.JobSettings(number_CPUs = 1)
         self.number_ranking_jobs = 10
+        # impacts of previous runs, reused for the NPs whose part of the model did not change
+        # (None: output/{ws}/root-files/ranking.db, i.e. only reruns of the same workspace)
+        self.ranking_cache = None
+        # time (in seconds) that a ranking job should take, given the fit times recorded by earlier runs:
+        # fewer jobs are submitted if this is enough to do all the NPs (None: always number_ranking_jobs)
+        self.ranking_job_runtime = None
 
         # ----------------------------------
         # for breakdown
         # ----------------------------------
         self.categories_per_breakdown_job = -1 #-1: all
 
+        # ----------------------------------
+        # for likelihood scans
+        # ----------------------------------
+        # number of refinement rounds of the adaptive scan (0: scan a regular grid)
+        self.likelihood_scan_refinement_rounds = 0
+        # cells with a PNLL value below this are always refined (cells crossed by a contour are refined in any case)
+        self.likelihood_scan_nll_threshold = 0.5
+
+        # ----------------------------------
+        # for Condor/Torque
+        # ----------------------------------
+        # minimum time (in seconds) between two queries of the status of all submitted jobs
+        self.status_refresh_interval = 5
+
+        # ----------------------------------
+        # for local running
+        # ----------------------------------
+        # CPUs and memory (in MB) that jobs can be packed into (None: use what this machine has available)
+        self.local_number_CPUs = None
+        self.local_memory = None
+        # keep track of the peak memory used by each task and use it to pack the jobs of later runs
+        self.record_local_memory = False
+
         # dictionnary of job settings defined by the user (one setting per task)
         self._dict_jobSettings = {}
 
@@ -15,7 +15,7 @@ ROOT.gROOT.SetBatch(True)
 
 from argparse import ArgumentParser
 
-from plotLikelihoodLandscape import Plot1DProfile, Plot2DContours, Tree2Dict, RemoveOutliers, Interpolate, operator_namer
+from plotLikelihoodLandscape import Plot1DProfile, Plot2DContours, LoadLikelihoodLandscape, Interpolate, operator_namer
 from analysisPlottingConfig import Config
 import numpy as np
 
@@ -32,8 +32,7 @@ def compareLikelihoodLandscapes(infile_paths, legend, outfile_path, twodelta, ye
     bestfit = []
     domain_dims = []
     for cur_infile_path in infile_paths:
-        cur_data = Tree2Dict(cur_infile_path, "NLLscan")
-        cur_bestfit = Tree2Dict(cur_infile_path, "bestFit")
+        cur_data, cur_bestfit = LoadLikelihoodLandscape(cur_infile_path)
         cur_domain_dims = len([col for col in cur_data.keys() if "NLL" not in col])
 
         data.append(cur_data)
@@ -158,9 +157,8 @@ def compareLikelihoodLandscapes(infile_paths, legend, outfile_path, twodelta, ye
 
 
         for cur_color, cur_data, cur_bestfit, cur_leg in zip(color_library, data, bestfit, legend):
-            (new_xvals, new_yvals), new_zvals = RemoveOutliers(xvals = [cur_data[x_column], cur_data[y_column]],
-                                                               zvals = cur_data[NLL_column])
-            interpolated_data = Interpolate(xvals = new_xvals, yvals = new_yvals, zvals = new_zvals)
+            # outliers are already removed while loading
+            interpolated_data = Interpolate(xvals = cur_data[x_column], yvals = cur_data[y_column], zvals = cur_data[NLL_column])
             tmp_interpolated_data, tmp_minx, tmp_miny, wrongMin = renormalize_2D(interpolated_data, cur_leg)
             if(wrongMin):
                 plot_data.append(tmp_interpolated_data)
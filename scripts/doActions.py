@@ -3,7 +3,7 @@
 
 from argparse import ArgumentParser
 import BatchMgr as Mgr
-import os, re, itertools, ROOT
+import os, re, itertools, json, ROOT
 from contextlib import contextmanager
 
 try:
@@ -39,6 +39,10 @@ class BuildWorkspaceTask(Mgr.AtomicTask):
         super().__init__(name = BuildWorkspaceTask.ID, commands = commands, submit_dir = submit_dir,
                                                  log_dir = log_dir, prerequisites = get_prerequisites(other_tasks), settings = settings)
 
+        # the config file itself is part of the command, but not the input histograms it points to
+        self.inputs = [os.path.join("inputs", cutv)]
+        self.outputs = [os.path.join("output", ws_name, "workspaces")]
+
 # to run FitCrossChecks
 class FCCTask(Mgr.AtomicTask):
 
@@ -66,6 +70,9 @@ class FCCTask(Mgr.AtomicTask):
         super().__init__(name = FCCTask.ID, commands = commands, submit_dir = submit_dir, log_dir = log_dir, 
                                       prerequisites = get_prerequisites(other_tasks), settings = settings)
 
+        self.inputs = [os.path.join("output", ws_name, "workspaces", "combined")]
+        self.outputs = [os.path.join("output", ws_name, "fccs")]
+
 class doPlotFromWSTask(Mgr.AtomicTask):
 
     ID = "doPlotFromWS"
@@ -168,6 +175,9 @@ class BreakdownTask(Mgr.Task):
 
     ID = "breakdown"
 
+    # the jobs are built from the POIs in the workspace
+    generate_after_prerequisites = True
+
     def __init__(self, options, categories_per_job, log_dir, submit_dir, other_tasks, settings):
 
         def get_prerequisites(other_jobs):
@@ -243,22 +253,31 @@ class BreakdownTask(Mgr.Task):
 
         super().__init__(taskname = BreakdownTask.ID, job_generator = job_generator, prerequisites = get_prerequisites(other_tasks))
 
+def parse_ranking_options(options):
+    # mass, and data name with the optional snapshot to load
+    npopts = str(options).split(',')
+    mass = npopts[0]
+    dataName = "obsData"
+    if len(npopts) > 1:
+        dataName=npopts[1]
+    if len(npopts) > 2:
+        dataName += "," + npopts[2]
+    return mass, dataName
+
 class RankingJob(Mgr.WSMakerJob):
 
     ID = "ranking"
 
-    def __init__(self, options, num_total_jobs, num_job, log_dir, submit_dir, settings):
+    def __init__(self, options, num_total_jobs, num_job, log_dir, submit_dir, settings, cache = None, slices = None):
 
-        npopts = str(options).split(',')
-        mass = npopts[0]
-        dataName = "obsData"
-        if len(npopts) > 1:
-            dataName=npopts[1]
-        if len(npopts) > 2:
-            dataName += "," + npopts[2]
+        mass, dataName = parse_ranking_options(options)
 
         command = " ".join(["python", os.path.join(os.environ["WORKDIR"], "scripts/runNPranking.py"), ws_name, "--mass", mass, "--model_config", "ModelConfig", "--data", dataName, 
                             "--num_total_slices", str(num_total_jobs), "--num_slice", str(num_job)])
+        if cache is not None:
+            command += " --cache " + cache
+        if slices is not None:
+            command += " --slices " + slices
 
         super().__init__(name = f"{RankingJob.ID}_job_{num_job + 1}_of_{num_total_jobs}", commands = command, submit_dir = submit_dir, log_dir = log_dir,
                                          prerequisites = [], settings = settings)
@@ -267,24 +286,55 @@ class RankingTask(Mgr.Task):
 
     ID = "ranking"
 
-    def __init__(self, options, number_jobs, log_dir, submit_dir, other_tasks, settings):
+    # the NPs are shared among the jobs according to their cost, read from the workspace and earlier runs
+    generate_after_prerequisites = True
+
+    def __init__(self, options, number_jobs, log_dir, submit_dir, other_tasks, settings, cache = None, job_runtime = None):
 
         def get_prerequisites(other_tasks):
             # need to have existing workspace
             return [task for task in other_tasks if task.ID == BuildWorkspaceTask.ID]
     
         def job_generator():
+
+            from runNPranking import planSlices
+
             jobs = []
 
-            for cur_job in range(number_jobs):
+            mass, dataName = parse_ranking_options(options)
+            plan = planSlices(ws_name, mass, "ModelConfig", dataName, number_jobs, cache, job_runtime)
+            slices_path = os.path.join("output", ws_name, "root-files", "ranking_slices.json")
+            os.makedirs(os.path.dirname(slices_path), exist_ok = True)
+            with open(slices_path, "w") as outfile:
+                json.dump(plan, outfile)
+
+            self.plan = plan
+            for cur_job in range(len(plan["slices"])):
                 jobs.append(RankingJob(options = options, log_dir = log_dir, submit_dir = submit_dir,
-                                       num_total_jobs = number_jobs, num_job = cur_job,
-                                       settings = settings))
+                                       num_total_jobs = len(plan["slices"]), num_job = cur_job,
+                                       settings = settings, cache = cache, slices = slices_path))
 
             return jobs
 
         super().__init__(taskname = RankingTask.ID, prerequisites = get_prerequisites(other_tasks), job_generator = job_generator)
 
+        self.options = options
+        self.plan = None
+        self.inputs = [os.path.join("output", ws_name, "workspaces", "combined")]
+        # makeNPrankPlots also needs the total uncertainty
+        self.outputs = [os.path.join("output", ws_name, "root-files", "pulls"),
+                        os.path.join("output", ws_name, "root-files", "breakdown_add"),
+                        os.path.join("output", ws_name, "root-files", "ranking_fitresult.root")]
+
+    def fingerprint_commands(self):
+        # the plan given to the jobs depends on what earlier runs stored in the ranking cache, but the
+        # results only on the fingerprints of the model it carries
+        self.generate_jobs()
+        mass, dataName = parse_ranking_options(self.options)
+        command = " ".join(["python", os.path.join(os.environ["WORKDIR"], "scripts/runNPranking.py"), ws_name, "--mass", mass,
+                            "--model_config", "ModelConfig", "--data", dataName])
+        return [command, json.dumps(self.plan["fingerprints"], sort_keys = True)]
+
 class RankingPlotTask(Mgr.AtomicTask):
 
     ID = "ranking_plot"
@@ -324,6 +374,9 @@ class SignificanceTask(Mgr.AtomicTask):
         super().__init__(name = SignificanceTask.ID, commands = commands, submit_dir = submit_dir, log_dir = log_dir,
                                                prerequisites = get_prerequisites(other_tasks), settings = settings)        
 
+        self.inputs = [os.path.join("output", ws_name, "workspaces", "combined")]
+        self.outputs = [os.path.join("output", ws_name, "root-files", ("exp" if bool(int(conf[0])) else "obs") + "_p0")]
+
 class TablesTask(Mgr.AtomicTask):
 
     ID = "tables"
@@ -377,6 +430,58 @@ class RatiosTask(Mgr.AtomicTask):
         super().__init__(name = RatiosTask.ID, commands = " ".join(a), submit_dir = submit_dir, log_dir = log_dir,
                                          prerequisites = get_prerequisites(other_tasks), settings = settings)
 
+class PostfitProductsTask(Mgr.AtomicTask):
+    """ Plots, tables and ratio tables made by one job that loads the workspace only once """
+
+    ID = "postfitProducts"
+
+    def __init__(self, plot_options, table_options, ratio_options, ws_name, log_dir, submit_dir, other_tasks, settings):
+
+        def get_prerequisites(other_tasks):
+            # need to have existing fit results
+            return [task for task in other_tasks if task.ID == FCCTask.ID]
+
+        a = ["python", os.path.join(os.environ["WORKDIR"], "scripts/makePostfitProducts.py")]
+        user_args = []
+        mass = ''
+
+        if plot_options:
+            tokens = re.split('(;|@|!|&)', plot_options)
+            mass = tokens[tokens.index('@')+1] if '@' in tokens else mass
+            if '!' in tokens:
+                a += ['-f', tokens[tokens.index('!')+1]]
+            if '&' in tokens:
+                a.append('-s')
+            a += ['-p', tokens[0]]
+            if ';' in tokens:
+                user_args += [arg for arg in re.split(',', tokens[-1]) if arg != '']
+
+        if table_options:
+            tokens = re.split('(;|@)', table_options)
+            mass = tokens[tokens.index('@')+1] if '@' in tokens else mass
+            a += ['-t', tokens[0]]
+            if ';' in tokens:
+                user_args += [arg for arg in re.split(',', tokens[-1]) if arg != '']
+
+        if ratio_options:
+            tokens = re.split('(;|@)', ratio_options)
+            ws_name2 = tokens[0]
+            if ws_name2.lower() == "current": ws_name2 = ws_name
+            a += ['-a', tokens[2], '--ratio_workspace', ws_name2]
+            if tokens.count(';') > 1:
+                user_args += [arg for arg in re.split(',', tokens[-1]) if arg != '']
+
+        if mass != '':
+            a += ['-m', mass]
+        a.append(ws_name)
+        # the same user arguments can be given to several of the products
+        for user_arg in user_args:
+            if not user_arg in a:
+                a.append(user_arg)
+
+        super().__init__(name = PostfitProductsTask.ID, commands = " ".join(a), submit_dir = submit_dir, log_dir = log_dir,
+                                         prerequisites = get_prerequisites(other_tasks), settings = settings)
+
 class LimitTask(Mgr.AtomicTask):
 
     ID = "limit"
@@ -399,6 +504,9 @@ class LimitTask(Mgr.AtomicTask):
         super().__init__(name = LimitTask.ID, commands = " ".join(res), submit_dir = submit_dir, log_dir = log_dir,
                                         prerequisites = get_prerequisites(other_tasks), settings = settings)
 
+        self.inputs = [os.path.join("output", ws_name, "workspaces", "combined")]
+        self.outputs = [os.path.join("output", ws_name, "root-files", "exp" if bool(int(conf[0])) else "obs")]
+
 
 class ComparePullTask(Mgr.AtomicTask):
 
@@ -429,6 +537,9 @@ class LikelihoodScanTask(Mgr.Task):
 
     ID = "likelihood_scan"
 
+    # the scan ranges are taken from the POIs in the workspace
+    generate_after_prerequisites = True
+
     def __init__(self, options, ws_name, log_dir, submit_dir, other_tasks):
         
         def get_prerequisites(other_jobs):
@@ -516,9 +627,8 @@ class LikelihoodScanPlotsTask(Mgr.AtomicTask):
     def __init__(self, options, ws_name, log_dir, submit_dir, other_tasks, settings):
         
         def get_prerequisites(other_tasks):
-            # need to have the merged output files ready
-            from runLikelihoodLandscape import LikelihoodMergeJob
-            return [task for task in other_tasks if task.ID == LikelihoodMergeJob.ID]
+            # need to have the merged output files ready (i.e. the merge jobs of the scan)
+            return [task for task in other_tasks if task.ID == LikelihoodScanTask.ID]
         
         options = options.lower().split(',')
 
@@ -584,6 +694,8 @@ if __name__ == "__main__":
                         help="plot nuissance parameter ranking")
     parser.add_argument("--driver", dest = "driver", action = "store",
                         help = "where to run the jobs: 'local', 'condor' or 'torque'", default = "local")
+    parser.add_argument("--cache", dest = "cache", action = "store_true",
+                        help = "restore the outputs of tasks whose inputs did not change since an earlier run", default = False)
     
     args = parser.parse_args()
 
@@ -617,7 +729,14 @@ if __name__ == "__main__":
         tasks.append(FCCTask(fcc_options = args.fcc, log_dir = log_dir, submit_dir = submit_dir,
                            other_tasks = tasks, settings = batchconf.getJobSettings("FCCTask") ))
 
-    if args.plots:
+    # plots, tables and ratio tables share one workspace load if more than one of them is requested
+    postfit_products = len([opt for opt in [args.plots, args.tables, args.ratios] if opt]) > 1
+    if postfit_products:
+        tasks.append(PostfitProductsTask(plot_options = args.plots, table_options = args.tables, ratio_options = args.ratios,
+                                         ws_name = ws_name, log_dir = log_dir, submit_dir = submit_dir,
+                                         other_tasks = tasks, settings = batchconf.getJobSettings("PostfitProductsTask")))
+
+    if args.plots and not postfit_products:
         tasks.append(doPlotFromWSTask(plot_options = args.plots, log_dir = log_dir, submit_dir = submit_dir,
                                     other_tasks = tasks, settings = batchconf.getJobSettings("doPlotFromWSTask")))
 
@@ -631,7 +750,8 @@ if __name__ == "__main__":
 
     if args.NPranking:
         tasks.append(RankingTask(options = args.NPranking, number_jobs = batchconf.number_ranking_jobs, log_dir = log_dir, submit_dir = submit_dir, 
-                                 other_tasks = tasks, settings =  batchconf.getJobSettings("RankingTask")))
+                                 other_tasks = tasks, settings =  batchconf.getJobSettings("RankingTask"), cache = batchconf.ranking_cache,
+                                 job_runtime = batchconf.ranking_job_runtime))
 
     if args.NPrankingPlots:
         tasks.append(RankingPlotTask(options = args.NPrankingPlots, ws_name = ws_name, log_dir = log_dir,
@@ -641,7 +761,7 @@ if __name__ == "__main__":
         tasks.append(SignificanceTask(options = args.sig, log_dir = log_dir, submit_dir = submit_dir,
                                       other_tasks = tasks, settings = batchconf.getJobSettings("SignificanceTask")))
 
-    if args.tables:
+    if args.tables and not postfit_products:
         tasks.append(TablesTask(options = args.tables, log_dir = log_dir, submit_dir = submit_dir,
                                 other_tasks = tasks, settings = batchconf.getJobSettings("TablesTask")))        
 
@@ -653,7 +773,7 @@ if __name__ == "__main__":
         tasks.append(ComparePullTask(options = args.comparpull, ws_name = ws_name, log_dir = log_dir,
                                 submit_dir = submit_dir, other_tasks = tasks, settings = batchconf.getJobSettings("ComparePullTask")))
 
-    if args.ratios:
+    if args.ratios and not postfit_products:
         tasks.append(RatiosTask(options = args.ratios, ws_name = ws_name, log_dir = log_dir,
                                 submit_dir = submit_dir, other_tasks = tasks, settings = batchconf.getJobSettings("RatiosTask")))
         
@@ -667,6 +787,15 @@ if __name__ == "__main__":
 
     # ... and submit them
     drivers = {"local": Mgr.LocalJobSubmitter, "condor": Mgr.CondorJobSubmitter, "torque": Mgr.TorqueJobSubmitter}
-    Mgr.TaskScheduler.schedule(tasks, drivers[args.driver])
+    for cluster_driver in [Mgr.CondorJobSubmitter, Mgr.TorqueJobSubmitter]:
+        cluster_driver.status_cache.refresh_interval = batchconf.status_refresh_interval
+
+    Mgr.LocalJobSubmitter.number_CPUs = batchconf.local_number_CPUs
+    Mgr.LocalJobSubmitter.memory = batchconf.local_memory
+    if batchconf.record_local_memory:
+        Mgr.LocalJobSubmitter.memory_record_path = os.path.join("output", "local_job_memory.json")
+
+    result_cache = Mgr.ResultCache(os.path.join("output", ".cache")) if args.cache else None
+    Mgr.JobScheduler.schedule(tasks, drivers[args.driver], result_cache = result_cache)
 
     print(f"finished for {ws_name}")
@@ -11,6 +11,10 @@ import argparse
 import copy
 import logging
 import ctypes
+import hashlib
+import multiprocessing
+
+import numpy as np
 
 from ROOT import TFile, TH1, TCanvas, gROOT, gSystem, RooMsgService, gDirectory, TObject, TGraphAsymmErrors, TGraph
 from ROOT import RooArgSet, RooArgList, RooAddition, RooAbsData, RooAbsReal, RooHist, RooExpandedFitResult
@@ -32,16 +36,17 @@ import analysisPlottingConfig
 #       option 0 crash at the end needs to be fix
 
 # Spyros: Added mass as argument
-def main(cfg, version, mass, doSum):
+def main(cfg, version, mass, doSum, workspace=None):
     """ main function
 
     Parameters:
     * version: version of the workspace which we want to make plots with
     * directory: where to find FitCrossChecks.root that contains the RooFitResult
     * is_conditional, is_asimov, mu: describe the type of fit chosen for the FitResult
+    * workspace: (workspace, file) already opened by the caller, which keeps it open
     """
 
-    ws, rfr, suffix, plotdir, g, binDir = initialize(cfg, version, mass)
+    ws, rfr, suffix, plotdir, g, binDir = initialize(cfg, version, mass, workspace)
     save_h = False
 
     cfg._main_suffix = suffix
@@ -50,22 +55,29 @@ def main(cfg, version, mass, doSum):
 
     logging.info("Now start plotting")
     if doSum: makePlotsSums(cfg, ws, rfr, mass, binDir)
+    elif cfg.plot_workers > 1: makePlotsParallel(cfg, version, ws, mass, restrict_to = cfg.restrict_to, excludes = cfg.excludes)
     else: makePlots(cfg, ws, rfr, mass, restrict_to = cfg.restrict_to, excludes = cfg.excludes, bin_dir = binDir)
     for plotFunc in cfg.additionalPlots:
         plotFunc(cfg, ws, rfr, mass)
+    mkplots.finish_exports()
     logging.info("Plots made. Now exiting")
     cfg._save_plot_objs()
-    cfg._reset()
-    g.Close()
+    # a workspace given by the caller stays open for its next products
+    cfg._reset(keep_components = workspace is not None)
+    if workspace is None:
+        g.Close()
 
 
 # Spyros: Added mass as argument
-def initialize(cfg, version, mass):
+def initialize(cfg, version, mass, workspace=None):
     RooMsgService.instance().setGlobalKillBelow(RF.ERROR)
     gROOT.SetBatch(True)
     gSystem.Load("libWSMaker.so")
 
-    ws,g = getWorkspace(version, mass)
+    if workspace is None:
+        ws,g = getWorkspace(version, mass)
+    else:
+        ws,g = workspace
 
     logging.info("Preparing NP to the requested values")
     # Make postfit plots
@@ -85,12 +97,25 @@ def initialize(cfg, version, mass):
     binHist = getBinningDir(g)
 
     os.system("mkdir -vp "+plotdir)
-    cfg._yieldsfile = os.path.join(plotdir, f"Yields_{suffix}.yik")
-    cfg._plot_objs_file = os.path.join(plotdir, f"plotobjs_{suffix}.yik")
+    cfg._yieldsfile = os.path.join(plotdir, f"Yields_{suffix}.db")
+    cfg._plot_objs_file = os.path.join(plotdir, f"plotobjs_{suffix}.db")
+    cfg._cache_context = getCacheContext(g, rfr)
 
     return ws, rfr, suffix, plotdir, g, binHist
 
 
+def getCacheContext(wsfile, rfr, window=None):
+    """ Key of the cached yields and plot objects: workspace file, fit result and window """
+    context = hashlib.sha256()
+    info = os.stat(wsfile.GetName())
+    context.update(f"{os.path.abspath(wsfile.GetName())} {info.st_size} {info.st_mtime_ns}".encode())
+    for pars in (rfr.floatParsFinal(), rfr.constPars()):
+        for i in range(pars.getSize()):
+            context.update(f"{pars[i].GetName()} {pars[i].getVal()!r} {pars[i].getError()!r}".encode())
+    context.update(repr(window).encode())
+    return context.hexdigest()
+
+
 def getWorkspace(version, mass):
     wsf = os.path.join("output", str(version), "workspaces" , "combined", str(mass))
     wsf += ".root"
@@ -255,23 +280,44 @@ def getFitResult(cfg):
     return rfr, suffix
 
 
-def getComponents(cfg, w):
+def getRegionNames(cfg, w, restrict_to=[], excludes=[]):
+    """ Names of the regions of the workspace, filtered on sub-strings as restrict_to and excludes """
+    simPdf = w.pdf('combPdf' if cfg.dataname=='combData' else "simPdf")
+    regions = []
+    for tt in simPdf.indexCat():
+        ttname = tt.first
+        if len(restrict_to)>0 and not True in (r in ttname for r in restrict_to):
+            continue
+        if len(excludes)>0 and True in (r in ttname for r in excludes):
+            continue
+        regions.append(ttname)
+    return regions
+
+
+def getComponents(cfg, w, regions=None):
     """ Fetch all components (data, MC pdfs...) for a given workspace
     Organize all of this in a map
+
+    If regions are given, only the missing components of these regions are built. The map of
+    all components built so far is kept in cfg._comps and returned.
     """
     iscomb=cfg.dataname=='combData' # SKC
     mc = w.obj("ModelConfig")
     data = w.data(cfg.dataname)
     simPdf = w.pdf('combPdf'if iscomb else "simPdf")
     channelCat = simPdf.indexCat()
-    chanName = channelCat.GetName()
 
-    comps = {}
+    if cfg._comps is None:
+        cfg._comps = {}
+    comps = cfg._comps
 
     for tt in channelCat:
         ttname = tt.first
+        if ttname in comps or (regions is not None and ttname not in regions):
+            continue
+        datasets = getSplitData(cfg, data, channelCat)
         pdftmp  = simPdf.getPdf( ttname )
-        datatmp = data.reduce(f"{chanName}=={chanName}::{ttname}")
+        datatmp = datasets[ttname]
         obs  = pdftmp.getObservables( mc.GetObservables() ).first()
         obs_set = RooArgSet(obs)
         # somehow binWidth contains the inverse of bin width... strange
@@ -279,15 +325,6 @@ def getComponents(cfg, w):
         logging.debug(f"    Inverse of Bin Width : {binWidth.getVal()}")
         comps[ttname] = [obs, binWidth, datatmp, {}, pdftmp]
 
-        binning = obs.getBinning()
-        stepsize = binning.averageBinWidth()
-        low = binning.lowBound()
-        high = binning.highBound()
-        m = low
-        while m<(high-1e-6):
-            obs.setRange("bin"+str(m), m, m+stepsize)
-            m += stepsize
-
         bkgList = RooArgList()
         sigList = RooArgList()
         totList = RooArgList()
@@ -335,28 +372,41 @@ def getComponents(cfg, w):
     return comps
 
 
-def getYields(cfg, w, rfr=None, onlyTot=False, window=None):
+def getSplitData(cfg, data, channelCat):
+    """ Split the combined dataset into one dataset per category, in a single pass over the data
+    The split is kept in cfg, such that it is done only once per dataset
+    """
+    if cfg._split_data is None or cfg._split_data[0] != data.GetName():
+        logging.info(f"Splitting dataset {data.GetName()} by {channelCat.GetName()}")
+        datalist = data.split(channelCat, True)
+        cfg._split_data = (data.GetName(), {d.GetName(): d for d in datalist})
+    return cfg._split_data[1]
+
+
+def getYields(cfg, w, rfr=None, onlyTot=False, window=None, regions=None):
     """ Give map of yields (each category and total) for current snapshot of workspace
     If RooFitResult is given, the errors are computed
     If onlyTot = True, error is computed only on the sum of MC
+    If regions are given, only the yields in these regions are computed
     """
-    if cfg._comps is None:
-        cfg._comps = getComponents(cfg, w)
-
-    comps = cfg._comps
+    comps = getComponents(cfg, w, regions)
+    if regions is not None:
+        comps = {ttname: comps[ttname] for ttname in regions}
 
     if window:
         logging.info(f"Will compute weights in window {window}")
 
-    cfg._read_yields()
+    cfg._read_yields(regions)
     yields = cfg._yields
-    if len(cfg._yields)>0 and rfr is None:
+    if len(cfg._yields)>0 and rfr is None and all(ttname in cfg._yields for ttname in comps):
         return cfg._yields
 
     if onlyTot:
         comp_rfr = None
     else:
         comp_rfr = rfr
+    # errors still to be computed, all in one go at the end
+    pending = []
     for ttname,comptt in comps.items():
         logging.info(f"    Computing yields for category : {ttname}")
         obs_set = RooArgSet(comptt[0])
@@ -370,23 +420,35 @@ def getYields(cfg, w, rfr=None, onlyTot=False, window=None):
 
         for compname, comp in comptt[3].items():
             if compname != "MC":
-                yieldsChan[compname] = getValueAndError(cfg, comptt[0], comp, comptt[1], comp_rfr, ttname, window)
+                yieldsChan[compname] = getValueAndError(cfg, comptt[0], comp, comptt[1], comp_rfr, ttname, window, pending)
             else:
-                yieldsChan[compname] = getValueAndError(cfg, comptt[0], comp, comptt[1], rfr, ttname, window)
-            if compname == "Signal" and cfg._muhat:
-                yieldsChan["SignalExpected"] = [y/cfg._muhat for y in yieldsChan[compname]]
+                yieldsChan[compname] = getValueAndError(cfg, comptt[0], comp, comptt[1], rfr, ttname, window, pending)
 
         yieldsChan["S/B"] = yieldsChan["Signal"][0] / yieldsChan["Bkg"][0]
         yieldsChan["S/sqrt(S+B)"] = yieldsChan["Signal"][0] / (yieldsChan["Bkg"][0]+yieldsChan["Signal"][0])**.5
         yields[ttname] = yieldsChan
+
+    if len(pending) > 0:
+        logging.info(f"Propagating the fit errors to {len(pending)} yields")
+        errors = getPropagatedErrors([compInt for ttname, compname, compInt in pending], rfr)
+        for (ttname, compname, compInt), error in zip(pending, errors):
+            yields[ttname][compname][1] = error
+            logging.info(f"Found {yields[ttname][compname][0]} +/- {error} for {compname} in region {ttname}")
+
+    if cfg._muhat:
+        for ttname in comps:
+            yields[ttname]["SignalExpected"] = [y/cfg._muhat for y in yields[ttname]["Signal"]]
     cfg._yields = yields
     cfg._save_yields()
 
     return yields
 
 
-def getValueAndError(cfg, obs, comp, binWidth, rfr, ttname, window=None):
-    """ Try to be clever and not re-compute something that has already been computed """
+def getValueAndError(cfg, obs, comp, binWidth, rfr, ttname, window=None, pending=None):
+    """ Try to be clever and not re-compute something that has already been computed
+    If a list 'pending' is given, the error is not computed here: the integral is added
+    to the list instead, such that all errors can be computed at once
+    """
     obs_set = RooArgSet(obs)
     compname = comp.GetName()
     bwidth = binWidth.getVal()
@@ -412,11 +474,75 @@ def getValueAndError(cfg, obs, comp, binWidth, rfr, ttname, window=None):
                     compInt = comp.createIntegral(obs_set, RF.Range("myrange"))
                 else:
                     compInt = comp.createIntegral(obs_set)
-            error = ROOT.RU.getPropagatedError(compInt, rfr)
+            if pending is not None:
+                pending.append((ttname, compname, compInt))
+                logging.info(f"Found {Ntemp} for {compname} in region {ttname}, error to be computed")
+                return [Ntemp, error]
+            error = getPropagatedErrors([compInt], rfr)[0]
     logging.info(f"Found {Ntemp} +/- {error} for {compname} in region {ttname}")
     return [Ntemp, error]
 
 
+# covariance matrix of the last fit result seen, with the fit result it was read from
+_covariance = [None, None]
+
+
+def getCovarianceMatrix(rfr):
+    """ Covariance matrix of the floating parameters of rfr, as a numpy array
+
+    It is read in one go, and only once per fit result: every error band and yield needs it.
+    """
+    if _covariance[0] is not rfr:
+        cov = rfr.covarianceMatrix()
+        n = cov.GetNrows()
+        _covariance[:] = [rfr, np.frombuffer(cov.GetMatrixArray(), count=n*n).reshape(n, n).copy()]
+    return _covariance[1]
+
+
+def getPropagatedErrors(funcs, rfr, rsa=None):
+    """ Linearly propagated errors on all funcs at once, as in RU::getPropagatedError
+
+    Every floating parameter of the fit result is varied by +/- 1 sigma only once, and all
+    functions that depend on it are evaluated. With F the matrix of these variations and C
+    the correlation matrix of the fit, the variances are the diagonal of F C F^T.
+    If rsa is given, only the parameters in it are considered.
+    """
+    fpf = rfr.floatParsFinal()
+    nparams = fpf.getSize()
+    index = {fpf[i].GetName(): i for i in range(nparams)}
+
+    # find the parameters each function depends on
+    instances = {}
+    dependents = [[] for i in range(nparams)]
+    for k, func in enumerate(funcs):
+        for par in func.getObservables(fpf):
+            name = par.GetName()
+            if name not in index or (rsa is not None and not rsa.find(name)):
+                continue
+            instances.setdefault(index[name], par)
+            dependents[index[name]].append(k)
+
+    V = getCovarianceMatrix(rfr)
+    sigmas = np.sqrt(np.clip(np.diag(V), 0, None))
+
+    F = np.zeros((len(funcs), nparams))
+    for i, deps in enumerate(dependents):
+        if len(deps) == 0 or sigmas[i] == 0:
+            continue
+        par = instances[i]
+        cenVal = fpf[i].getVal()
+        par.setVal(cenVal + sigmas[i])
+        plusVar = np.array([funcs[k].getVal() for k in deps])
+        par.setVal(cenVal - sigmas[i])
+        minusVar = np.array([funcs[k].getVal() for k in deps])
+        par.setVal(cenVal)
+        F[deps, i] = (plusVar - minusVar) / 2
+
+    norm = np.where(sigmas > 0, sigmas, 1)
+    C = V / np.outer(norm, norm)
+    return np.sqrt(np.clip(np.einsum('ki,ij,kj->k', F, C, F), 0, None))
+
+
 # TODO: delete or move
 def getSumAndError(list_comps, rfr, window=None):
     """ list_comps: list of tuples (obs, bwidth, comp)
@@ -435,7 +561,7 @@ def getSumAndError(list_comps, rfr, window=None):
     roosum = RooAddition("sum", "sum", complist, widthlist)
     val = roosum.getVal()
     if rfr is not None:
-        error = ROOT.RU.getPropagatedError(roosum, rfr)
+        error = getPropagatedErrors([roosum], rfr)[0]
     else:
         error = -1
     return [val, error]
@@ -470,6 +596,62 @@ def makePlots(cfg, w, rfr, mass, restrict_to=[], excludes=[], bin_dir=None):
     logging.info("End plotting distributions!")
 
 
+def makePlotsParallel(cfg, version, w, mass, restrict_to=[], excludes=[]):
+    """ Same as makePlots, with the regions shared among cfg.plot_workers processes
+
+    Each worker opens the workspace and loads the fit result once, then makes the plot
+    objects and plots of one region at a time. The plot objects and yields of all regions
+    are sent back and merged into the caches of cfg.
+    """
+    plotdir = cfg._main_plotdir
+    os.system("mkdir -vp "+plotdir)
+
+    regions = getRegionNames(cfg, w, restrict_to, excludes)
+
+    cfg._read_yields()
+    if cfg._plot_objs is None:
+        cfg._read_plot_objs()
+
+    logging.info(f"Plotting Distributions for {len(regions)} subchannels with {cfg.plot_workers} processes")
+
+    # the workers are forked, such that they get cfg as it is
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(cfg.plot_workers, initializer=_initPlotWorker, initargs=(cfg, version, mass)) as pool:
+        for ttname, yields, objs in pool.imap_unordered(_plotRegion, regions):
+            logging.info(f"Done with region {ttname}")
+            cfg._yields[ttname] = yields
+            cfg._plot_objs[ttname] = objs
+
+    cfg._save_yields()
+    logging.info("End plotting distributions!")
+
+
+# state of a worker process of makePlotsParallel
+_plot_worker = {}
+
+
+def _initPlotWorker(cfg, version, mass):
+    # start from a clean state: everything is re-made from this worker's own workspace
+    cfg._comps = None
+    cfg._split_data = None
+    cfg._yields = None
+    cfg._plot_objs = None
+    # only the main process writes the caches, and the workers print their own plots
+    cfg._read_only_caches = True
+    cfg.export_workers = 0
+    cfg._caches = {}
+    ws, rfr, suffix, plotdir, g, binDir = initialize(cfg, version, mass)
+    _plot_worker.update(cfg=cfg, ws=ws, rfr=rfr, mass=mass, file=g, bin_dir=binDir)
+
+
+def _plotRegion(ttname):
+    cfg = _plot_worker["cfg"]
+    objs_dict = getAllPlotObjects(cfg, _plot_worker["ws"], _plot_worker["rfr"], cfg._main_is_prefit,
+                                  cfg._main_suffix, cfg._main_plotdir, regions=[ttname])
+    plot(cfg, objs_dict[ttname], ttname, _plot_worker["mass"], plot_bkgsub = False, bin_dir=_plot_worker["bin_dir"])
+    return ttname, cfg._yields[ttname], objs_dict[ttname]
+
+
 # TODO: delete or move
 def makepTbinsPlots(w, rfr, is_prefit, suffix, plotdir, yields = None, save_hists = False):
     """ Plot VpT distributions in each tag region """
@@ -647,30 +829,7 @@ def plotSumOfCats(cfg, w, rfr, mass, suffix, plotdir, save_hists, list_objs, lis
             res["error"] = cfg._plot_objs[error_name]
         else:
             #print "JWH: did not find in cfg._plot_objs"
-            mc = w.obj("ModelConfig")
-            it_b = mc.GetParametersOfInterest().createIterator()
-            n_b = it_b.Next()
-            POIs = []
-            while n_b:
-                POIs.append(n_b.getVal())
-                n_b = it_b.Next()
-            it_m = mc.GetParametersOfInterest().createIterator()
-            if cfg.draw_error_band_on_b_only:
-                n_m = it_m.Next()
-                while n_m:
-                    n_m.setVal(0)
-                    n_m = it_m.Next()
-            NPs = RooArgList(mc.GetNuisanceParameters())
-            if not cfg.draw_error_band_on_b_only:
-                NPs.add(mc.GetParametersOfInterest())
-            res["error"] = getSumErrorBand(list_comps, rfr, weights, RooArgSet(NPs))
-            it_a = mc.GetParametersOfInterest().createIterator()
-            n_a = it_a.Next()
-            i = 0
-            while n_a:
-                n_a.setVal(POIs[i])
-                i += 1
-                n_a = it_a.Next()
+            res["error"] = getErrorBand(cfg, w, list_comps, rfr, weights)
             cfg._plot_objs[error_name] = res["error"]
             # print res["error"]
             # for i in range(res["error"].GetN()):
@@ -830,7 +989,11 @@ def makePlotsSumsCR(w, rfr, is_prefit, suffix, plotdir, save_hists = False):
     print( "End plotting distributions !")
 
 
-def getPlotObjects(cfg, w, obs, pdf, data, components, ttyields, fitres=None, objs={}):
+def getPlotObjects(cfg, w, obs, pdf, data, components, ttyields, fitres=None, objs={}, comptt=None):
+    """ Histograms of the components, data, chi2 and, if fitres is given, error band of a region
+
+    comptt is the entry of the region in cfg._comps, that the error band is computed from
+    """
     frm = obs.frame()
 
     for comp in components:
@@ -858,20 +1021,32 @@ def getPlotObjects(cfg, w, obs, pdf, data, components, ttyields, fitres=None, ob
         objs["chi2"] = chi2
 
     if fitres is not None and "error" not in objs:
-        data.plotOn(frm,RF.DataError(RooAbsData.Poisson))
-        mc = w.obj("ModelConfig")
-        prev_mu = mc.GetParametersOfInterest().first().getVal()
-        if cfg.draw_error_band_on_b_only:
-            mc.GetParametersOfInterest().first().setVal(0)
-        pdf.plotOn(frm, RF.VisualizeError(fitres,1), RF.Name("FitError_AfterFit"),
-                   RF.Normalization(1, RooAbsReal.RelativeExpected))
-        mc.GetParametersOfInterest().first().setVal(prev_mu)
-        c = frm.getCurve()
-        objs["error"] = c
+        objs["error"] = getErrorBand(cfg, w, [comptt], fitres)
 
     return objs
 
 
+def getErrorBand(cfg, w, comps_list, rfr, weights=None):
+    """ Postfit error band of the (weighted) sum of the MC in the regions of comps_list
+
+    The band is computed bin by bin from the covariance of rfr. With draw_error_band_on_b_only,
+    the POIs are set to 0 and only the NPs are varied.
+    """
+    mc = w.obj("ModelConfig")
+    pois = RooArgList(mc.GetParametersOfInterest())
+    prev_vals = [pois[i].getVal() for i in range(pois.getSize())]
+    NPs = RooArgList(mc.GetNuisanceParameters())
+    if cfg.draw_error_band_on_b_only:
+        for i in range(pois.getSize()):
+            pois[i].setVal(0)
+    else:
+        NPs.add(pois)
+    band = getSumErrorBand(comps_list, rfr, weights, RooArgSet(NPs))
+    for i, val in enumerate(prev_vals):
+        pois[i].setVal(val)
+    return band
+
+
 # TODO: Elisabeth's stuff
 def sumPlotObjects(objs_list, weights=None):
     res = {}
@@ -958,8 +1133,6 @@ def getBinByBinErrorBand(mc_comps, observables, binWidths, rfr, weights=None, rs
         return None
     bins = []
     binning = observables[0].getBinning()
-    stepsize = binning.averageBinWidth()
-    low = binning.lowBound()
     high = binning.highBound()
     real_weights = RooArgList()
     if weights is not None:
@@ -968,18 +1141,28 @@ def getBinByBinErrorBand(mc_comps, observables, binWidths, rfr, weights=None, rs
     else:
         for bw in binWidths:
             real_weights.add(RF.RooConst(bw.getVal()))
-    m = low
-    while m < high - 1e-6:
-        rname = "bin"+str(m)
+    rnames = [defineBinRanges(obs) for obs in observables][0]
+    # keep all integrals alive until the errors of all bins have been computed together
+    all_intes = []
+    totbins = []
+    for rname in rnames:
         intes = RooArgList()
         for obs, mc in zip(observables, mc_comps):
-            intes.add(mc.createIntegral(RooArgSet(obs), RF.Range(rname)))
-        totbin = RooAddition("sumbin", "sumbin", intes, real_weights)
-        val = totbin.getVal()
-        err = ROOT.RU.getPropagatedError(totbin, rfr, rsa)
-        bins.append((val, err))
+            inte = mc.createIntegral(RooArgSet(obs), RF.Range(rname))
+            all_intes.append(inte)
+            intes.add(inte)
+        all_intes.append(intes)
+        totbins.append(RooAddition("sumbin", "sumbin", intes, real_weights))
+    errs = getPropagatedErrors(totbins, rfr, rsa)
+    for totbin, err in zip(totbins, errs):
+        bins.append((totbin.getVal(), err))
         logging.debug(f"Found error of {err}")
-        m += stepsize
+    return makeErrorBandCurve(bins, [binning.binLow(i) for i in range(len(bins))], high)
+
+
+def makeErrorBandCurve(bins, binLows, high):
+    """ Outline of the band given by the (value, error) of bins, as a curve RooFit would make """
+    low = binLows[0]
     # NM 19-07-11
     # Need to add lots of useless stuff to mimic what RooFit creates, so it can be rebinned
     # It may look wrong, but please trust me...
@@ -987,7 +1170,7 @@ def getBinByBinErrorBand(mc_comps, observables, binWidths, rfr, weights=None, rs
     xvals = [low-1, low-1]
     for i,b in enumerate(bins):
         yvals.extend([b[0]+b[1], b[0]+b[1]])
-        xvals.extend([binning.binLow(i), binning.binLow(i)])
+        xvals.extend([binLows[i], binLows[i]])
     xvals.extend([high, high, high, high+1, high+1])
     yvals.extend([0, 0, 0, 0,   0, 0, 0, 0])
     xvals.extend(reversed(xvals))
@@ -1004,6 +1187,26 @@ def getBinByBinErrorBand(mc_comps, observables, binWidths, rfr, weights=None, rs
     return curve
 
 
+def defineBinRanges(obs):
+    """ Define one range named bin<low edge> per bin of obs, unless it was already done
+
+    Returns the names of the ranges, in the order of the bins
+    """
+    binning = obs.getBinning()
+    stepsize = binning.averageBinWidth()
+    low = binning.lowBound()
+    high = binning.highBound()
+    defined = obs.hasRange("bin"+str(low))
+    names = []
+    m = low
+    while m<(high-1e-6):
+        names.append("bin"+str(m))
+        if not defined:
+            obs.setRange(names[-1], m, m+stepsize)
+        m += stepsize
+    return names
+
+
 def getPrefitCurve(cfg, w, obs=None, pdf=None, regname=None):
     w.loadSnapshot("vars_initial")
     mc = w.obj("ModelConfig")
@@ -1086,32 +1289,32 @@ def getMCerror(w, rfr, regname):
     return error
 
 
-def getAllPlotObjects(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], excludes=[]):
-    """ returns a map of plot objects, indexed by category name """
+def getAllPlotObjects(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], excludes=[], regions=None):
+    """ returns a map of plot objects, indexed by category name
+    If regions are given, only the plot objects of exactly these regions are made and returned
+    """
     if is_prefit:
         logging.info("Loading initial snapshot")
         w.loadSnapshot("vars_initial")
     else:
         logging.info("Loading final snapshot")
         w.loadSnapshot("vars_final")
-    getYields(cfg, w)
+    # only build what is needed for the regions to plot
+    selection = regions
+    if selection is None and (len(restrict_to)>0 or len(excludes)>0):
+        selection = getRegionNames(cfg, w, restrict_to, excludes)
+    getYields(cfg, w, regions=selection)
     yields = cfg._yields
-    if cfg._comps is None:
-        cfg._comps = getComponents(cfg, w)
-    comps = cfg._comps
+    comps = getComponents(cfg, w, selection)
     if cfg._plot_objs is None:
-        cfg._read_plot_objs()
+        cfg._read_plot_objs(selection)
     objs_dict = cfg._plot_objs
 
     logging.info("Getting Distributions for each subchannel")
 
     for ttname, comptt in comps.items():
-        if len(restrict_to)>0:
-            if not True in (r in ttname for r in restrict_to):
-                continue
-        if len(excludes)>0:
-            if True in (r in ttname for r in excludes):
-                continue
+        if selection is not None and ttname not in selection:
+            continue
         objs = objs_dict.get(ttname, {})
 
         logging.info(f"Gathering plot primitives for region {ttname}")
@@ -1125,7 +1328,7 @@ def getAllPlotObjects(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], e
                             and k!="S/sqrt(S+B)"}
         # objs = getPlotObjects(cfg, obs, pdftmp, datatmp, individual_comps.values(), yields[ttname], rfr, objs)
         # FIXME: JWH test
-        objs = getPlotObjects(cfg, w, obs, pdftmp, datatmp, list(individual_comps.values()), yields[ttname], rfr, objs)
+        objs = getPlotObjects(cfg, w, obs, pdftmp, datatmp, list(individual_comps.values()), yields[ttname], rfr, objs, comptt)
         # if doing postfit, add the prefit line
         if not is_prefit and "prefit" not in objs:
             histo, mulegend = getPrefitCurve(cfg, w, obs, pdftmp)
@@ -1141,6 +1344,9 @@ def getAllPlotObjects(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], e
 
     cfg._save_plot_objs()
 
+    if regions is not None:
+        return {k: copy.deepcopy(objs_dict[k]) for k in regions if k in objs_dict}
+
     to_remove = []
     if len(restrict_to)>0:
         for k in objs_dict:
@@ -1170,54 +1376,49 @@ def plot(cfg, objs, ttname, mass, plot_bkgsub=True, ybounds=(0.4, 1.6), bin_dir=
     suffix = cfg._main_suffix
     plotdir = cfg._main_plotdir
     save_hists = cfg._main_save_hists
-    sm = mkplots.SetupMaker(cfg, ttname, mass, muhat = cfg._muhat, guess_properties = True, bin_dir=bin_dir, bin_hName=bin_hName)
-    #for i in range(objs["error"].GetN()):
-        #print "JWH: objs[\"error\"](x,y) = ({},{})".format(objs["error"].GetX()[i], objs["error"].GetY()[i])
-    if 'mass' in objs:
-        sm.add('mass', objs['mass'])
-    for k,v in objs.items():
-        logging.info(f"... {k}")
-        sm.add(getCompName(k), v)
-
-    # first, standard plot
-    cname = ttname +"_"+suffix
-    if ttname.endswith("weighted"):
-        can = sm.setup.make_complete_plot(cname, True, ytitle = "Weighted events",ybounds = ybounds, draw_difference = plot_bkgsub)
-        canlog = sm.setup.make_complete_plot(cname+'_logy', True,True, ytitle = "Weighted events",ybounds = ybounds, draw_difference = plot_bkgsub)
-    else:
-        can = sm.setup.make_complete_plot(cname, True, ybounds = ybounds, draw_difference = plot_bkgsub)
-        canlog = sm.setup.make_complete_plot(cname+'_logy', True,True, ybounds = ybounds, draw_difference = plot_bkgsub)
-    plotname = f"{plotdir}/{can.GetName()}"
-
-    if plot_bkgsub:
-        # then, bkg-subtracted plot
-        cname2 = ttname +"_BkgSub_"+suffix
-        can2 = sm.setup.make_bkg_substr_plot(cname2)
-        plotname2 = f"{plotdir}/{can2.GetName()}"
-    for f in cfg.formats:
-        print( plotname+'.'+f)
-        can.Print(plotname+'.'+f)
-        canlog.Print(plotname+'log.'+f)
-        if plot_bkgsub:
-            can2.Print(plotname2+'.'+f)
-    # save histograms if requested
-    if save_hists:
-        afile = TFile.Open(plotname+".root", "recreate")
-        can.Write(can.GetName())
-        canlog.Write(canlog.GetName())
-        if plot_bkgsub:
-            can2.Write(can.GetName())
+    # canvases and all the objects cloned for them are deleted once the plots are printed
+    with mkplots.PlotArena(cfg, ttname):
+        sm = mkplots.SetupMaker(cfg, ttname, mass, muhat = cfg._muhat, guess_properties = True, bin_dir=bin_dir, bin_hName=bin_hName)
+        #for i in range(objs["error"].GetN()):
+            #print "JWH: objs[\"error\"](x,y) = ({},{})".format(objs["error"].GetX()[i], objs["error"].GetY()[i])
+        if 'mass' in objs:
+            sm.add('mass', objs['mass'])
         for k,v in objs.items():
-            if isinstance(v, TObject):
-                v.Write(v.GetName())
-            if k == "prefit":
-                v[0].Write(v[0].GetName())
+            logging.info(f"... {k}")
+            sm.add(getCompName(k), v)
+
+        # first, standard plot
+        cname = ttname +"_"+suffix
+        if ttname.endswith("weighted"):
+            can = sm.setup.make_complete_plot(cname, True, ytitle = "Weighted events",ybounds = ybounds, draw_difference = plot_bkgsub)
+            canlog = sm.setup.make_complete_plot(cname+'_logy', True,True, ytitle = "Weighted events",ybounds = ybounds, draw_difference = plot_bkgsub)
+        else:
+            can = sm.setup.make_complete_plot(cname, True, ybounds = ybounds, draw_difference = plot_bkgsub)
+            canlog = sm.setup.make_complete_plot(cname+'_logy', True,True, ybounds = ybounds, draw_difference = plot_bkgsub)
+        plotname = f"{plotdir}/{can.GetName()}"
 
-    if plot_bkgsub:
-        can2.Close()
-    # free memory for some objects used in the plotting...
-    mkplots.purge()
-    # TODO check for things not deleted
+        if plot_bkgsub:
+            # then, bkg-subtracted plot
+            cname2 = ttname +"_BkgSub_"+suffix
+            can2 = sm.setup.make_bkg_substr_plot(cname2)
+            plotname2 = f"{plotdir}/{can2.GetName()}"
+        mkplots.export(cfg, can, [plotname+'.'+f for f in cfg.formats])
+        mkplots.export(cfg, canlog, [plotname+'log.'+f for f in cfg.formats])
+        if plot_bkgsub:
+            mkplots.export(cfg, can2, [plotname2+'.'+f for f in cfg.formats])
+        # save histograms if requested
+        if save_hists:
+            afile = TFile.Open(plotname+".root", "recreate")
+            can.Write(can.GetName())
+            canlog.Write(canlog.GetName())
+            if plot_bkgsub:
+                can2.Write(can.GetName())
+            for k,v in objs.items():
+                if isinstance(v, TObject):
+                    v.Write(v.GetName())
+                if k == "prefit":
+                    v[0].Write(v[0].GetName())
+            afile.Close()
 
 
 def getBinningDir(f):
@@ -1258,6 +1459,8 @@ if __name__ == "__main__":
     parser.set_defaults(sum = False)
     parser.add_argument('--remove-gamma', help = "prevent gammas from being transfered",
                         default = False, dest = 'remove_gamma', action = 'store_true')
+    parser.add_argument('-j', '--workers', type = int, default = None,
+                        help = "number of processes that share the regions to plot (default: plot_workers of the config)", dest = 'workers')
     args, pass_to_user = parser.parse_known_args()
 
     cfg = analysisPlottingConfig.Config(pass_to_user)
@@ -1281,6 +1484,8 @@ if __name__ == "__main__":
     cfg._fcc_directory = fcc
 
     cfg.remove_gamma = args.remove_gamma
+    if args.workers is not None:
+        cfg.plot_workers = args.workers
 
     for mode in modes:
         if mode == 0:
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+
+import os
+import sys
+import argparse
+import logging
+from ROOT import gROOT, gSystem
+import ROOT
+
+import doPlotFromWS as plots
+import makeTables as tables
+import makeRatioTables as ratios
+import runFitCrossCheck
+import analysisPlottingConfig
+
+
+def setFitMode(cfg, mode):
+    """ Choose the fit result the way the -p/-t modes of doPlotFromWS and makeTables do """
+    if mode == 0:
+        cfg._main_is_prefit = True
+        return True
+    cfg._main_is_prefit = False
+    cfg._is_asimov = False
+    if mode == 1:
+        cfg._is_conditional = True
+        cfg._mu = 0
+    elif mode == 2:
+        cfg._is_conditional = False
+        cfg._mu = 1
+    elif mode == 3:
+        cfg._is_conditional = True
+        cfg._mu = 1
+    else:
+        logging.warning(f"Mode {mode} is not recognized!")
+        return False
+    return True
+
+
+def setRatioMode(cfg, algnum):
+    """ Choose the fit results the way the -t modes of makeRatioTables do """
+    if algnum == 'p':
+        cfg._main_is_prefit = True
+        return
+    alg = runFitCrossCheck.available_algs[int(algnum)]
+    cfg._is_conditional = alg[3] == "true"
+    cfg._is_asimov = "Asimov" in alg[0]
+    cfg._mu = int(alg[1])
+    cfg._main_is_prefit = False
+
+
+def main(cfg, version, mass, plot_modes=[], table_modes=[], ratio_modes=[], ratio_ws=None, doSum=False):
+    """ Make the plots, tables and ratio tables of a workspace, opening it only once
+
+    For each fit, the tables are made first, then the plots from the same components and yields.
+    The ratio tables only read the yields stored by these.
+    """
+    ws, g = plots.getWorkspace(version, mass)
+
+    for mode in sorted(set(plot_modes) | set(table_modes)):
+        if not setFitMode(cfg, mode):
+            continue
+        if mode in table_modes:
+            logging.info(f"Doing tables for mode {mode}")
+            tables.main(cfg, version, mass, workspace = (ws, g))
+        if mode in plot_modes:
+            logging.info(f"Doing plots for mode {mode}")
+            plots.main(cfg, version, mass, doSum, workspace = (ws, g))
+
+    cfg._reset()
+    g.Close()
+
+    for algnum in ratio_modes:
+        logging.info(f"Doing ratio tables for mode {algnum}")
+        setRatioMode(cfg, algnum)
+        ratios.main(cfg, version, ratio_ws)
+
+
+if __name__ == "__main__":
+
+    gROOT.LoadMacro("$WORKDIR/macros/AtlasStyle.C")
+    gSystem.Load("libWSMaker.so")
+    wdir = os.environ["WORKDIR"]
+    gROOT.ProcessLine("#include \""+wdir+"/WSMaker/roofitUtils.hpp\"")
+    ROOT.SetAtlasStyle()
+
+    class MyParser(argparse.ArgumentParser):
+        def error(self, message=None):
+            sys.stderr.write('error: %s\n' % message)
+            self.print_help()
+            sys.exit(2)
+
+    parser = MyParser(description='Create plots, tables and ratio tables from a given workspace, loading it only once.',
+                      formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('workspace', help = 'workspace/{name}/{something}/{mass}.root -> pass {name}')
+    parser.add_argument('-m', '--mass', type = int, default = 125,
+                        help = 'workspace/{name}/{something}/{mass}.root -> pass {mass}', dest = 'mass')
+    parser.add_argument('-p', '--plot_modes', default = '',
+                        help = "Comma-separated list of plots to create, as in doPlotFromWS", dest = 'plot_modes')
+    parser.add_argument('-t', '--table_modes', default = '',
+                        help = "Comma-separated list of tables to create, as in makeTables", dest = 'table_modes')
+    parser.add_argument('-a', '--ratio_modes', default = '',
+                        help = "Comma-separated list of ratio tables to create, as in makeRatioTables", dest = 'ratio_modes')
+    parser.add_argument('--ratio_workspace', default = None,
+                        help = "workspace to divide by in the ratio tables (default: this one)", dest = 'ratio_ws')
+    parser.add_argument('-f', '--fitres', help = "fit results to use (fcc directory)", default = None, dest = 'fitres')
+    parser.add_argument('-d', '--dataname', help = "data name in WS (default obsData)", default = 'obsData', dest = 'dataname')
+    parser.add_argument('-s', '--sum', help = "make sum plots",
+                        dest = 'sum', action = 'store_true')
+    parser.set_defaults(sum = False)
+    parser.add_argument('--remove-gamma', help = "prevent gammas from being transfered",
+                        default = False, dest = 'remove_gamma', action = 'store_true')
+    parser.add_argument('-j', '--workers', type = int, default = None,
+                        help = "number of processes that share the regions to plot (default: plot_workers of the config)", dest = 'workers')
+    args, pass_to_user = parser.parse_known_args()
+
+    cfg = analysisPlottingConfig.Config(pass_to_user)
+
+    wsname = args.workspace
+    plot_modes = [int(s) for s in args.plot_modes.split(',') if s != '']
+    table_modes = [int(s) for s in args.table_modes.split(',') if s != '']
+    ratio_modes = [s for s in args.ratio_modes.split(',') if s != '']
+    ratio_ws = args.ratio_ws if args.ratio_ws is not None else wsname
+
+    cfg.dataname = args.dataname
+    fitres = args.fitres
+    if fitres is None:
+        fitres = wsname
+
+    if os.path.sep in fitres:
+        fcc = fitres
+    else:
+        fcc = "output/"+fitres+"/fccs"
+
+    cfg._fcc_directory = fcc
+
+    cfg.remove_gamma = args.remove_gamma
+    if args.workers is not None:
+        cfg.plot_workers = args.workers
+
+    main(cfg, wsname, args.mass, plot_modes, table_modes, ratio_modes, ratio_ws, args.sum)
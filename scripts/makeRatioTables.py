@@ -116,10 +116,10 @@ def main(cfg, ws1, ws2):
         print("INFO: Create prefit-fit table.")
 
     if cfg.window:
-        cfg._yieldsfile = os.path.join(plotdir1, "Yields_{}_{}_{}.yik".format(suffix1, cfg.window[0],
+        cfg._yieldsfile = os.path.join(plotdir1, "Yields_{}_{}_{}.db".format(suffix1, cfg.window[0],
                                                                                         cfg.window[1]))
     else:
-        cfg._yieldsfile = os.path.join(plotdir1, f"Yields_{suffix1}.yik")
+        cfg._yieldsfile = os.path.join(plotdir1, f"Yields_{suffix1}.db")
     print(cfg._yieldsfile)
     cfg._read_yields()
     #plots.sumPTbins()
@@ -127,10 +127,10 @@ def main(cfg, ws1, ws2):
     yields1 = sumBins(cfg, yields1)
     cfg._reset()
     if cfg.window:
-        cfg._yieldsfile = os.path.join(plotdir2, "Yields_{}_{}_{}.yik".format(suffix2, cfg.window[0],
+        cfg._yieldsfile = os.path.join(plotdir2, "Yields_{}_{}_{}.db".format(suffix2, cfg.window[0],
                                                                                         cfg.window[1]))
     else:
-        cfg._yieldsfile = os.path.join(plotdir2, f"Yields_{suffix2}.yik")
+        cfg._yieldsfile = os.path.join(plotdir2, f"Yields_{suffix2}.db")
     print(cfg._yieldsfile)
     cfg._read_yields()
     #plots.sumPTbins()
@@ -12,14 +12,17 @@ import analysisPlottingConfig
 from AtlasRounding import atlasRound
 
 
-def main(cfg, version, mass):
+def main(cfg, version, mass, workspace=None):
     RooMsgService.instance().setGlobalKillBelow(RF.ERROR)
     gROOT.SetBatch(True)
     gSystem.Load("libWSMaker.so")
 
     cfg.tables = True
 
-    ws,g = plots.getWorkspace(version, mass)
+    if workspace is None:
+        ws,g = plots.getWorkspace(version, mass)
+    else:
+        ws,g = workspace
     if not cfg._main_is_prefit: # if directory is present, then assumes we want postfit
         rfr, suffix = plots.getFitResult(cfg)
         plots.transferResults(cfg, ws, rfr)
@@ -37,10 +40,11 @@ def main(cfg, version, mass):
     os.system("mkdir -vp "+plotdir)
 
     if cfg.window:
-        cfg._yieldsfile = os.path.join(plotdir, "Yields_{}_{}_{}.yik".format(suffix, cfg.window[0],
+        cfg._yieldsfile = os.path.join(plotdir, "Yields_{}_{}_{}.db".format(suffix, cfg.window[0],
                                                                                     cfg.window[1]))
     else:
-        cfg._yieldsfile = os.path.join(plotdir, f"Yields_{suffix}.yik")
+        cfg._yieldsfile = os.path.join(plotdir, f"Yields_{suffix}.db")
+    cfg._cache_context = plots.getCacheContext(g, rfr, cfg.window)
     plots.getYields(cfg, ws, rfr, window=cfg.window)
     raw_yields = cfg._yields
 
@@ -97,8 +101,9 @@ def main(cfg, version, mass):
     f = open(latexfile, 'w')
     f.write(final_text)
     f.close()
-    g.Close()
-    cfg._reset()
+    if workspace is None:
+        g.Close()
+    cfg._reset(keep_components = workspace is not None)
 
 
 def make_pretty_yields_map(cfg, yields):
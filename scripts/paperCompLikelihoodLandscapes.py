@@ -15,7 +15,7 @@ ROOT.gROOT.SetBatch(True)
 
 from argparse import ArgumentParser
 
-from plotLikelihoodLandscape import Plot2DContours, Tree2Dict, RemoveOutliers, Interpolate, operator_namer, _drawText
+from plotLikelihoodLandscape import Plot2DContours, LoadLikelihoodLandscape, Interpolate, operator_namer, _drawText
 from analysisPlottingConfig import Config
 import numpy as np
 from array import array
@@ -158,8 +158,7 @@ def paperCompLikelihoodLandscapes(lin_infile_paths, quad_infile_paths, outfile_p
     legend = []
 
     for cur_infile_path in lin_infile_paths:
-        cur_data = Tree2Dict(cur_infile_path, "NLLscan")
-        cur_bestfit = Tree2Dict(cur_infile_path, "bestFit")
+        cur_data, cur_bestfit = LoadLikelihoodLandscape(cur_infile_path)
         cur_domain_dims = len([col for col in cur_data.keys() if "NLL" not in col])
         if "Asimov" in cur_infile_path:
             dset.append("Asimov")
@@ -175,8 +174,7 @@ def paperCompLikelihoodLandscapes(lin_infile_paths, quad_infile_paths, outfile_p
         legend.append("Linear ")
 
     for cur_infile_path in quad_infile_paths:
-        cur_data = Tree2Dict(cur_infile_path, "NLLscan")
-        cur_bestfit = Tree2Dict(cur_infile_path, "bestFit")
+        cur_data, cur_bestfit = LoadLikelihoodLandscape(cur_infile_path)
         cur_domain_dims = len([col for col in cur_data.keys() if "NLL" not in col])
         if "Asimov" in cur_infile_path:
             dset.append("Asimov")
@@ -301,9 +299,8 @@ def paperCompLikelihoodLandscapes(lin_infile_paths, quad_infile_paths, outfile_p
         ylabel = operator_namer(y_column, plotconf)
 
         for cur_color, cur_data, cur_bestfit in zip(color_library, data, bestfit):
-            (new_xvals, new_yvals), new_zvals = RemoveOutliers(xvals = [cur_data[x_column], cur_data[y_column]],
-                                                               zvals = cur_data[NLL_column])
-            interpolated_data = Interpolate(xvals = new_xvals, yvals = new_yvals, zvals = new_zvals)
+            # outliers are already removed while loading
+            interpolated_data = Interpolate(xvals = cur_data[x_column], yvals = cur_data[y_column], zvals = cur_data[NLL_column])
             plot_data.append(interpolated_data)
             colors.append(cur_color)
             lw.append(3)
@@ -0,0 +1,165 @@
+import os
+import pickle
+import sqlite3
+import logging
+
+
+class KeyedCache:
+    """ On-disk store of the yields or plot objects of doPlotFromWS, one entry per (region, component)
+
+    runNPranking also uses it for the impacts of the NPs, one region per NP, each with its own context.
+
+    Every entry carries the context it was computed in (workspace, fit result, window), see
+    doPlotFromWS.getCacheContext. Entries of another context are stale: they are never read back
+    in that context, and saveEntries drops them as soon as it writes entries of a new one, such
+    that readers that take every entry (makeRatioTables) only see the last context.
+    Entries are read and written one by one, so only the regions that are needed are loaded, and
+    only the ones that changed are written back. Several processes can share the same file.
+    """
+
+    # to be increased whenever the layout of the stored values changes
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def _connect(self):
+        if self._db is not None:
+            return self._db
+        try:
+            self._db = self._open()
+        except sqlite3.OperationalError:
+            # locked or not accessible: the file may well be fine, and in use by another process
+            raise
+        except sqlite3.DatabaseError:
+            logging.warning(f"{self.path} is not a valid cache. Regenerate it.")
+            os.remove(self.path)
+            self._db = self._open()
+        return self._db
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout = 600)
+        # check the version and make the table under the write lock, such that two processes
+        # opening the file at the same time cannot drop what the other one has just written
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                db.execute("DROP TABLE IF EXISTS entries")
+                db.execute(f"PRAGMA user_version = {self.version}")
+            db.execute("""CREATE TABLE IF NOT EXISTS entries (region TEXT, component TEXT, context TEXT,
+                          value BLOB, PRIMARY KEY (region, component))""")
+            db.commit()
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def read(self, context = None, regions = None, components = None):
+        """ Entries of the given regions and components (all if None) as {region: {component: pickled value}}
+
+        If context is None, the entries are taken whatever the context they were computed in
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        query = "SELECT region, component, value FROM entries"
+        conditions = []
+        args = []
+        if context is not None:
+            conditions.append("context = ?")
+            args.append(context)
+        if regions is not None:
+            conditions.append("region IN ({})".format(",".join("?"*len(regions))))
+            args += list(regions)
+        if components is not None:
+            conditions.append("component IN ({})".format(",".join("?"*len(components))))
+            args += list(components)
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+
+        res = {}
+        for region, component, value in self._connect().execute(query, args):
+            res.setdefault(region, {})[component] = value
+        return res
+
+    def contexts(self):
+        """ Context of every entry, as {(region, component): context} """
+        if not os.path.isfile(self.path):
+            return {}
+        query = "SELECT region, component, context FROM entries"
+        return {(region, component): context for region, component, context in self._connect().execute(query)}
+
+    def write(self, context, entries, drop_others = False):
+        """ Store entries given as (region, component, pickled value)
+
+        If drop_others, the entries of any other context are removed in the same transaction
+        """
+        with self._connect() as db:
+            if drop_others:
+                db.execute("DELETE FROM entries WHERE context != ?", (context,))
+            db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                           ((region, component, context, value) for region, component, value in entries))
+
+    def merge(self, path):
+        """ Copy all the entries of the cache file path into this one, replacing the ones with the same keys """
+        if not os.path.isfile(path):
+            return
+        # brings the other file to the current version, dropping its entries if it is older
+        other = KeyedCache(path)
+        other._connect()
+        other.close()
+        db = self._connect()
+        db.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            with db:
+                db.execute("INSERT OR REPLACE INTO entries SELECT region, component, context, value FROM other.entries")
+        finally:
+            db.execute("DETACH DATABASE other")
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def loadEntries(cache, context = None, regions = None):
+    """ Unpickle the entries of cache. Returns the values and the pickled entries they come from
+
+    Whole-region values are stored under the empty component.
+    """
+    values = {}
+    blobs = {}
+    for region, comps in cache.read(context, regions).items():
+        for component, blob in comps.items():
+            blobs[(region, component)] = blob
+            if component == "":
+                values[region] = pickle.loads(blob)
+            else:
+                values.setdefault(region, {})[component] = pickle.loads(blob)
+    return values, blobs
+
+
+def saveEntries(cache, context, values, blobs):
+    """ Write back the entries of values that differ from the pickled blobs they were read from
+
+    Dictionaries are stored one entry per component, anything else as a whole-region value.
+    The entries of any other context are dropped. blobs is updated with what is written.
+    """
+    changed = []
+    for region, value in values.items():
+        if isinstance(value, dict):
+            items = value.items()
+        else:
+            items = [("", value)]
+        for component, v in items:
+            blob = pickle.dumps(v)
+            if blobs.get((region, component)) != blob:
+                changed.append((region, component, blob))
+                blobs[(region, component)] = blob
+    if len(changed) > 0:
+        cache.write(context, changed, drop_others = True)
+    return len(changed)
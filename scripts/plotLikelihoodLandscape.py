@@ -357,37 +357,62 @@ def Plot1DProfile(xvals, yvals, labels, colors, outfile_path, twodelta, xlabel =
 
     canv.SaveAs(outfile_path)
 
-def Tree2Dict(treefile_path, tree_name = "NLLscan"):
-    if not os.path.exists(treefile_path):
-        raise OSError(f"Error: file '{treefile_path}' does not exist!")
+# scan points with larger PNLL values play no role for the contours
+outlier_cut = "NLL < 50"
 
+# arrays already read from the trees, to be shared among all plots made in one go
+_loaded_trees = {}
+
+def GetTreeColumns(treefile_path, tree_name = "NLLscan"):
     infile = ROOT.TFile(treefile_path, 'READ')
     ROOT.SetOwnership(infile, False)
     intree = infile.Get(tree_name)
 
     available_columns = [key.GetName() for key in intree.GetListOfBranches()]
-    retdict = {col: [] for col in available_columns}
-
-    for row in intree:
-        for col in available_columns:
-            retdict[col].append(getattr(row, col))
 
     infile.Close()
-    return retdict
+    return available_columns
 
-def RemoveOutliers(xvals, zvals, cut = lambda xval, zval: True if zval < 50 else False):
-    new_xvals = []
-    new_zvals = []
+def Tree2Dict(treefile_path, tree_name = "NLLscan", selection = None):
+    """
+    Read all branches of a tree into numpy arrays in one go, keeping only the entries
+    that pass 'selection' (if given). Each tree is read only once, later calls get the
+    same arrays.
+    """
+    if not os.path.exists(treefile_path):
+        raise OSError(f"Error: file '{treefile_path}' does not exist!")
+
+    key = (os.path.abspath(treefile_path), os.path.getmtime(treefile_path), tree_name, selection)
+    if key not in _loaded_trees:
+        available_columns = GetTreeColumns(treefile_path, tree_name)
+
+        frame = ROOT.RDataFrame(tree_name, treefile_path)
+        if selection:
+            frame = frame.Filter(selection)
+
+        _loaded_trees[key] = {col: np.asarray(vals) for col, vals in frame.AsNumpy(available_columns).items()}
+
+    # callers may replace columns, but not touch the shared arrays
+    return dict(_loaded_trees[key])
+
+def LoadLikelihoodLandscape(infile_path):
+    """
+    Load the PNLL scan and the best-fit point stored in 'infile_path'. Scans in more
+    than one POI are only used to draw contours, so their outliers are dropped already
+    while reading.
+    """
+    x_columns = [col for col in GetTreeColumns(infile_path, "NLLscan") if "NLL" not in col]
+    selection = outlier_cut if len(x_columns) > 1 else None
 
-    xvals = list(map(list, zip(*xvals)))
+    return Tree2Dict(infile_path, "NLLscan", selection = selection), Tree2Dict(infile_path, "bestFit")
 
-    for ind, cur_zval in enumerate(zvals):
-        if cut(xvals[ind], zvals[ind]):
-            new_xvals.append(xvals[ind])
-            new_zvals.append(zvals[ind])
+def RemoveOutliers(xvals, zvals, cut = lambda xvals, zvals: zvals < 50):
+    # 'cut' acts on all points at once and returns the mask of points to keep
+    xvals = np.asarray(xvals)
+    zvals = np.asarray(zvals)
 
-    new_xvals = list(map(list, zip(*new_xvals)))
-    return new_xvals, new_zvals
+    mask = cut(xvals, zvals)
+    return list(xvals[:, mask]), zvals[mask]
 
 def Interpolate(xvals, yvals, zvals, number_points = 64.0):
     from scipy.interpolate import griddata
@@ -484,14 +509,12 @@ def PlotLikelihoodLandscape(data_infile, asimov_infile, plot_outdir, year = "605
     bestfit = {}
 
     if os.path.exists(data_infile):
-        data_NLL = Tree2Dict(data_infile, "NLLscan")
-        data_bestfit = Tree2Dict(data_infile, "bestFit")
+        data_NLL, data_bestfit = LoadLikelihoodLandscape(data_infile)
         data["data"] = data_NLL
         bestfit["data"] = data_bestfit
 
     if os.path.exists(asimov_infile):
-        asimov_NLL = Tree2Dict(asimov_infile, "NLLscan")
-        asimov_bestfit = Tree2Dict(asimov_infile, "bestFit")
+        asimov_NLL, asimov_bestfit = LoadLikelihoodLandscape(asimov_infile)
         data["asimov"] = asimov_NLL
         bestfit["asimov"] = asimov_bestfit
 
@@ -640,10 +663,8 @@ def PlotLikelihoodLandscape(data_infile, asimov_infile, plot_outdir, year = "605
                 return [],0.0,0.0,False
 
         for cur_name, cur_data in data.items():
-            # take the loaded data and interpolate it onto a very fine grid
-            (new_xvals, new_yvals), new_zvals = RemoveOutliers(xvals = [cur_data[x_column], cur_data[y_column]],
-                                                               zvals = cur_data[NLL_column])
-            interpolated_data = Interpolate(xvals = new_xvals, yvals = new_yvals, zvals = new_zvals)
+            # take the loaded data (outliers are already removed) and interpolate it onto a very fine grid
+            interpolated_data = Interpolate(xvals = cur_data[x_column], yvals = cur_data[y_column], zvals = cur_data[NLL_column])
 
             tmp_interpolated_data, tmp_minx, tmp_miny, wrongMin = renormalize_2D(interpolated_data, cur_name)
             if(wrongMin):
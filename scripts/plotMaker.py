@@ -17,6 +17,9 @@ import bisect
 import logging
 import re
 import random
+import resource
+import tempfile
+import multiprocessing
 
 import ROOT
 
@@ -281,8 +284,7 @@ class Setup:
             cname = "can"
         print( cname)
         logging.info(f'plotting {cname}')
-        tc = ROOT.TCanvas(cname, cname, 600, 600)
-        if draw_difference : tc = ROOT.TCanvas(cname, cname, 600, 800)
+        tc = new_canvas(cname, 600, 800 if draw_difference else 600)
         if do_ratio:
             up, do = divide_canvas(tc, 0.25)
             if draw_difference : up, do = divide_canvas(tc, 0.40)
@@ -501,7 +503,7 @@ class Setup:
             cname = "can"
         logging.info(f"plotting {cname}")
 
-        tc = ROOT.TCanvas(cname, cname, 600, 600)
+        tc = new_canvas(cname, 600, 600)
         if do_ratio:
             up, do = divide_canvas(tc, 0.25)
             up.cd()
@@ -1787,7 +1789,7 @@ def clone(hist):
 def draw(obj, opt=""):
     """ Draw something that will stay, even when current file is closed or function returns """
     # if is already released, do not clone/release
-    if obj in pointers_in_the_wild:
+    if obj in pointers_in_the_wild or any(obj in arena.pointers for arena in arenas):
         obj.Draw(opt)
     elif obj.InheritsFrom("TH1"):
         clone(obj).Draw(opt)
@@ -1798,10 +1800,21 @@ pointers_in_the_wild = set()
 def release(obj):
     """ Tell python that no, we don't want to lose this one when current function returns """
     global pointers_in_the_wild
-    pointers_in_the_wild.add(obj)
+    if len(arenas) > 0:
+        arenas[-1].add(obj)
+    else:
+        pointers_in_the_wild.add(obj)
     ROOT.SetOwnership(obj, False)
     return obj
 
+def new_canvas(cname, width, height):
+    """ Create a canvas, which belongs to the current PlotArena if there is one """
+    tc = ROOT.TCanvas(cname, cname, width, height)
+    if len(arenas) > 0:
+        arenas[-1].canvases.append(tc)
+        ROOT.SetOwnership(tc, False)
+    return tc
+
 def purge():
     """ Delete all objects that we took control of """
     global pointers_in_the_wild
@@ -1811,6 +1824,143 @@ def purge():
     pointers_in_the_wild.clear()
 
 
+export_pool = None
+pending_exports = []
+def export(cfg, tc, paths):
+    """ Print canvas tc to each of paths
+
+    With cfg.export_workers > 0, the canvas is written once to a temporary ROOT file, and
+    printed by a pool of background processes, such that the next plot can be made meanwhile.
+    finish_exports() waits for them.
+    """
+    global export_pool
+    for path in paths:
+        logging.info(f"exporting {path}")
+    if cfg.export_workers <= 0:
+        for path in paths:
+            tc.Print(path)
+        return
+    if export_pool is None:
+        export_pool = multiprocessing.get_context("fork").Pool(cfg.export_workers)
+    fd, filename = tempfile.mkstemp(prefix="canvas_", suffix=".root")
+    os.close(fd)
+    # gDirectory must not be left pointing to the closed file, the plots that follow create their objects in it
+    with ROOT.TDirectory.TContext():
+        f = ROOT.TFile.Open(filename, "recreate")
+        tc.Write(tc.GetName())
+        f.Close()
+    pending_exports.append(export_pool.apply_async(print_saved_canvas, (filename, tc.GetName(), paths)))
+
+def print_saved_canvas(filename, cname, paths):
+    """ Print the canvas cname saved in filename to each of paths, then remove filename """
+    ROOT.gROOT.SetBatch(True)
+    f = ROOT.TFile.Open(filename)
+    tc = f.Get(cname)
+    for path in paths:
+        tc.Print(path)
+    f.Close()
+    os.remove(filename)
+
+def finish_exports():
+    """ Wait until all canvases given to export() are printed """
+    global export_pool
+    for res in pending_exports:
+        res.get()
+    pending_exports.clear()
+    if export_pool is not None:
+        export_pool.close()
+        export_pool.join()
+        export_pool = None
+
+
+arenas = []
+class PlotArena:
+    """ Owner of the ROOT objects made for one plot
+
+    While the arena is open, the objects released by clone/draw/release and the canvases
+    made by new_canvas belong to it. They are all deleted when it is closed, after which
+    cfg.report_plot_memory is given the memory used by the process, and its peak while the
+    arena was open.
+    """
+    def __init__(self, cfg=None, name=""):
+        self.cfg = cfg
+        self.name = name
+        self.objects = []
+        self.pointers = set()
+        self.canvases = []
+        self.peak_rss = 0.
+
+    def __enter__(self):
+        # the arenas this one is nested in keep the peak reached so far, before it is reset
+        peak_rss = memory_usage()[1]
+        for arena in arenas:
+            arena.peak_rss = max(arena.peak_rss, peak_rss)
+        reset_peak_memory()
+        arenas.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def add(self, obj):
+        if not obj in self.pointers:
+            self.pointers.add(obj)
+            self.objects.append(obj)
+
+    def close(self):
+        """ Delete the objects, then the canvases that showed them """
+        if self in arenas:
+            arenas.remove(self)
+        for p in reversed(self.objects):
+            if p:
+                p.Delete()
+        self.objects = []
+        self.pointers.clear()
+        for tc in self.canvases:
+            tc.Close()
+            tc.Delete()
+        self.canvases = []
+        rss, peak_rss = memory_usage()
+        self.peak_rss = max(self.peak_rss, peak_rss)
+        for arena in arenas:
+            arena.peak_rss = max(arena.peak_rss, self.peak_rss)
+        if self.cfg is not None:
+            self.cfg.report_plot_memory(self.name, rss, self.peak_rss)
+
+
+def reset_peak_memory():
+    """ Restart the peak of memory_usage from the current resident memory. Returns whether it could be done
+
+    Only possible on Linux. Elsewhere the peak stays the one over the lifetime of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def memory_usage():
+    """ Current and peak resident memory of this process, in MB
+
+    The peak is the one since the last reset_peak_memory, if /proc provides it.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    rss = peak_rss
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024.
+                elif line.startswith("VmHWM:"):
+                    peak_rss = int(line.split()[1]) / 1024.
+    except (OSError, IndexError, ValueError):
+        pass
+    return rss, peak_rss
+
+
 def getPropertiesFromTag(cfg, regname):
     """ decompose a region name in nleptons, ntags, njets, VpT, year, distribution... with WSMaker 2 conventions """
     """ SKC: added some hacks to deal with some WSMaker <2 conventions """
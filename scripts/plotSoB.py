@@ -6,9 +6,11 @@ import sys
 import doPlotFromWS
 import plotMaker
 import ROOT
-import math
+import numpy as np
 import analysisPlottingConfig
 import logging
+from ROOT import RooArgSet, RooArgList, RooAddition
+from ROOT import RooFit as RF
 
 def main(version, directory=None, is_conditional=False, is_asimov=False, mu=None):
 
@@ -22,16 +24,128 @@ def main(version, directory=None, is_conditional=False, is_asimov=False, mu=None
     ws, rfr,  suffix, plotdir, g, binHist = doPlotFromWS.initialize(cfg, version, 125)
     #makeSoBPlot(ws, rfr, is_prefit=is_prefit, suffix=suffix, plotdir=plotdir)
 
-    for ratioType in [0, 1, 2]:
-        makeSoBPlot(cfg, ws, rfr, is_prefit=cfg._main_is_prefit, suffix=suffix, plotdir=plotdir, restrict_to=[], ratioType=ratioType)
+    makeSoBPlot(cfg, ws, rfr, is_prefit=cfg._main_is_prefit, suffix=suffix, plotdir=plotdir, restrict_to=[], ratioTypes=[0, 1, 2])
 
+    plotMaker.finish_exports()
     print("Plots made. Now exiting")
     g.Close()
     cfg._save_plot_objs()
     cfg._reset()
 
-def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioType = 0):
-    """ Plot distributions for each subchannel """
+def getBinContents(h):
+    """ Contents of the bins of h as an array, without under- and overflows """
+    n = h.GetNbinsX()
+    dtype = {"TH1D": np.float64, "TH1F": np.float32}.get(h.ClassName())
+    if dtype is None:
+        return np.array([h.GetBinContent(i) for i in range(1, n+1)])
+    return np.frombuffer(h.GetArray(), dtype=dtype, count=n+2)[1:n+1].astype(np.float64)
+
+
+def getSoBInputs(cfg, objs_dict):
+    """ Signal, background, data and individual backgrounds of all bins of all regions, as flat arrays """
+    regions = []
+    bins = []
+    sig = []
+    bkg = []
+    data = []
+    bkgs = {}
+    nbins = 0
+    for ttname, objs in objs_dict.items():
+        if ttname.endswith("error"): # FIXME what's that for already ? looks useless nowadys
+            continue
+        # Now do the plots
+        #sm = plotMaker.SetupMaker(cfg, ttname, 125, muhat = cfg._muhat)
+        sm = plotMaker.SetupMaker(cfg, ttname, 0, muhat = cfg._muhat)
+        if 'mass' in objs:
+            sm.add('mass', objs['mass'])
+        for k,v in objs.items():
+            print("...", k)
+            sm.add(doPlotFromWS.getCompName(k), v)
+        res = sm.setup.finish_initialize()
+        try:
+            sig.append(getBinContents(sm.setup.sig_to_use.h))
+        except:
+            print("WARNING: No signal in category", ttname)
+            continue
+        data.append(getBinContents(sm.setup.data.hist))
+        bkg.append(getBinContents(sm.setup.hsum))
+        n = len(data[-1])
+        regions.append(np.full(n, ttname, dtype=object))
+        bins.append(np.arange(1, n+1))
+        # complete list of backgrounds
+        for b in sm.setup.bkgs:
+            if not b.name in bkgs:
+                bkgs[b.name] = {}
+            bkgs[b.name][len(regions)-1] = getBinContents(b.h)
+        nbins += n
+
+    def concat(arrays):
+        return np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0)
+
+    inputs = {"region": concat(regions), "bin": concat(bins).astype(int),
+              "sig": concat(sig), "bkg": concat(bkg), "data": concat(data), "bkgs": {}}
+    for name, contents in bkgs.items():
+        inputs["bkgs"][name] = concat([contents.get(i, np.zeros(len(r))) for i, r in enumerate(regions)])
+    return inputs
+
+
+def getSoBErrorBand(cfg, w, rfr, regions, bins, sob_bins, hmodel):
+    """ Band of the postfit uncertainty on the total MC in each bin of the S/B plot
+
+    The MC integrals of all the analysis bins entering an S/B bin are summed, and the errors of
+    all the sums are propagated at once from the covariance of rfr. As for getErrorBand, with
+    draw_error_band_on_b_only the POIs are set to 0 and only the NPs are varied.
+    """
+    nbins = hmodel.GetNbinsX()
+    comps = doPlotFromWS.getComponents(cfg, w, set(regions))
+    mc = w.obj("ModelConfig")
+    pois = RooArgList(mc.GetParametersOfInterest())
+    prev_vals = [pois[i].getVal() for i in range(pois.getSize())]
+    NPs = RooArgList(mc.GetNuisanceParameters())
+    if cfg.draw_error_band_on_b_only:
+        for i in range(pois.getSize()):
+            pois[i].setVal(0)
+    else:
+        NPs.add(pois)
+    # keep all integrals alive until the errors have been computed
+    keep_alive = []
+    intes = [RooArgList() for i in range(nbins)]
+    weights = [RooArgList() for i in range(nbins)]
+    for ttname, b, sob_bin in zip(regions, bins, sob_bins):
+        if sob_bin > nbins:
+            continue
+        obs, binWidth = comps[ttname][0], comps[ttname][1]
+        rname = doPlotFromWS.defineBinRanges(obs)[b-1]
+        inte = comps[ttname][3]["MC"].createIntegral(RooArgSet(obs), RF.Range(rname))
+        bw = RF.RooConst(binWidth.getVal())
+        keep_alive += [inte, bw]
+        intes[sob_bin-1].add(inte)
+        weights[sob_bin-1].add(bw)
+    totbins = [RooAddition(f"sob_bin{i}", f"sob_bin{i}", intes[i], weights[i]) for i in range(nbins)]
+    errs = doPlotFromWS.getPropagatedErrors(totbins, rfr, RooArgSet(NPs))
+    bands = [(totbin.getVal(), err) for totbin, err in zip(totbins, errs)]
+    for i, val in enumerate(prev_vals):
+        pois[i].setVal(val)
+    return doPlotFromWS.makeErrorBandCurve(bands, [hmodel.GetBinLowEdge(i) for i in range(1, nbins+1)],
+                                           hmodel.GetXaxis().GetXmax())
+
+
+def makeSoBHistogram(hmodel, name, sob_bins, contents, sumw2=True):
+    """ Histogram of contents, filled in the bins sob_bins of hmodel. The underflow goes to the first bin """
+    h = hmodel.Clone(name)
+    h.Sumw2(sumw2)
+    size = h.GetNbinsX() + 2
+    sumw = np.bincount(sob_bins, contents, minlength=size)
+    sumw2s = np.bincount(sob_bins, contents**2, minlength=size)
+    for i in range(1, size):
+        h.SetBinContent(i, sumw[i])
+        if sumw2:
+            h.SetBinError(i, sumw2s[i]**.5)
+    return h
+
+
+def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioTypes=[0]):
+    """ Plot the bins of all subchannels in bins of log10(S/B) """
 
     os.system("mkdir -vp "+plotdir)
     objs_dict = doPlotFromWS.getAllPlotObjects(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to)
@@ -42,14 +156,6 @@ def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioTy
     xmax = 0.35
     xwidth = 0.35
     nbins = 11
-    yMinRatio = 0
-    yMaxRatio = 2.5
-    if ratioType == 1:
-        yMinRatio = -2.5
-        yMaxRatio = 9.5
-    if ratioType == 2:
-        yMinRatio = -2.5
-        yMaxRatio = 3.5
 
     if "VHbbRun2" in os.getenv("ANALYSISTYPE") :
         cfg.isSoBplot = True
@@ -61,14 +167,6 @@ def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioTy
     #xmax = 0.5
     #xwidth = 0.5
     #nbins = (int) ((xmax - xmin + 1e-3) / xwidth) *2
-    #yMinRatio = 0
-    #yMaxRatio = 2.5
-    #if ratioType is 1:
-    #  yMinRatio = -2.5
-    #  yMaxRatio = 12.5
-    # if ratioType is 2:
-    #  yMinRatio = -2.5
-    #  yMaxRatio = 3.5
     #end for VZ
 
     hmodel = ROOT.TH1F("h","h",nbins,xmin,xmax)
@@ -77,83 +175,41 @@ def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioTy
     #hmodel.GetYAxis().SetRange(5,10e7)
     hmodel.SetMinimum(5.0)
 
-    # need several copies of these hists if we want to superimpose the plots for different mus
-    hdata = hmodel.Clone("hdata")
-    hdata.Sumw2(False)
-    hsig = hmodel.Clone("hsig")
-    hbkg = hmodel.Clone("hbkg")
-    hsig.Sumw2(True)
-    hbkg.Sumw2(True)
-    #hsig_exp = hmodel.Clone("hsigexp")
-    origin = [[] for i in range(nbins)]
-    bkg_list = {}
-
-    for ttname, objs in objs_dict.items():
-        if ttname.endswith("error"): # FIXME what's that for already ? looks useless nowadys
-            continue
-        # Now do the plots
-        #sm = plotMaker.SetupMaker(cfg, ttname, 125, muhat = cfg._muhat)
-        sm = plotMaker.SetupMaker(cfg, ttname, 0, muhat = cfg._muhat)
-        if 'mass' in objs:
-            sm.add('mass', objs['mass'])
-        for k,v in objs.items():
-            print("...", k)
-            sm.add(doPlotFromWS.getCompName(k), v)
-        res = sm.setup.finish_initialize()
-        data = sm.setup.data.hist
-        try:
-            sig = sm.setup.sig_to_use.h
-        except:
-            print("WARNING: No signal in category", ttname)
-            continue
-
-        bkg = sm.setup.hsum
-        #sig_exp = sm.setup.exp_sig.h
-        # complete list of backgrounds
-        bkgs = sm.setup.bkgs
-        for b in bkgs:
-            if not b.name in bkg_list:
-                bkg_list[b.name] = hmodel.Clone(b.name)
-                bkg_list[b.name].Sumw2(True)
-
-        for i in range(1, data.GetNbinsX()+1):
-            if bkg.GetBinContent(i) == 0:
-                print("ERROR: 0 background content for some bin of category", ttname)
-                print("Signal content there is", sig.GetBinContent(i))
-                if sig.GetBinContent(i) == 0:
-                    continue
-                else:
-                    raise ZeroDivisionError
-            sob = sig.GetBinContent(i) / bkg.GetBinContent(i)
-            if sob == 0:
-                print("WARNING: signal is 0 in some bin of category", ttname)
-            else:
-                logsob = math.log10(sob)
-                # keep track what we put in
-                bnumber = hdata.FindFixBin(logsob)
-                if bnumber == 15:
-                    print("WARNING")
-                    print(ttname, i)
-                if bnumber == 0:
-                    bnumber = 1
-                origin[bnumber-1].append((ttname+"_"+str(i), sob, {}))
-                # now fill histograms
-                hdata.Fill(logsob, data.GetBinContent(i))
-                hsig.Fill(logsob, sig.GetBinContent(i))
-                hbkg.Fill(logsob, bkg.GetBinContent(i))
-                for b in bkgs:
-                    bkg_list[b.name].Fill(logsob, b.h.GetBinContent(i))
-                    origin[bnumber-1][-1][2][b.name] = b.h.GetBinContent(i)
-
-    hdata.AddBinContent(1, hdata.GetBinContent(0))
-    hsig.AddBinContent(1, hsig.GetBinContent(0))
-    hbkg.AddBinContent(1, hbkg.GetBinContent(0))
-    for b in bkg_list.values():
-        b.AddBinContent(1, b.GetBinContent(0))
-
-    for i in range(hdata.GetNbinsX() + 2):
-        hdata.SetBinError(i, hdata.GetBinContent(i)**.5)
-
+    inputs = getSoBInputs(cfg, objs_dict)
+    sig = inputs["sig"]
+    bkg = inputs["bkg"]
+
+    for ttname, b in zip(inputs["region"][bkg == 0], inputs["bin"][bkg == 0]):
+        print("ERROR: 0 background content for bin", b, "of category", ttname)
+    if np.any((bkg == 0) & (sig != 0)):
+        raise ZeroDivisionError
+    for ttname in np.unique(inputs["region"][(bkg != 0) & (sig == 0)]):
+        print("WARNING: signal is 0 in some bin of category", ttname)
+
+    # only the bins with some signal enter the plot
+    use = (bkg != 0) & (sig != 0)
+    sob = sig[use] / bkg[use]
+    logsob = np.log10(sob)
+    # bin numbers as TAxis.FindFixBin gives them, with the underflow merged into the first bin
+    sob_bins = np.floor(nbins * (logsob - xmin) / (xmax - xmin)).astype(int) + 1
+    sob_bins = np.clip(sob_bins, 1, nbins + 1)
+
+    regions = inputs["region"][use]
+    bins = inputs["bin"][use]
+    band = None
+    if rfr is not None and not is_prefit:
+        print("Computing the postfit uncertainties of the MC in the S/B bins")
+        band = getSoBErrorBand(cfg, w, rfr, regions, bins, sob_bins, hmodel)
+
+    def makeHistograms():
+        hdata = makeSoBHistogram(hmodel, "hdata", sob_bins, inputs["data"][use], sumw2=False)
+        for i in range(hdata.GetNbinsX() + 2):
+            hdata.SetBinError(i, hdata.GetBinContent(i)**.5)
+        hsig = makeSoBHistogram(hmodel, "hsig", sob_bins, sig[use])
+        hbkg = makeSoBHistogram(hmodel, "hbkg", sob_bins, bkg[use])
+        bkg_list = {name: makeSoBHistogram(hmodel, name, sob_bins, contents[use])
+                    for name, contents in inputs["bkgs"].items()}
+        return hdata, hsig, hbkg, bkg_list
 
     # Get year tag from folder
     ytag="4033" # what goes in the plot name at the moment of the fix
@@ -167,59 +223,84 @@ def makeSoBPlot(cfg, w, rfr, is_prefit, suffix, plotdir, restrict_to=[], ratioTy
             print("Year tag updated to "+ytag)
             break
 
-    # Do the pretty printing
-    cname = "Global_SoverB_"+ytag
-    if ratioType == 1:
-        cname = "Global_SoverB_"+ytag+"_pulls"
-    if ratioType == 2:
-        cname = "Global_SoverB_"+ytag+"_mu"
-    #plot_setup = plotMaker.SetupMaker(cfg, cname, 125, muhat = 1, guess_properties=False)
-    plot_setup = plotMaker.SetupMaker(cfg, cname, 0, muhat = cfg._muhat, guess_properties=False)
-    plot_setup.add("data", hdata)
-    plot_setup.add("VH125", hsig) # just cheating to have it accepted as signal
-    #plot_setup.add("VZ", hsig) # just cheating to have it accepted as signal
-    plot_setup.add("bkg", hbkg)
-
-    can = plot_setup.setup.make_SoB_plot(cname,do_ratio = True, Ratioybounds=(yMinRatio, yMaxRatio), ratioType=ratioType)
-    plotname = f"{plotdir}/{can.GetName()}"
-    for f in cfg.formats:
-        can.Print(plotname+'.'+f)
-    plotMaker.purge()
-
-    # Do the colorful plot
-    cname = "Global_SoverB_"+ytag+"_details"
-    if ratioType == 1:
-        cname = "Global_SoverB_"+ytag+"_details_pulls"
-    if ratioType == 2:
-        cname = "Global_SoverB_"+ytag+"_details_mu"
-    #plot_setup = plotMaker.SetupMaker(cfg, cname, 125, muhat = 1, guess_properties=False)
-    plot_setup = plotMaker.SetupMaker(cfg, cname, 0, muhat = cfg._muhat, guess_properties=False)
-    plot_setup.add("data", hdata)
-    plot_setup.add("VH125", hsig) # just cheating to have it accepted as signal
-    #plot_setup.add("VZ", hsig) # just cheating to have it accepted as signal
-    for k,v in bkg_list.items():
-        plot_setup.add(k, v)
-
-    can = plot_setup.setup.make_SoB_plot(cname,do_ratio = True, Ratioybounds=(yMinRatio, yMaxRatio), ratioType=ratioType)
-    plotname = f"{plotdir}/{can.GetName()}"
-    for f in cfg.formats:
-        can.Print(plotname+'.'+f)
-    plotMaker.purge()
+    for ratioType in ratioTypes:
+        yMinRatio = 0
+        yMaxRatio = 2.5
+        if ratioType == 1:
+            yMinRatio = -2.5
+            yMaxRatio = 9.5
+        if ratioType == 2:
+            yMinRatio = -2.5
+            yMaxRatio = 3.5
+        ###For VZ
+        #if ratioType is 1:
+        #  yMinRatio = -2.5
+        #  yMaxRatio = 12.5
+        # if ratioType is 2:
+        #  yMinRatio = -2.5
+        #  yMaxRatio = 3.5
+        #end for VZ
+
+        # Do the pretty printing
+        hdata, hsig, hbkg, bkg_list = makeHistograms()
+        cname = "Global_SoverB_"+ytag
+        if ratioType == 1:
+            cname = "Global_SoverB_"+ytag+"_pulls"
+        if ratioType == 2:
+            cname = "Global_SoverB_"+ytag+"_mu"
+        #plot_setup = plotMaker.SetupMaker(cfg, cname, 125, muhat = 1, guess_properties=False)
+        plot_setup = plotMaker.SetupMaker(cfg, cname, 0, muhat = cfg._muhat, guess_properties=False)
+        plot_setup.add("data", hdata)
+        plot_setup.add("VH125", hsig) # just cheating to have it accepted as signal
+        #plot_setup.add("VZ", hsig) # just cheating to have it accepted as signal
+        plot_setup.add("bkg", hbkg)
+        if band is not None:
+            plot_setup.add("error", band)
+
+        can = plot_setup.setup.make_SoB_plot(cname,do_ratio = True, Ratioybounds=(yMinRatio, yMaxRatio), ratioType=ratioType)
+        plotname = f"{plotdir}/{can.GetName()}"
+        plotMaker.export(cfg, can, [plotname+'.'+f for f in cfg.formats])
+        plotMaker.purge()
+
+        # Do the colorful plot
+        hdata, hsig, hbkg, bkg_list = makeHistograms()
+        cname = "Global_SoverB_"+ytag+"_details"
+        if ratioType == 1:
+            cname = "Global_SoverB_"+ytag+"_details_pulls"
+        if ratioType == 2:
+            cname = "Global_SoverB_"+ytag+"_details_mu"
+        #plot_setup = plotMaker.SetupMaker(cfg, cname, 125, muhat = 1, guess_properties=False)
+        plot_setup = plotMaker.SetupMaker(cfg, cname, 0, muhat = cfg._muhat, guess_properties=False)
+        plot_setup.add("data", hdata)
+        plot_setup.add("VH125", hsig) # just cheating to have it accepted as signal
+        #plot_setup.add("VZ", hsig) # just cheating to have it accepted as signal
+        for k,v in bkg_list.items():
+            plot_setup.add(k, v)
+        if band is not None:
+            plot_setup.add("error", band)
+
+        can = plot_setup.setup.make_SoB_plot(cname,do_ratio = True, Ratioybounds=(yMinRatio, yMaxRatio), ratioType=ratioType)
+        plotname = f"{plotdir}/{can.GetName()}"
+        plotMaker.export(cfg, can, [plotname+'.'+f for f in cfg.formats])
+        plotMaker.purge()
 
     cfg._save_yields()
     print("End plotting S/B plot !")
 
     print("Printing origin of bins")
-    for i,b in enumerate(origin):
+    names = np.array([f"{ttname}_{b}" for ttname, b in zip(regions, bins)], dtype=object)
+    order = np.lexsort((names, sob_bins))
+    for i in range(nbins):
         print("Analysis bins entering bin", i+1, "of the final plot:")
-        for s in sorted(b):
-            print("   ", s[0])
-            print("      S/B:", s[1])
-            for k,v in s[2].items():
-                print(f"      {k} : {v:.2f}")
+        for k in order[sob_bins[order] == i+1]:
+            print("   ", names[k])
+            print("      S/B:", sob[k])
+            for name, contents in inputs["bkgs"].items():
+                print(f"      {name} : {contents[use][k]:.2f}")
 
     print("\n\n\n\n\n\n")
     print("Printing total background composition of the final plot")
+    hdata, hsig, hbkg, bkg_list = makeHistograms()
     for i in range(1, hdata.GetNbinsX()+1):
         print("Composition of bin", i, "of the final plot:")
         for b,h in bkg_list.items():
@@ -1,10 +1,9 @@
 import os
 import os.path
-import copy
-import pickle
 import logging
 import ROOT
 import re
+import plotCache
 
 class PlottingConfig:
     """ This is the class each analysis needs to inherit from to configure the plotting code """
@@ -23,10 +22,17 @@ class PlottingConfig:
         self._weighted = ''
         self._yields = None
         self._comps = None
+        self._split_data = None
         self._plot_objs = None
         self._muhat = None
         self._yieldsfile = None
         self._plot_objs_file = None
+        self._read_only_caches = False
+        # (workspace, fit result, window) the cached yields and plot objects belong to, see doPlotFromWS.getCacheContext
+        self._cache_context = None
+        self._caches = {}
+        self._yields_blobs = {}
+        self._plot_objs_blobs = {}
         self._STACK = 1
         self._OVERPRINT = 2
 
@@ -87,6 +93,10 @@ class PlottingConfig:
         self.force_recompute_yields = False
         self.force_recompute_plotobjs = False        
         self.plot_prefit_curve = True        
+        # number of processes to share the regions among when making the plots of each region
+        self.plot_workers = 1
+        # number of background processes printing the canvases in all formats (0: print them in the main process)
+        self.export_workers = 0
         self.find_optimal_yrange = True
         #This flag is to control the range of the postfit plots (0.9,1.1) and plot the ratio of the prefit over postfit. This flag only affects the postfit plots 
         self.prepost_ratio = False
@@ -108,6 +118,10 @@ class PlottingConfig:
         """
         return
 
+    def report_plot_memory (self, name, rss, peak_rss):
+        """ executed after each plot is made and its objects deleted. Memory in MB, the peak is the one while the plot was made """
+        logging.info(f"Memory after plot {name}: {rss:.0f} MB resident, {peak_rss:.0f} MB at peak during the plot")
+
     def preprocess_main_content_histogram (self, hist, setupMaker):
         """ executed before rebinning """
         return hist
@@ -289,48 +303,59 @@ class PlottingConfig:
 
     # hidden, for experts only
     def _save_yields(self):
-        os.system(f"rm -f {self._yieldsfile}")
-        f = open(self._yieldsfile, "wb")
-        pickle.dump(copy.deepcopy(self._yields), f)
-        f.close()
-
-    def _read_yields(self):
-        if os.path.isfile(self._yieldsfile):
-            if self.force_recompute_yields:
-                os.remove(self._yieldsfile)
+        if self._read_only_caches or self._yields is None:
+            return
+        n = plotCache.saveEntries(self._yields_cache(), self._cache_context, self._yields, self._yields_blobs)
+        logging.debug(f"Wrote {n} yields to {self._yieldsfile}")
+
+    def _read_yields(self, regions=None):
+        cache = self._yields_cache()
+        if self.force_recompute_yields:
+            if not self._read_only_caches:
+                cache.clear()
                 print( "Forced regeneration of yields file")
-                yields = {}
-            else:
-                f = open(self._yieldsfile, "rb")
-                yields = pickle.load(f)
-                f.close()
+            yields, self._yields_blobs = {}, {}
         else:
-            print( "Yields file does not exist yet... Generate it.")
-            yields = {}
+            yields, self._yields_blobs = plotCache.loadEntries(cache, self._cache_context, regions)
+            if len(yields) == 0:
+                print( "Yields file does not exist yet... Generate it.")
         self._yields = yields
 
     def _save_plot_objs(self):
-        if self._plot_objs is not None:
-            os.system(f"rm -f {self._plot_objs_file}")
-            f = open(self._plot_objs_file, "wb")
-            pickle.dump(copy.deepcopy(self._plot_objs), f)
-            f.close()
-
-    def _read_plot_objs(self):
-        if os.path.isfile(self._plot_objs_file):
-            if self.force_recompute_plotobjs:
-                os.remove(self._plot_objs_file)
+        if self._plot_objs is not None and not self._read_only_caches:
+            n = plotCache.saveEntries(self._plot_objs_cache(), self._cache_context, self._plot_objs, self._plot_objs_blobs)
+            logging.debug(f"Wrote {n} plot objects to {self._plot_objs_file}")
+
+    def _read_plot_objs(self, regions=None):
+        cache = self._plot_objs_cache()
+        if self.force_recompute_plotobjs:
+            if not self._read_only_caches:
+                cache.clear()
                 print( "Forced regeneration of plot objs file")
-                plot_objs = {}
-            else:
-                f = open(self._plot_objs_file, "rb")
-                plot_objs = pickle.load(f)
-                f.close()
+            plot_objs, self._plot_objs_blobs = {}, {}
         else:
-            print( "Plot objs file does not exist yet... Generate it.")
-            plot_objs = {}
+            plot_objs, self._plot_objs_blobs = plotCache.loadEntries(cache, self._cache_context, regions)
+            if len(plot_objs) == 0:
+                print( "Plot objs file does not exist yet... Generate it.")
         self._plot_objs = plot_objs
 
-    def _reset(self):
+    def _yields_cache(self):
+        if self._caches.get("yields") is None or self._caches["yields"].path != self._yieldsfile:
+            self._caches["yields"] = plotCache.KeyedCache(self._yieldsfile)
+        return self._caches["yields"]
+
+    def _plot_objs_cache(self):
+        if self._caches.get("plot_objs") is None or self._caches["plot_objs"].path != self._plot_objs_file:
+            self._caches["plot_objs"] = plotCache.KeyedCache(self._plot_objs_file)
+        return self._caches["plot_objs"]
+
+    def _reset(self, keep_components=False):
+        """ Forget the state of the current fit. The components stay valid as long as the workspace is open """
         self._yields = None
-        self._comps = None
+        if not keep_components:
+            self._comps = None
+            self._split_data = None
+        self._cache_context = None
+        self._yields_blobs = {}
+        self._plot_objs = None
+        self._plot_objs_blobs = {}
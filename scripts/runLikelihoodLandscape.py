@@ -11,13 +11,19 @@ Description:
     perform a PNLL scan. The script automatically performs the PNLL scan over all parameters
     that are set as "POIs" in the RooStats::ModelConfig. The scan is performed within the
     bounds set by the ranges of these POIs (as defined in the workspace).
+
+    In the adaptive mode, the scan starts from a coarse lattice and is then refined in
+    several rounds: only lattice cells that contain a low PNLL value or that are crossed by
+    one of the contour levels are subdivided further, and the new points of each round are
+    evaluated by a new wave of subjobs.
 """
 
 import ROOT
 ROOT.gSystem.Load("libRooFit")
 ROOT.gSystem.Load("libRooFitCore")
 
-import os, sys, subprocess
+import os, sys, subprocess, glob, json, itertools
+import numpy as np
 import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
 
@@ -34,10 +40,22 @@ class LikelihoodScanJob(Mgr.WSMakerJob):
 
     ID = "likelihood_scan"
 
-    def __init__(self, rootcmd, job_ind, log_dir, submit_dir, settings):
+    def __init__(self, rootcmd, job_ind, log_dir, submit_dir, settings, prerequisites = []):
 
         super().__init__(name = f"{LikelihoodScanJob.ID}_job_{job_ind}", commands = rootcmd, submit_dir = submit_dir,
-                                                log_dir = log_dir, prerequisites = [], settings = settings)
+                                                log_dir = log_dir, prerequisites = prerequisites, settings = settings)
+
+class LikelihoodRefineJob(Mgr.WSMakerJob):
+
+    ID = "likelihood_refine"
+
+    def __init__(self, outputdir, round_number, job_ind, log_dir, submit_dir, prerequisites, settings):
+
+        executable = os.path.join(os.environ["WORKDIR"], "scripts/runLikelihoodLandscape.py")
+        command = " ".join(["python", executable, "--outputdir", outputdir, "--refine_round", str(round_number)])
+
+        super().__init__(name = f"{LikelihoodRefineJob.ID}_job_{job_ind}", commands = command, submit_dir = submit_dir,
+                                                log_dir = log_dir, prerequisites = prerequisites, settings = settings)
 
 class LikelihoodMergeJob(Mgr.WSMakerJob):
 
@@ -50,12 +68,13 @@ class LikelihoodMergeJob(Mgr.WSMakerJob):
             return [job for job in other_jobs if job.ID == LikelihoodScanJob.ID]
 
         mergefile_path = os.path.join(outputdir, "LikelihoodLandscape_out.root")
-        command = " ".join(["hadd", mergefile_path, f"{outputdir}/*.root"])
+        command = " ".join(["hadd", "-f", mergefile_path, f"{outputdir}/LikelihoodLandscape_out_*.root"])
 
         super().__init__(name = LikelihoodMergeJob.ID + "_" + job_ind, commands = command, submit_dir = submit_dir, log_dir = log_dir,
                                                  prerequisites = get_prerequisites(other_jobs), settings = settings)
 
-def BuildLikelihoodScanJobs(submit_dir, log_dir, infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None):
+def BuildLikelihoodScanJobs(submit_dir, log_dir, infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None,
+                            refinement_rounds = None, nll_threshold = None, warmStart = True, resume = False):
 
     PrepareRun()
 
@@ -66,8 +85,35 @@ def BuildLikelihoodScanJobs(submit_dir, log_dir, infile_path, outputdir, Workspa
     batchconf = BatchConfig()
     job_type = f"asimov_{int(useAsimov)}_postfit_{int(doPostFit)}_poi_{poiValue}"
 
+    if refinement_rounds is None:
+        refinement_rounds = batchconf.likelihood_scan_refinement_rounds
+    if nll_threshold is None:
+        nll_threshold = batchconf.likelihood_scan_nll_threshold
+
     jobs = []
-    for job_number, rootcmd in enumerate(GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density)):
+    if refinement_rounds > 0:
+        # one wave of scan jobs per round, each of which waits for the refinement step that defines its points
+        waves = GetAdaptiveLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density,
+                                                   refinement_rounds, nll_threshold, warmStart)
+        prerequisites = []
+        for round_number, wave in enumerate(waves):
+            if round_number > 0:
+                refine_job = LikelihoodRefineJob(outputdir, round_number, job_ind = f"{job_type}_r{round_number}", log_dir = log_dir, submit_dir = submit_dir,
+                                                 prerequisites = prerequisites, settings = batchconf.default_settings)
+                jobs.append(refine_job)
+                prerequisites = [refine_job]
+
+            wave_jobs = []
+            for job_number, rootcmd in enumerate(wave):
+                cmd = 'root -l -b -q "{}"'.format(rootcmd.replace('"', '\\"'))
+                wave_jobs.append(LikelihoodScanJob(cmd, job_ind = f"{job_type}_r{round_number}_{job_number}", log_dir = log_dir, submit_dir = submit_dir,
+                                                   settings = batchconf.default_settings, prerequisites = prerequisites))
+            jobs += wave_jobs
+            prerequisites = wave_jobs
+
+        return jobs
+
+    for job_number, rootcmd in enumerate(GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density, warmStart, resume)):
         cmd = 'root -l -b -q "{}"'.format(rootcmd.replace('"', '\\"'))
         jobs.append(LikelihoodScanJob(cmd, job_ind = f"{job_type}_{job_number}", log_dir = log_dir, submit_dir = submit_dir,
                                       settings = batchconf.default_settings))
@@ -81,7 +127,7 @@ def BuildMergeJob(outputdir, useAsimov, doPostFit, poiValue, log_dir, submit_dir
 
     return LikelihoodMergeJob(outputdir, job_type, log_dir, submit_dir, other_jobs, settings = batchconf.default_settings)
 
-def WriteXMLConfig(outfile_path, start_vertex, end_vertex, opts = {}):
+def WriteXMLConfig(outfile_path, start_vertex, end_vertex, opts = {}, points = None):
     # ensure that all data variables are indeed strings
     start_vertex = {cur_key: str(cur_val) for cur_key, cur_val in start_vertex.items()}
     end_vertex = {cur_key: str(cur_val) for cur_key, cur_val in end_vertex.items()}
@@ -91,6 +137,12 @@ def WriteXMLConfig(outfile_path, start_vertex, end_vertex, opts = {}):
     end_section = ET.SubElement(root, "end_vertex", attrib = end_vertex)
     end_section = ET.SubElement(root, "opts", attrib = opts)
 
+    # an explicit list of points replaces the regular grid
+    if points is not None:
+        points_section = ET.SubElement(root, "points")
+        for cur_point in points:
+            ET.SubElement(points_section, "point", attrib = {cur_key: str(cur_val) for cur_key, cur_val in cur_point.items()})
+
     tree = ET.ElementTree(root)
     tree.write(outfile_path)
 
@@ -119,71 +171,411 @@ def GetPOIInformation(infile_path, WorkspaceName, ModelConfigName):
     infile.Close()
     return POI_information
 
-def SliceHypercube(start_vertex, end_vertex, slice_dim, number_slices):
+def GetScanGrid(start_vertex, end_vertex, points_per_dimension):
+    """
+    Regular grid with 'points_per_dimension' points along each axis of the hyperrectangle
+    parametrised by 'start_vertex' and 'end_vertex' (as in LikelihoodLandscape.C, the
+    end vertex itself is not part of the grid).
+    """
+    POI_names = list(start_vertex.keys())
+
+    axes = []
+    for POI_name in POI_names:
+        start, end = float(start_vertex[POI_name]), float(end_vertex[POI_name])
+        stepsize = (end - start) / points_per_dimension
+        axes.append([start + stepsize * cur for cur in range(points_per_dimension)])
+
+    return [dict(zip(POI_names, cur)) for cur in itertools.product(*axes)]
+
+def ReadPointCost(infile_path, POI_names):
     """
-    Slice the hyperrectangle parametrised by 'start_vertex' and 'end_vertex'
-    into 'number_slices' smaller hyperrectangles along the dimension specified by
-    'slice_dim'.
+    Read the time spent on each point of an earlier scan, as stored in the "scanCost" tree.
+    Returns None if there is nothing (usable) to read.
     """
+    if not os.path.exists(infile_path):
+        return None
+
+    infile = ROOT.TFile(infile_path, 'READ')
+    tree = infile.Get("scanCost")
+    if not tree or any(not tree.GetBranch(POI_name) for POI_name in POI_names):
+        infile.Close()
+        return None
+
+    coordinates = []
+    times = []
+    for entry in tree:
+        coordinates.append([getattr(entry, POI_name) for POI_name in POI_names])
+        times.append(entry.time)
+    infile.Close()
+
+    if len(times) == 0:
+        return None
+
+    return np.array(coordinates), np.array(times)
+
+def EstimatePointCost(points, previous_cost, start_vertex, end_vertex):
+    # every point is assumed to be as expensive as the closest point of the earlier scan
+    POI_names = list(start_vertex.keys())
+    ranges = np.array([float(end_vertex[POI_name]) - float(start_vertex[POI_name]) or 1.0 for POI_name in POI_names])
+
+    previous_coordinates, previous_times = previous_cost
+    previous_coordinates = previous_coordinates / ranges
+    coordinates = np.array([[point[POI_name] for POI_name in POI_names] for point in points]) / ranges
+
+    cost = []
+    chunk_size = 1000
+    for chunk_start in range(0, len(coordinates), chunk_size):
+        chunk = coordinates[chunk_start:chunk_start + chunk_size]
+        distances = np.sum((chunk[:, np.newaxis, :] - previous_coordinates[np.newaxis, :, :]) ** 2, axis = 2)
+        cost += list(previous_times[np.argmin(distances, axis = 1)])
+
+    # make sure that no point comes for free
+    min_cost = max(np.mean(previous_times) * 1e-3, 1e-6)
+    return [max(cur, min_cost) for cur in cost]
+
+def SerpentineOrder(points, POI_names):
+    """
+    Order the points such that consecutive points are neighbours on the grid: the walk
+    goes back and forth along the last axis, reversing direction whenever it steps along
+    one of the others (a boustrophedon walk).
+    """
+    ranks = {}
+    for POI_name in POI_names:
+        values = sorted(set(point[POI_name] for point in points))
+        ranks[POI_name] = {value: rank for rank, value in enumerate(values)}
+
+    def key(point):
+        retval = []
+        steps = 0
+        for POI_name in POI_names:
+            rank = ranks[POI_name][point[POI_name]]
+            retval.append(-rank if steps % 2 else rank)
+            steps += rank
+        return retval
+
+    return sorted(points, key = key)
+
+def PartitionHypercube(start_vertex, end_vertex, requested_partitions, points, cost = None):
+    """
+    Partition the 'points' within the hyperrectangle parametrised by 'start_vertex' and
+    'end_vertex' into exactly 'requested_partitions' groups of about equal total 'cost'
+    (if no cost is given, all points are taken to be equally expensive).
+    The groups are built by recursive bisection: each cut goes across the axis along
+    which the current group is longest (relative to the full range of each POI), and
+    splits the cost in proportion to the number of partitions on either side.
+    Returns the bounding boxes and the points of the partitions, each of which is
+    ordered for a warm-started scan.
+    """
+    POI_names = list(start_vertex.keys())
+    ranges = {POI_name: float(end_vertex[POI_name]) - float(start_vertex[POI_name]) or 1.0 for POI_name in POI_names}
+
+    if cost is None:
+        cost = [1.0] * len(points)
+
+    def bisect(group, number_partitions):
+        if number_partitions == 1:
+            return [group]
+
+        if len(group) <= number_partitions:
+            # nothing left to balance, some partitions will stay empty
+            return [[entry] for entry in group] + [[] for cur in range(number_partitions - len(group))]
+
+        def extent(POI_name):
+            values = [point[POI_name] for point, _ in group]
+            return (max(values) - min(values)) / ranges[POI_name]
+
+        axis = max(POI_names, key = extent)
+        sort_order = [axis] + [POI_name for POI_name in POI_names if POI_name != axis]
+        group = sorted(group, key = lambda entry: [entry[0][POI_name] for POI_name in sort_order])
+
+        left_partitions = number_partitions // 2
+        target = sum(cur_cost for _, cur_cost in group) * left_partitions / number_partitions
+
+        cut = len(group)
+        cumulative = 0.0
+        for ind, (_, cur_cost) in enumerate(group):
+            if cumulative + 0.5 * cur_cost > target:
+                cut = ind
+                break
+            cumulative += cur_cost
+
+        # each side needs at least one point per partition
+        cut = min(max(cut, left_partitions), len(group) - (number_partitions - left_partitions))
+
+        return bisect(group[:cut], left_partitions) + bisect(group[cut:], number_partitions - left_partitions)
+
+    partitions = bisect(list(zip(points, cost)), requested_partitions)
 
     start_vertices = []
     end_vertices = []
-
-    def linspace(start, end, length):
-        start, end = float(start), float(end)
-        if length > 1:
-            stepsize = (end - start) / (length - 1)
-            return [start + stepsize * cur for cur in range(length)]
+    partition_points = []
+    partition_costs = []
+    for partition in partitions:
+        cur_points = [point for point, _ in partition]
+        if cur_points:
+            start_vertices.append({POI_name: min(point[POI_name] for point in cur_points) for POI_name in POI_names})
+            end_vertices.append({POI_name: max(point[POI_name] for point in cur_points) for POI_name in POI_names})
         else:
-            return [start]
+            start_vertices.append(dict(start_vertex))
+            end_vertices.append(dict(end_vertex))
+        partition_points.append(SerpentineOrder(cur_points, POI_names))
+        partition_costs.append(sum(cur_cost for _, cur_cost in partition))
+
+    print(f"Using {len(partitions)} partitions with {min(map(len, partition_points))} - {max(map(len, partition_points))} points each.")
+    if partition_costs and max(partition_costs) > 0:
+        print(f"Expected cost per partition: {min(partition_costs):.3g} - {max(partition_costs):.3g}")
+
+    return start_vertices, end_vertices, partition_points
+
+def GuessDensity(number_dimensions):
+    #density_guess = {1: 10, 2: 70, 3: 60}
+    density_guess = {1: 10, 2: 100, 3: 60}
+
+    if number_dimensions > 3:
+        print("Warning: do you *really* want to do a scan in more than 3 dimensions? How are you going to plot it, anyways?")
+        return 100
+    else:
+        return density_guess[number_dimensions]
+
+def GetScanOpts(density, warmStart):
+    # "density" is the density of the evaluation points for the NLL, i.e. points per unit (hyper)volume,
+    # "warmStart" starts the minimisation at each point from the closest point done before
+    return {"density": str(density), "warmStart": str(int(warmStart))}
+
+def GetRootCmd(infile_path, outfile_path, config_path, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, doBestFit):
+    args = [infile_path, outfile_path, config_path, WorkspaceName, ModelConfigName, ObsDataName]
+    args = [f'"{cur}"' for cur in args] # add the proper quotes to signify strings
+
+    # add the boolean arguments
+    args.append(str(useAsimov).lower())
+    args.append(str(doPostFit).lower())
+    args.append(str(poiValue))
+    args.append(str(doBestFit).lower())
+    return "$WORKDIR/LikelihoodLandscape.C+({arglist})".format(arglist = ", ".join(args))
+
+# -------------------------------------------------------------------------
+# adaptive scan
+# -------------------------------------------------------------------------
+# All points of an adaptive scan sit on a lattice whose spacing is that of the coarse
+# starting lattice, halved once per refinement round. Points and cells are therefore
+# identified by their integer lattice indices on the finest lattice; a cell is given by
+# its lower corner and its size (in units of the finest lattice spacing).
+
+# PNLL values of the 68% and 95% CL contours, depending on the number of POIs
+contour_levels_guess = {1: [0.494475, 1.92072], 2: [1.15, 3.00], 3: [1.765, 3.907]}
+
+def GetAdaptiveStatePath(outputdir):
+    return os.path.join(outputdir, "LikelihoodLandscape_adaptive.json")
+
+def GetAdaptiveConfigPath(outputdir, round_number, ind):
+    return os.path.join(outputdir, f"LikelihoodLandscape_config_r{round_number}_{ind}.xml")
+
+def GetAdaptiveOutfilePath(outputdir, round_number, ind):
+    return os.path.join(outputdir, f"LikelihoodLandscape_out_r{round_number}_{ind}.root")
+
+def IndexToPoint(state, index):
+    point = {}
+    for POI_name, idx in zip(state["POI_names"], index):
+        unit = (state["end_vertex"][POI_name] - state["start_vertex"][POI_name]) / state["lattice_size"]
+        point[POI_name] = state["start_vertex"][POI_name] + idx * unit
+    return point
+
+def PointToIndex(state, point):
+    index = []
+    for POI_name in state["POI_names"]:
+        unit = (state["end_vertex"][POI_name] - state["start_vertex"][POI_name]) / state["lattice_size"]
+        index.append(int(round((point[POI_name] - state["start_vertex"][POI_name]) / unit)))
+    return tuple(index)
+
+def GetCellNodes(cell, cell_size, step):
+    # all lattice nodes with spacing 'step' on the boundary of or inside the cell
+    return list(itertools.product(*[range(idx, idx + cell_size + 1, step) for idx in cell]))
+
+def NeedsRefinement(corner_nlls, nll_threshold, contour_levels):
+    if not corner_nlls:
+        # none of the fits converged, nothing to learn from this cell
+        return False
+
+    low, high = min(corner_nlls), max(corner_nlls)
+    return low < nll_threshold or any(low < level < high for level in contour_levels)
+
+def WriteAdaptiveConfigs(state, outputdir, round_number, indices):
+    """
+    Distribute the points with the given lattice indices over the subjobs of this round.
+    Every subjob gets a configuration file, even if it ends up with nothing to do.
+    """
+    points = [IndexToPoint(state, index) for index in sorted(indices)]
+
+    print(f"round {round_number}: {len(points)} points to evaluate")
+
+    start_vertices, end_vertices, partition_points = PartitionHypercube(state["start_vertex"], state["end_vertex"], state["number_subjobs"], points)
+    for ind, (cur_start_vertex, cur_end_vertex, cur_points) in enumerate(zip(start_vertices, end_vertices, partition_points)):
+        WriteXMLConfig(outfile_path = GetAdaptiveConfigPath(outputdir, round_number, ind), start_vertex = cur_start_vertex,
+                       end_vertex = cur_end_vertex, opts = state["scan_opts"], points = cur_points)
+
+def ReadScanResults(state, outputdir):
+    # collect the PNLL values of all points evaluated so far
+    results = {}
+    for cur_path in glob.glob(os.path.join(outputdir, "LikelihoodLandscape_out_r*.root")):
+        infile = ROOT.TFile(cur_path, 'READ')
+        tree = infile.Get("NLLscan")
+        if tree:
+            for entry in tree:
+                index = PointToIndex(state, {POI_name: getattr(entry, POI_name) for POI_name in state["POI_names"]})
+                results[index] = min(entry.NLL, results.get(index, entry.NLL))
+        infile.Close()
+
+    return results
+
+def PrepareAdaptiveScan(POI_info, outputdir, numberSubjobs, density, refinement_rounds, nll_threshold, warmStart = True):
+    POI_names = list(POI_info.keys())
+    number_dimensions = len(POI_names)
+
+    # make the finest lattice about as dense as the regular grid would be
+    points_per_dimension = int(pow(density, 1.0 / number_dimensions))
+    coarse_cells = max(4, int(round(points_per_dimension / 2 ** refinement_rounds)))
+    cell_size = 2 ** refinement_rounds
+
+    if number_dimensions in contour_levels_guess:
+        contour_levels = contour_levels_guess[number_dimensions]
+    else:
+        contour_levels = contour_levels_guess[3]
+
+    state = {"POI_names": POI_names,
+             "start_vertex": {POI_name: POI_info[POI_name]["RangeLow"] for POI_name in POI_names},
+             "end_vertex": {POI_name: POI_info[POI_name]["RangeHigh"] for POI_name in POI_names},
+             "scan_opts": GetScanOpts(density, warmStart),
+             "number_subjobs": numberSubjobs,
+             "refinement_rounds": refinement_rounds,
+             "nll_threshold": nll_threshold,
+             "contour_levels": contour_levels,
+             "lattice_size": coarse_cells * cell_size,
+             "cell_size": cell_size,
+             "active_cells": [list(cell) for cell in itertools.product(range(0, coarse_cells * cell_size, cell_size), repeat = number_dimensions)]}
+
+    print(f"using a coarse lattice with {coarse_cells} cells per dimension and {refinement_rounds} refinement rounds")
+
+    # outputs of an earlier scan would otherwise be taken for points of this one
+    ClearScanOutputs(outputdir)
+
+    with open(GetAdaptiveStatePath(outputdir), 'w') as outfile:
+        json.dump(state, outfile)
+
+    coarse_nodes = itertools.product(range(0, coarse_cells * cell_size + 1, cell_size), repeat = number_dimensions)
+    WriteAdaptiveConfigs(state, outputdir, 0, coarse_nodes)
+
+def RefineLikelihoodLandscape(outputdir, round_number):
+    """
+    Subdivide all cells of the previous round in which the PNLL is low or which
+    are crossed by a contour, and prepare the configurations for the points that
+    still need to be evaluated.
+    """
+    with open(GetAdaptiveStatePath(outputdir)) as infile:
+        state = json.load(infile)
 
-    cut_positions = linspace(start_vertex[slice_dim], end_vertex[slice_dim], number_slices + 1) # need to place one more cut than slices
+    results = ReadScanResults(state, outputdir)
+    cell_size = state["cell_size"]
+    child_size = cell_size // 2
 
-    for cut_position in cut_positions:
-        cur_start_vertex = dict(start_vertex)
-        cur_start_vertex[slice_dim] = cut_position
-        start_vertices.append(cur_start_vertex)
+    active_cells = []
+    new_points = set()
+    for cell in state["active_cells"]:
+        corners = GetCellNodes(cell, cell_size, cell_size)
+        corner_nlls = [results[corner] for corner in corners if corner in results]
+        if not NeedsRefinement(corner_nlls, state["nll_threshold"], state["contour_levels"]):
+            continue
 
-        cur_end_vertex = dict(end_vertex)
-        cur_end_vertex[slice_dim] = cut_position
-        end_vertices.append(cur_end_vertex)
+        active_cells += [list(child) for child in GetCellNodes(cell, child_size, child_size)]
+        new_points.update(node for node in GetCellNodes(cell, cell_size, child_size) if node not in results)
 
-    # now need to shift them by one to have each hypercube span
-    # a nonzero volume
-    start_vertices = start_vertices[:-1]
-    end_vertices = end_vertices[1:]
+    print(f"round {round_number}: refining {len(active_cells) // 2 ** len(state['POI_names'])} out of {len(state['active_cells'])} cells")
 
-    return start_vertices, end_vertices
+    state["cell_size"] = child_size
+    state["active_cells"] = active_cells
+    with open(GetAdaptiveStatePath(outputdir), 'w') as outfile:
+        json.dump(state, outfile)
 
-def PartitionHypercube(start_vertex, end_vertex, requested_partitions):
+    WriteAdaptiveConfigs(state, outputdir, round_number, new_points)
+
+def GetAdaptiveLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None,
+                                       refinement_rounds = 3, nll_threshold = 0.5, warmStart = True):
     """
-    Partition a hyperrectangle into 'requested_partitions' smaller hyperrectangles,
-    along all dimensions.
+    Returns one list of commands per round. The configurations for the first round are written
+    right away, those for each later round only by RefineLikelihoodLandscape, once all commands of
+    the preceding round have finished.
     """
-    dimensions = start_vertex.keys()
-    partitions_per_dimension = int(pow(requested_partitions, 1.0 / len(dimensions)))
+    POI_info = GetPOIInformation(infile_path, WorkspaceName, ModelConfigName)
 
-    print(f"Using {partitions_per_dimension} partitions per dimension.")
+    if density is None:
+        density = GuessDensity(len(POI_info))
+
+    PrepareAdaptiveScan(POI_info, outputdir, numberSubjobs, density, refinement_rounds, nll_threshold, warmStart)
+
+    waves = []
+    for round_number in range(refinement_rounds + 1):
+        wave = []
+        for ind in range(numberSubjobs):
+            # make sure to do the (potentially time-consuming) search for the best-fit value only once
+            doBestFit = round_number == 0 and ind == 0
+            wave.append(GetRootCmd(infile_path, GetAdaptiveOutfilePath(outputdir, round_number, ind), GetAdaptiveConfigPath(outputdir, round_number, ind),
+                                   WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, doBestFit))
+        waves.append(wave)
 
-    start_vertices = [start_vertex]
-    end_vertices = [end_vertex]
-    for cur_slice_dim in dimensions:
-        cur_start_vertices = []
-        cur_end_vertices = []
+    return waves
 
-        for cur_start_vertex, cur_end_vertex in zip(start_vertices, end_vertices):
-            cur_sliced_start_vertices, cur_sliced_end_vertices = SliceHypercube(cur_start_vertex, cur_end_vertex,
-                                                                                slice_dim = cur_slice_dim, number_slices = partitions_per_dimension)
+def ClearScanOutputs(outputdir):
+    # remove the outputs (and journals) of the subjobs of an earlier scan, but keep the merged output
+    for cur_path in glob.glob(os.path.join(outputdir, "LikelihoodLandscape_out_*")):
+        os.remove(cur_path)
 
-            cur_start_vertices += cur_sliced_start_vertices
-            cur_end_vertices += cur_sliced_end_vertices
+def IsPartitionComplete(config_path, outfile_path, doBestFit):
+    # the output of a subjob is only written once all of its points are done
+    required_trees = ["bestFit"] if doBestFit else []
 
-        start_vertices = cur_start_vertices
-        end_vertices = cur_end_vertices
+    points_section = ET.parse(config_path).getroot().find("points")
+    if points_section is None or len(points_section) > 0:
+        required_trees.append("NLLscan")
 
-    return start_vertices, end_vertices
+    if not required_trees:
+        return True
 
-def GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None):
+    if not os.path.exists(outfile_path):
+        return False
+
+    infile = ROOT.TFile(outfile_path, 'READ')
+    complete = not infile.IsZombie() and all(infile.Get(tree_name) for tree_name in required_trees)
+    infile.Close()
+
+    return complete
+
+def GetResumeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs):
+    # re-use the configurations of the earlier scan, such that the journals of interrupted subjobs stay valid
+    for ind in range(numberSubjobs):
+        doBestFit = ind == 0
+
+        config_path = os.path.join(outputdir, f"LikelihoodLandscape_config_{ind}.xml")
+        outfile_path = os.path.join(outputdir, f"LikelihoodLandscape_out_{ind}.root")
+
+        if IsPartitionComplete(config_path, outfile_path, doBestFit):
+            print(f"partition {ind} is already complete")
+            continue
+
+        if os.path.exists(outfile_path + ".journal"):
+            print(f"partition {ind} is incomplete, resuming from its journal")
+        else:
+            print(f"partition {ind} is missing")
+
+        yield GetRootCmd(infile_path, outfile_path, config_path, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, doBestFit)
+
+def GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None, warmStart = True,
+                               resume = False):
+
+    if resume:
+        if all(os.path.exists(os.path.join(outputdir, f"LikelihoodLandscape_config_{ind}.xml")) for ind in range(numberSubjobs)):
+            yield from GetResumeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs)
+            return
+
+        print("WARNING: did not find the configuration of an earlier scan with this number of subjobs, starting from scratch")
 
     # ----------------------------------------------------------------------
     # prepare the XML file that holds the configuration for the NLL scan
@@ -195,21 +587,11 @@ def GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfi
 
     if density is None:
         # did not get anything, make up some value based on the number of POIs:
-        number_dimensions = len(POI_names)
-        #density_guess = {1: 10, 2: 70, 3: 60}
-        density_guess = {1: 10, 2: 100, 3: 60}
-
-        if number_dimensions > 3:
-            print("Warning: do you *really* want to do a scan in more than 3 dimensions? How are you going to plot it, anyways?")
-            density = 100
-        else:
-            density = density_guess[number_dimensions]
+        density = GuessDensity(len(POI_names))
 
     print(f"using density = {density}")
 
-    # this is the "density" of the evaluation points for the NLL, i.e.
-    # points per unit (hyper)volume
-    scan_opts = {"density": str(density)}
+    scan_opts = GetScanOpts(density, warmStart)
 
     # build the start and end points
     start_vertex = {POI_name: POI_info[POI_name]["RangeLow"] for POI_name in POI_names}
@@ -221,15 +603,29 @@ def GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfi
     print("using the following end point:")
     print(end_vertex)
 
-    # partition the parameter range such that the subjobs each have some work to do
-    start_vertices, end_vertices = PartitionHypercube(start_vertex, end_vertex, requested_partitions = numberSubjobs)
+    # the grid has the resolution of 'density' points in each of 'numberSubjobs' equal slices of the parameter range
+    number_dimensions = len(POI_names)
+    points_per_dimension = max(1, int(pow(numberSubjobs, 1.0 / number_dimensions))) * max(1, int(pow(density, 1.0 / number_dimensions)))
+    points = GetScanGrid(start_vertex, end_vertex, points_per_dimension)
+
+    # if there is an earlier scan, use the time it took for each point to balance the subjobs
+    cost = None
+    previous_cost = ReadPointCost(os.path.join(outputdir, "LikelihoodLandscape_out.root"), list(POI_names))
+    if previous_cost is not None:
+        print("balancing the subjobs based on the timing of the previous scan")
+        cost = EstimatePointCost(points, previous_cost, start_vertex, end_vertex)
+
+    # partition the points such that the subjobs all have about the same amount of work to do
+    start_vertices, end_vertices, partition_points = PartitionHypercube(start_vertex, end_vertex, numberSubjobs, points, cost)
+
+    ClearScanOutputs(outputdir)
 
     print(f"start_vertices = {start_vertices}")
     print(f"end_vertices = {end_vertices}")
 
     # run all these jobs
     firstJob = True
-    for ind, (cur_start_vertex, cur_end_vertex) in enumerate(zip(start_vertices, end_vertices)):
+    for ind, (cur_start_vertex, cur_end_vertex, cur_points) in enumerate(zip(start_vertices, end_vertices, partition_points)):
         # make sure to do the (potentially time-consuming) search for the best-fit value only once
         doBestFit = firstJob
         firstJob = False
@@ -237,42 +633,49 @@ def GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfi
         config_path = os.path.join(outputdir, f"LikelihoodLandscape_config_{ind}.xml")
         outfile_path = os.path.join(outputdir, f"LikelihoodLandscape_out_{ind}.root")
 
-        WriteXMLConfig(outfile_path = config_path, start_vertex = cur_start_vertex, end_vertex = cur_end_vertex, opts = scan_opts)
+        WriteXMLConfig(outfile_path = config_path, start_vertex = cur_start_vertex, end_vertex = cur_end_vertex, opts = scan_opts, points = cur_points)
 
-        args = [infile_path, outfile_path, config_path, WorkspaceName, ModelConfigName, ObsDataName]
-        args = [f'"{cur}"' for cur in args] # add the proper quotes to signify strings
+        yield GetRootCmd(infile_path, outfile_path, config_path, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, doBestFit)
 
-        # add the boolean arguments
-        args.append(str(useAsimov).lower())
-        args.append(str(doPostFit).lower())
-        args.append(str(poiValue))
-        args.append(str(doBestFit).lower())
-        rootcmd = "$WORKDIR/LikelihoodLandscape.C+({arglist})".format(arglist = ", ".join(args))
-        yield rootcmd
-
-def RunLikelihoodLandscape(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None):
+def RunLikelihoodLandscape(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov = False, doPostFit = False, poiValue = 1.0, numberSubjobs = 16, density = None,
+                           refinement_rounds = 0, nll_threshold = 0.5, warmStart = True, resume = False):
     if not os.path.exists(outputdir):
         os.makedirs(outputdir)
 
-    pids = []
-    logfiles = []
+    def run_cmds(rootcmds, log_prefix):
+        pids = []
+        logfiles = []
+
+        for ind, rootcmd in enumerate(rootcmds):
 
-    for ind, rootcmd in enumerate(GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density)):
+            cur_logfile_path = os.path.join(outputdir, f"{log_prefix}_{ind}.log")
+            cur_logfile = open(cur_logfile_path, 'w')
+            logfiles.append(cur_logfile)
 
-        cur_logfile_path = os.path.join(outputdir, f"output_{ind}.log")
-        cur_logfile = open(cur_logfile_path, 'w')
+            cmds = ["root", "-l", "-b", "-q", rootcmd]
+            pid = subprocess.Popen(cmds, stderr = cur_logfile, stdout = cur_logfile)
+            pids.append(pid)
 
-        cmds = ["root", "-l", "-b", "-q", rootcmd]
-        pid = subprocess.Popen(cmds, stderr = cur_logfile, stdout = cur_logfile)
-        pids.append(pid)
+        wait_all(pids)
+        for cur_logfile in logfiles:
+            cur_logfile.close()
 
-    wait_all(pids)
-    for cur_logfile in logfiles:
-        cur_logfile.close()
+    if refinement_rounds > 0:
+        if resume:
+            print("WARNING: adaptive scans can not be resumed, starting from scratch")
+
+        waves = GetAdaptiveLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density,
+                                                   refinement_rounds, nll_threshold, warmStart)
+        for round_number, wave in enumerate(waves):
+            if round_number > 0:
+                RefineLikelihoodLandscape(outputdir, round_number)
+            run_cmds(wave, f"output_r{round_number}")
+    else:
+        run_cmds(GetLikelihoodLandscapeCmds(infile_path, outputdir, WorkspaceName, ModelConfigName, ObsDataName, useAsimov, doPostFit, poiValue, numberSubjobs, density, warmStart, resume), "output")
 
     print("all jobs finished - merging output ...")
     mergefile_path = os.path.join(outputdir, "LikelihoodLandscape_out.root")
-    subprocess.check_output(["hadd", mergefile_path, f"{outputdir}/LikelihoodLandscape_out_*.root"])
+    subprocess.check_output(["hadd", "-f", mergefile_path] + glob.glob(os.path.join(outputdir, "LikelihoodLandscape_out_*.root")))
     print("done!")
 
 def PrepareRun():
@@ -296,8 +699,17 @@ if __name__ == "__main__":
     parser.add_argument("--algs", action = "store", dest = "algs", help = "Algorithms to run -> 0: postfit Asimov built with poi = 0, 1: postfit Asimov built with poi = 1, 2: prefit Asimov, 3: data unconditional")
     parser.add_argument("--density", action = "store", dest = "density", default = None, help = "number of evaluation points per unit (hyper)volume. Use larger values for better scan quality. If no value given, try to make an educated guess based on the number of POIs")
     parser.add_argument("--subjobs", action = "store", dest = "numberSubjobs", default = "16", help = "number of subjobs to use: the volume in parameter space over which the scan should be run is partitioned into this many subjobs, which are then executed concurrently")
+    parser.add_argument("--refinement_rounds", action = "store", dest = "refinement_rounds", default = "0", help = "number of refinement rounds of an adaptive scan, starting from a coarse lattice. 0: scan a regular grid")
+    parser.add_argument("--nll_threshold", action = "store", dest = "nll_threshold", default = "0.5", help = "adaptive scan: always refine cells with a PNLL value below this threshold (cells crossed by a contour are refined in any case)")
+    parser.add_argument("--cold_start", action = "store_true", dest = "cold_start", default = False, help = "do not warm-start the minimisation at each point from the closest point done before, but from the unconditional fit (e.g. to measure the speedup)")
+    parser.add_argument("--resume", action = "store_true", dest = "resume", default = False, help = "only run the subjobs of an earlier scan in 'outputdir' that are missing or incomplete, then merge again (not supported for adaptive scans)")
+    parser.add_argument("--refine_round", action = "store", dest = "refine_round", default = None, help = "only prepare the given round of an adaptive scan in 'outputdir' (used by the batch jobs)")
     args = vars(parser.parse_args())
 
+    if args["refine_round"] is not None:
+        RefineLikelihoodLandscape(args["outputdir"], int(args["refine_round"]))
+        sys.exit(0)
+
     PrepareRun()
 
     for alg in args["algs"].split(','):
@@ -338,5 +750,9 @@ if __name__ == "__main__":
                                useAsimov = useAsimov,
                                doPostFit = doPostFit,
                                poiValue = poiValue,
-                               numberSubjobs = int(args["numberSubjobs"]))
+                               numberSubjobs = int(args["numberSubjobs"]),
+                               refinement_rounds = int(args["refinement_rounds"]),
+                               nll_threshold = float(args["nll_threshold"]),
+                               warmStart = not args["cold_start"],
+                               resume = args["resume"])
 
@@ -2,27 +2,353 @@
 
 
 import sys, os, ROOT
+import glob
+import hashlib
+import json
+import math
 from argparse import ArgumentParser
 
-parser = ArgumentParser()
-parser.add_argument("ws")
-parser.add_argument("--mass", dest = "mass", action = "store", default = 125, type = int)
-parser.add_argument("--model_config", dest = "model_config", action = "store", default = "ModelConfig")
-parser.add_argument("--data", dest = "data", action = "store", default = "obsData")
-parser.add_argument("--precision", dest = "precision", action = "store", default = 0.005)
-parser.add_argument("--loglevel", dest = "loglevel", action = "store", default = "INFO")
-parser.add_argument("--num_total_slices", dest = "num_total_slices", action = "store", default = 1, type = int)
-parser.add_argument("--num_slice", dest = "num_slice", action = "store", default = 1, type = int)
-args = parser.parse_args()
+import plotCache
 
-ROOT.gROOT.SetBatch(True)
-ROOT.gROOT.ProcessLine(".L $WORKDIR/macros/runPulls.C+")
 
-print("Running runPulls")
-ROOT.runPulls("output/" + args.ws + "/workspaces/combined/" + str(args.mass) + ".root", "combined", args.model_config, args.data, args.ws, args.num_total_slices, args.num_slice)
+def getModelFingerprint(mc, data):
+    """ Fingerprint of what all the impacts depend on: the POIs, the set of NPs and the data, bin by bin """
+    h = hashlib.sha256()
+    h.update(",".join(poi.GetName() for poi in mc.GetParametersOfInterest()).encode())
+    h.update(",".join(sorted(np.GetName() for np in mc.GetNuisanceParameters())).encode())
+    h.update(f"{data.GetName()} {data.numEntries()} {data.sumEntries()!r}".encode())
+    # the bins of the data themselves, as new data can have the same binning and total
+    for i in range(data.numEntries()):
+        row = data.get(i)
+        values = [arg.getVal() if arg.InheritsFrom("RooAbsReal") else arg.getIndex() for arg in row]
+        h.update(repr((values, data.weight())).encode())
+    return h.hexdigest()
 
-# to compute the total uncertainty: need to do it only once
-if args.num_slice == 0:
-    ROOT.gROOT.ProcessLine(".L $WORKDIR/macros/runBreakdown.C+")
-    ROOT.runBreakdown("output/" + args.ws + "/workspaces/combined/" + str(args.mass) + ".root", "combined", args.model_config, args.data, "config/breakdown.xml", "add", "total", args.precision, 0.0, args.ws, args.loglevel)
 
+def getClientFingerprint(client, memo):
+    """ Fingerprint of a client of the NPs: its parameters, the values of the constant ones, and its templates
+
+    Most clients depend on many NPs, so the fingerprints are kept in memo by client name.
+    """
+    name = client.GetName()
+    if name not in memo:
+        h = hashlib.sha256(f"{client.ClassName()} {name}".encode())
+        for server in sorted(client.servers(), key = lambda s: s.GetName()):
+            h.update(server.GetName().encode())
+            if server.isConstant() and server.InheritsFrom("RooAbsReal"):
+                h.update(repr(server.getVal()).encode())
+        if client.InheritsFrom("PiecewiseInterpolation"):
+            # the value depends on the bin of the observable, so use the templates themselves
+            for func in [client.nominalHist()] + list(client.lowList()) + list(client.highList()):
+                if func.InheritsFrom("RooHistFunc"):
+                    dh = func.dataHist()
+                    h.update(repr([dh.weight(i) for i in range(dh.numEntries())]).encode())
+        memo[name] = h.hexdigest()
+    return memo[name]
+
+
+def getNPFingerprint(np, model, memo):
+    """ Fingerprint of the part of the model an NP acts on
+
+    It covers the NP itself and everything that directly depends on it: the templates and
+    normalisations it interpolates, its constraint term, and the other parameters these share.
+    """
+    h = hashlib.sha256(model.encode())
+    nominal = np.getVal()
+    h.update(f"{np.GetName()} {nominal!r} {np.getMin()!r} {np.getMax()!r} {np.getError()!r}".encode())
+    for client in sorted(np.clients(), key = lambda c: c.GetName()):
+        h.update(getClientFingerprint(client, memo).encode())
+        if not client.InheritsFrom("PiecewiseInterpolation"):
+            values = []
+            for val in [nominal - 1., nominal, nominal + 1.]:
+                np.setVal(val)
+                values.append(client.getVal())
+            np.setVal(nominal)
+            h.update(repr(values).encode())
+    return h.hexdigest()
+
+
+def getNPCost(np):
+    """ Guess of the time the impacts of an NP take, in units of fits
+
+    runPulls does a Minos fit (counted as two), the postfit variations and, except for the
+    unconstrained parameters, the prefit ones. NPs that enter many templates are correlated
+    with more of the others, which makes their fits slower.
+    """
+    name = np.GetName()
+    isNorm = "ATLAS_norm" in name or "gamma" in name or ("scale_" in name and "QCDscale_" not in name)
+    fits = 4. if isNorm else 6.
+    return fits * (1. + 0.1 * len(list(np.clients())))
+
+
+def getRankingOutputs(ws_file, model_config, data_name, outdir):
+    """ Files made by the ranking, as {(name, kind): (fingerprint, path)}, the keys of the NPs and POIs,
+    and the guessed cost of each NP
+
+    The impacts of an NP only need to be redone if its fingerprint changed. The POIs and
+    the total uncertainty depend on all of them.
+    """
+    f = ROOT.TFile(ws_file)
+    w = f.Get("combined")
+    mc = w.obj(model_config)
+    dataName = data_name.split(",")
+    if len(dataName) > 1:
+        w.loadSnapshot(dataName[1])
+    model = getModelFingerprint(mc, w.data(dataName[0]))
+
+    outputs = {}
+    costs = {}
+    memo = {}
+    # ATLAS_norm_All are not ranked by runPulls
+    nps = [(np.GetName(), "pulls") for np in mc.GetNuisanceParameters() if "ATLAS_norm_All" not in np.GetName()]
+    for key in nps:
+        np = mc.GetNuisanceParameters().find(key[0])
+        outputs[key] = (getNPFingerprint(np, model, memo), getOutputPath(outdir, key))
+        costs[key[0]] = getNPCost(np)
+    everything = hashlib.sha256(",".join(sorted(outputs[key][0] for key in nps)).encode()).hexdigest()
+    pois = [(poi.GetName(), "pulls") for poi in mc.GetParametersOfInterest()]
+    for key in pois:
+        outputs[key] = (everything, getOutputPath(outdir, key))
+    outputs[("total", "breakdown")] = (everything, getOutputPath(outdir, ("total", "breakdown")))
+    outputs[("fit", "result")] = (everything, getOutputPath(outdir, ("fit", "result")))
+    f.Close()
+    return outputs, nps, pois, costs
+
+
+def getOutputPath(outdir, key):
+    if key == ("fit", "result"):
+        return outdir + "ranking_fitresult.root"
+    return outdir + ("breakdown_add/" if key[1] == "breakdown" else "pulls/") + key[0] + ".root"
+
+
+def readPlan(plan_path, outdir):
+    """ The slices, outputs, keys of the NPs and POIs, and keys to redo of a plan written from planSlices,
+    see getRankingOutputs and getStaleKeys
+    """
+    with open(plan_path) as f:
+        plan = json.load(f)
+    outputs = {(name, kind): (fingerprint, getOutputPath(outdir, (name, kind)))
+               for kind, fingerprints in plan["fingerprints"].items() for name, fingerprint in fingerprints.items()}
+    nps = [(name, "pulls") for name in plan["nps"]]
+    pois = [(name, "pulls") for name in plan["pois"]]
+    stale = {tuple(key) for key in plan["stale"]}
+    return plan["slices"], outputs, nps, pois, stale
+
+
+def storeCorrelations(cache, fit_result_path, fingerprint):
+    """ Store which NPs are correlated in the unconditional fit saved by runPulls, as {NP: {NP: correlation}}
+
+    Correlations below 1% are left out.
+    """
+    if not os.path.isfile(fit_result_path):
+        return
+    infile = ROOT.TFile(fit_result_path)
+    fit_result = infile.Get("fitresult")
+    pars = fit_result.floatParsFinal()
+    names = [pars[i].GetName() for i in range(pars.getSize())]
+    corr = fit_result.correlationMatrix()
+    correlations = {}
+    for i in range(len(names)):
+        for j in range(len(names)):
+            if i != j and abs(corr(i, j)) > 0.01:
+                correlations.setdefault(names[i], {})[names[j]] = corr(i, j)
+    infile.Close()
+    cache.write(fingerprint, [("fit", "correlations", json.dumps(correlations).encode())])
+
+
+def getStaleKeys(cache, outputs, nps, correlation_threshold):
+    """ Keys of the outputs that need to be redone
+
+    These are the ones whose fingerprint changed, and the NPs that were correlated by more than
+    correlation_threshold with a changed NP in the last fit: the impacts come from fits of the
+    whole model, so they change with the NPs they are correlated with.
+    """
+    stored = cache.contexts()
+    stale = {key for key, (fingerprint, path) in outputs.items() if stored.get(key) != fingerprint}
+    correlations = json.loads(cache.read(regions = ["fit"], components = ["correlations"]).get("fit", {}).get("correlations", b"{}"))
+    for key in nps:
+        if key in stale:
+            continue
+        correlated = correlations.get(key[0], {})
+        if any((name, "pulls") in stale and abs(rho) > correlation_threshold for name, rho in correlated.items()):
+            stale.add(key)
+    return stale
+
+
+def storeOutputs(cache, outputs, keys):
+    """ Store the files of keys in the cache, with the fingerprint they were made with
+
+    The time runPulls took for each NP is stored separately, and kept when the NP changes.
+    """
+    for key in keys:
+        fingerprint, path = outputs[key]
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            entries = [(key[0], key[1], f.read())]
+        infile = ROOT.TFile(path)
+        fit_time = infile.Get("fit_time")
+        if fit_time:
+            entries.append((key[0], "time", repr(fit_time.GetVal()).encode()))
+        infile.Close()
+        cache.write(fingerprint, entries)
+
+
+def getCachePath(ws, cache_path = None):
+    return cache_path if cache_path is not None else "output/" + ws + "/root-files/ranking.db"
+
+
+def getJobCachePath(cache_path, num_slice):
+    """ File in which one of several jobs stores what it computes, such that no two jobs write to the same file """
+    root, ext = os.path.splitext(cache_path)
+    return f"{root}.job{num_slice}{ext}"
+
+
+def mergeJobCaches(cache_path):
+    """ Move what the jobs of earlier runs stored in their own files into cache_path
+
+    Must only be called when no job of the ranking is running.
+    """
+    root, ext = os.path.splitext(cache_path)
+    job_paths = sorted(glob.glob(glob.escape(root) + ".job*" + ext))
+    if len(job_paths) == 0:
+        return
+    cache = plotCache.KeyedCache(cache_path)
+    for path in job_paths:
+        cache.merge(path)
+        os.remove(path)
+    cache.close()
+
+
+def planSlices(ws, mass, model_config, data, number_jobs, cache_path = None, job_runtime = None, correlation_threshold = 0.2):
+    """ Share the NPs whose impacts need to be redone among at most number_jobs jobs of about equal cost
+
+    The cost of an NP is the time runPulls took for it in an earlier run, or else the guess of
+    getNPCost, turned into seconds with the NPs that have both. The most expensive NPs are placed
+    first, each in the job with the least work so far.
+    If job_runtime (in seconds) is given and earlier fit times are known, only as many jobs as
+    needed to stay below it are made. Returns the plan to be given to the jobs with --slices
+    (see readPlan): the list of NPs of each job, the fingerprints and what needs to be redone
+    (see getStaleKeys), such that the jobs do not need to compute them again.
+    """
+    ws_file = "output/" + ws + "/workspaces/combined/" + str(mass) + ".root"
+    outdir = "output/" + ws + "/root-files/"
+    mergeJobCaches(getCachePath(ws, cache_path))
+    cache = plotCache.KeyedCache(getCachePath(ws, cache_path))
+    outputs, nps, pois, costs = getRankingOutputs(ws_file, model_config, data, outdir)
+    stale_keys = getStaleKeys(cache, outputs, nps, correlation_threshold)
+    times = {name: float(entries["time"]) for name, entries in cache.read(components = ["time"]).items() if name in costs}
+    cache.close()
+
+    stale = [key[0] for key in nps if key in stale_keys]
+    scales = sorted(times[name] / costs[name] for name in times)
+    scale = scales[len(scales) // 2] if len(scales) > 0 else 1.
+    cost = {name: times.get(name, scale * costs[name]) for name in stale}
+
+    number_slices = number_jobs
+    if job_runtime is not None and len(times) > 0:
+        number_slices = min(number_slices, math.ceil(sum(cost.values()) / job_runtime))
+    # job 0 is needed in any case, to put back the reused impacts
+    number_slices = max(1, min(number_slices, len(stale)))
+
+    slices = [[] for cur in range(number_slices)]
+    loads = [0.] * number_slices
+    for name in sorted(stale, key = lambda name: (-cost[name], name)):
+        ind = loads.index(min(loads))
+        slices[ind].append(name)
+        loads[ind] += cost[name]
+
+    unit = "s" if len(times) > 0 else "fits"
+    print(f"Sharing {len(stale)} NPs out of {len(nps)} among {number_slices} jobs")
+    if len(stale) > 0:
+        print(f"Expected cost per job: {min(loads):.3g} - {max(loads):.3g} {unit}")
+    fingerprints = {}
+    for key, (fingerprint, path) in outputs.items():
+        fingerprints.setdefault(key[1], {})[key[0]] = fingerprint
+    return {"slices": slices, "nps": [key[0] for key in nps], "pois": [key[0] for key in pois], "fingerprints": fingerprints,
+            "stale": sorted(stale_keys)}
+
+
+def main(args):
+    ROOT.gROOT.SetBatch(True)
+
+    ws_file = "output/" + args.ws + "/workspaces/combined/" + str(args.mass) + ".root"
+    outdir = "output/" + args.ws + "/root-files/"
+    os.system("mkdir -vp " + outdir + "pulls " + outdir + "breakdown_add")
+
+    # reuse what the earlier runs stored, but with several jobs each one stores what it computes in its own
+    # file: SQLite cannot be trusted with concurrent writers on network file systems. planSlices merges them
+    cache_path = getCachePath(args.ws, args.cache)
+    if args.num_total_slices == 1:
+        mergeJobCaches(cache_path)
+    cache = plotCache.KeyedCache(cache_path)
+    job_cache = cache if args.num_total_slices == 1 else plotCache.KeyedCache(getJobCachePath(cache_path, args.num_slice))
+    # the first job also puts back what is reused, and does the POIs and the total uncertainty.
+    # --num_slice counts from 0, but a single job is the first one whatever it is given
+    first_job = args.num_slice == 0 or args.num_total_slices == 1
+    if args.slices is not None:
+        slices, outputs, nps, pois, stale = readPlan(args.slices, outdir)
+    else:
+        outputs, nps, pois, costs = getRankingOutputs(ws_file, args.model_config, args.data, outdir)
+        stale = getStaleKeys(cache, outputs, nps, args.correlation_threshold)
+    fresh = [key for key in outputs if key not in stale]
+
+    # runPulls does the POIs in any case, only the NPs are shared among the jobs. Without a plan from
+    # planSlices, the slices are made from all the NPs, such that they do not depend on what the other
+    # jobs already stored
+    stale_nps = [key for key in nps if key not in fresh]
+    if args.slices is not None:
+        slice_nps = [key for key in stale_nps if key[0] in slices[args.num_slice % len(slices)]]
+    else:
+        slice_nps = [key for i, key in enumerate(sorted(nps))
+                     if i % args.num_total_slices == args.num_slice % args.num_total_slices and key not in fresh]
+    print(f"{len(stale_nps)} NPs out of {len(nps)} to redo, {len(slice_nps)} of them done in this job")
+
+    # only one job puts back what is reused
+    if first_job:
+        blobs = cache.read(regions = [key[0] for key in fresh], components = ["pulls", "breakdown", "result"])
+        for key in fresh:
+            if key[1] in blobs.get(key[0], {}):
+                with open(outputs[key][1], "wb") as f:
+                    f.write(blobs[key[0]][key[1]])
+
+    redo_fit = first_job and ("fit", "result") not in fresh
+    if len(slice_nps) > 0 or (first_job and any(key not in fresh for key in pois)) or redo_fit:
+        ROOT.gROOT.ProcessLine(".L $WORKDIR/macros/runPulls.C+")
+
+        print("Running runPulls")
+        # only one job saves the unconditional fit, to know the correlations of the NPs in the next run
+        fit_result_path = outputs[("fit", "result")][1] if redo_fit else ""
+        ROOT.runPulls(ws_file, "combined", args.model_config, args.data, args.ws, args.num_total_slices, args.num_slice,
+                      ",".join(key[0] for key in slice_nps), 0.005, True, "DEBUG", fit_result_path)
+        storeOutputs(job_cache, outputs, slice_nps + (pois if first_job else []))
+        if redo_fit:
+            storeOutputs(job_cache, outputs, [("fit", "result")])
+            storeCorrelations(job_cache, fit_result_path, outputs[("fit", "result")][0])
+
+    # to compute the total uncertainty: need to do it only once
+    if first_job and ("total", "breakdown") not in fresh:
+        ROOT.gROOT.ProcessLine(".L $WORKDIR/macros/runBreakdown.C+")
+        ROOT.runBreakdown(ws_file, "combined", args.model_config, args.data, "config/breakdown.xml", "add", "total", args.precision, 0.0, args.ws, args.loglevel)
+        storeOutputs(job_cache, outputs, [("total", "breakdown")])
+    job_cache.close()
+    cache.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("ws")
+    parser.add_argument("--mass", dest = "mass", action = "store", default = 125, type = int)
+    parser.add_argument("--model_config", dest = "model_config", action = "store", default = "ModelConfig")
+    parser.add_argument("--data", dest = "data", action = "store", default = "obsData")
+    parser.add_argument("--precision", dest = "precision", action = "store", default = 0.005)
+    parser.add_argument("--loglevel", dest = "loglevel", action = "store", default = "INFO")
+    parser.add_argument("--num_total_slices", dest = "num_total_slices", action = "store", default = 1, type = int)
+    parser.add_argument("--num_slice", dest = "num_slice", action = "store", default = 1, type = int)
+    parser.add_argument("--cache", dest = "cache", action = "store", default = None,
+                        help = "impacts computed by previous runs (default: output/{ws}/root-files/ranking.db)")
+    parser.add_argument("--correlation_threshold", dest = "correlation_threshold", action = "store", default = 0.2, type = float,
+                        help = "also redo the NPs correlated by more than this with a changed NP in the last fit")
+    parser.add_argument("--slices", dest = "slices", action = "store", default = None,
+                        help = "json file with the NPs of each slice and their fingerprints, as made by planSlices")
+    main(parser.parse_args())